@@ -1,14 +1,39 @@
+import hashlib
+import json
 import os
 import shutil
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
+
+from tracing import traced
+
+# スナップショットの保存先（対象フォルダと同じ階層に作る）
+BACKUP_STORE_SUFFIX = "_backup_store"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 class BackupManager:
-    def __init__(self, target_dir: str):
+    def __init__(self, target_dir: str, max_workers: int = 4, use_hardlinks: bool = False):
         self.target_dir = target_dir
         self.backup_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.max_workers = max_workers
+        # ハードリンクはコピーより速いが、元の画像をその場で書き換えるとバックアップも変わってしまう
+        self.use_hardlinks = use_hardlinks
+        folder = os.path.abspath(target_dir)
+        self.store_dir = os.path.join(os.path.dirname(folder), os.path.basename(folder) + BACKUP_STORE_SUFFIX)
+        self.objects_dir = os.path.join(self.store_dir, "objects")
+        self.snapshots_dir = os.path.join(self.store_dir, "snapshots")
 
+    @traced("backup.zip")
     def create_zip_backup(self) -> Optional[str]:
         """
         対象フォルダのZIPバックアップを作成
@@ -35,6 +60,110 @@ class BackupManager:
             print(f"バックアップ作成エラー: {str(e)}")
             return None
 
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def latest_snapshot(self) -> Optional[str]:
+        """最新のスナップショット（マニフェスト）のパス、なければNone"""
+        if not os.path.isdir(self.snapshots_dir):
+            return None
+        manifests = sorted(name for name in os.listdir(self.snapshots_dir) if name.endswith(".json"))
+        return os.path.join(self.snapshots_dir, manifests[-1]) if manifests else None
+
+    def _new_manifest_path(self) -> str:
+        """
+        作成するスナップショットのマニフェストのパス（同じ秒に何度作っても上書きしないよう、マイクロ秒まで付ける）
+        名前の順がそのまま作成順になるので、latest_snapshotは名前で並べるだけでよい
+        """
+        created = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        manifest_path = os.path.join(self.snapshots_dir, f"{created}.json")
+        counter = 1
+        while os.path.exists(manifest_path):
+            manifest_path = os.path.join(self.snapshots_dir, f"{created}_{counter}.json")
+            counter += 1
+        return manifest_path
+
+    def _load_manifest(self, manifest_path: Optional[str]) -> Dict[str, dict]:
+        if not manifest_path:
+            return {}
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)["files"]
+
+    def _store_file(self, file_path: str, previous: Optional[dict]) -> dict:
+        """1ファイルを保存し、マニフェストに書く内容を返す（同じ内容が保存済みならコピーしない）"""
+        st = os.stat(file_path)
+        if previous and previous["size"] == st.st_size and previous["mtime_ns"] == st.st_mtime_ns \
+                and os.path.exists(self._object_path(previous["hash"])):
+            # 前回から変わっていないファイルはハッシュも計算しない
+            return previous
+        digest = _file_hash(file_path)
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            linked = False
+            if self.use_hardlinks:
+                try:
+                    os.link(file_path, object_path)
+                    linked = True
+                except (OSError, NotImplementedError):
+                    pass
+            if not linked:
+                # 書き込み途中のファイルが残らないように一時ファイルに書いてから置き換える
+                fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(object_path))
+                os.close(fd)
+                shutil.copyfile(file_path, tmp_path)
+                os.replace(tmp_path, object_path)
+        return {"hash": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    @traced("backup.snapshot")
+    def create_snapshot(self) -> Optional[str]:
+        """
+        対象フォルダのスナップショットを作成（同じ内容のファイルは1つだけ保存し、新しいか変わったファイルだけを書き込む）
+        Returns:
+            str: スナップショット（マニフェスト）のパス、失敗時はNone
+        """
+        try:
+            previous_files = self._load_manifest(self.latest_snapshot())
+            relpaths = []
+            for root, dirs, files in os.walk(self.target_dir):
+                for file in files:
+                    relpaths.append(os.path.relpath(os.path.join(root, file), self.target_dir).replace(os.sep, "/"))
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                entries = executor.map(
+                    lambda rel: self._store_file(os.path.join(self.target_dir, rel), previous_files.get(rel)), relpaths)
+                files = dict(zip(relpaths, entries))
+
+            os.makedirs(self.snapshots_dir, exist_ok=True)
+            manifest_path = self._new_manifest_path()
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": os.path.splitext(os.path.basename(manifest_path))[0], "source": os.path.abspath(self.target_dir), "files": files},
+                          f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, manifest_path)
+            return manifest_path
+
+        except Exception as e:
+            print(f"スナップショット作成エラー: {str(e)}")
+            return None
+
+    def _restore_snapshot(self, manifest_path: str) -> None:
+        """マニフェストに記録されたファイルを戻す（内容が同じファイルは書き込まない）"""
+        files = self._load_manifest(manifest_path)
+
+        def restore_file(item):
+            relpath, entry = item
+            file_path = os.path.join(self.target_dir, *relpath.split("/"))
+            if os.path.exists(file_path) and os.path.getsize(file_path) == entry["size"] \
+                    and _file_hash(file_path) == entry["hash"]:
+                return
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            shutil.copyfile(self._object_path(entry["hash"]), file_path)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(restore_file, files.items()))
+
+    @traced("backup.csv")
     def backup_csv_file(self, csv_path: str) -> Optional[str]:
         """
         CSVファイルのバックアップを作成
@@ -54,9 +183,10 @@ class BackupManager:
             print(f"CSVバックアップ作成エラー: {str(e)}")
             return None
 
+    @traced("backup.restore")
     def restore_from_backup(self, backup_path: str) -> bool:
         """
-        バックアップから復元（ZIPの場合）
+        バックアップから復元（スナップショットのマニフェスト・ZIP・単一ファイル）
         Returns:
             bool: 復元成功時True
         """
@@ -64,7 +194,10 @@ class BackupManager:
             if not os.path.exists(backup_path):
                 return False
 
-            if backup_path.endswith('.zip'):
+            if backup_path.endswith('.json'):
+                # スナップショットからの復元（スナップショットの後に追加されたファイルは削除しない）
+                self._restore_snapshot(backup_path)
+            elif backup_path.endswith('.zip'):
                 # ZIPファイルからの復元
                 with zipfile.ZipFile(backup_path, 'r') as zipf:
                     zipf.extractall(self.target_dir)
@@ -77,4 +210,4 @@ class BackupManager:
 
         except Exception as e:
             print(f"復元エラー: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
@@ -0,0 +1,244 @@
+#急がないフォルダをOpenAIのBatch APIでまとめて処理する部分
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from batch_journal import BatchJournal
+from batch_processor import (BatchExtractor, ExtractionResult, DUPLICATES_LOG_NAME, ERROR_LOG_NAME, RESULT_CSV_NAME,
+                             REFUSAL_MARKER, list_image_files, merge_results_csv, review_result, write_duplicates_log,
+                             write_error_log)
+from quality_gate import REVIEW_LIST_NAME, QualityReport, write_review_list
+from client_pool import get_openai_client
+from image_preprocessor import preprocess_image, guess_image_mime
+from rate_limiter import call_with_retry
+from text_extractor import MODEL_NAME, SYSTEM_ROLE_CONTENT, create_message, encode_image_bytes
+
+BATCH_STATE_NAME = "batch_state_RyoSyuSyo.json"
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch APIの入力ファイルの上限（200MB）より少し小さい値で分割する
+MAX_BATCH_FILE_BYTES = 180 * 1024 * 1024
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchApiRunner:
+    """
+    フォルダ内の画像をJSONLにまとめてBatch APIに投げ、終わったらCSVにファイル名で反映する
+    提出したバッチのIDはフォルダ内に保存するので、途中で終了しても次回は結果の待機から再開する
+    """
+    def __init__(self, extractor: BatchExtractor, poll_interval: float = 30.0,
+                 max_file_bytes: int = MAX_BATCH_FILE_BYTES):
+        self.extractor = extractor
+        self.poll_interval = poll_interval
+        self.max_file_bytes = max_file_bytes
+
+    def _client(self):
+        return get_openai_client(self.extractor.api_key, self.extractor.base_url)
+
+    def _state_path(self, folder: str) -> str:
+        return os.path.join(folder, BATCH_STATE_NAME)
+
+    def load_state(self, folder: str) -> Optional[dict]:
+        """提出済みで、まだ結果を反映していないバッチの情報を返す"""
+        path = self._state_path(folder)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, folder: str, state: dict) -> None:
+        tmp_path = self._state_path(folder) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self._state_path(folder))
+
+    def _image_urls(self, paths: List[str]):
+        """画像をdata URLにして順に返す（縮小する場合は別プロセスで行う）"""
+        if self.extractor.max_size is None:
+            for path in paths:
+                with open(path, "rb") as f:
+                    yield path, encode_image_bytes(f.read(), guess_image_mime(path))
+            return
+        with ProcessPoolExecutor(max_workers=self.extractor.preprocess_workers) as pool:
+            images = pool.map(preprocess_image, paths, [self.extractor.max_size] * len(paths),
+                              [self.extractor.jpeg_quality] * len(paths), [self.extractor.auto_crop] * len(paths))
+            for path, image in zip(paths, images):
+                yield path, encode_image_bytes(image.data, image.mime)
+
+    def build_request_line(self, image_path: str, image_url: str) -> str:
+        """1枚分のリクエストをBatch APIの入力形式（JSONLの1行）にする"""
+        request = {
+            "custom_id": os.path.basename(image_path),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": MODEL_NAME,
+                "messages": create_message(SYSTEM_ROLE_CONTENT, self.extractor.prompt_template, image_url),
+                "temperature": 0,
+            },
+        }
+        return json.dumps(request, ensure_ascii=False) + "\n"
+
+    def _upload_and_create(self, lines: List[str], files: List[str]) -> dict:
+        client = self._client()
+        payload = "".join(lines).encode("utf-8")
+        input_file = client.files.create(file=("batch_input.jsonl", io.BytesIO(payload)), purpose="batch")
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+        return {"id": batch.id, "files": files}
+
+    def submit(self, folder: str, resume: bool = True) -> dict:
+        """
+        未処理の画像をバッチとして提出する
+        入力ファイルの上限を超える場合は複数のバッチに分ける
+        画質チェックに通らない画像とほぼ同じ画像は送らず、結果を反映するときに要確認・同じ画像の結果として扱う
+        """
+        journal = BatchJournal.for_folder(folder, self.extractor.run_key())
+        finished = journal.completed(folder) if resume else {}
+        paths = [p for p in list_image_files(folder) if os.path.basename(p) not in finished]
+        paths, rejected, copies = self.extractor.screen(paths)
+
+        state = {
+            "run_key": self.extractor.run_key(),
+            "batches": [],
+            "rejected": [{"file": os.path.basename(r.image_path), "metrics": r.metrics, "reasons": r.reasons}
+                         for r in rejected],
+            "duplicates": {os.path.basename(path): os.path.basename(representative)
+                           for representative, group in copies.items() for path in group},
+        }
+        lines: List[str] = []
+        files: List[str] = []
+        size = 0
+        for path, image_url in self._image_urls(paths):
+            line = self.build_request_line(path, image_url)
+            line_bytes = len(line.encode("utf-8"))
+            if lines and size + line_bytes > self.max_file_bytes:
+                state["batches"].append(self._upload_and_create(lines, files))
+                lines, files, size = [], [], 0
+            lines.append(line)
+            files.append(os.path.basename(path))
+            size += line_bytes
+        if lines:
+            state["batches"].append(self._upload_and_create(lines, files))
+
+        if state["batches"] or state["rejected"]:
+            self._save_state(folder, state)
+        return state
+
+    def wait(self, folder: str, progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, object]:
+        """提出済みのバッチがすべて終わるまで待つ"""
+        state = self.load_state(folder)
+        if state is None:
+            return {}
+        client = self._client()
+        while True:
+            batches = {entry["id"]: call_with_retry(lambda: client.batches.retrieve(entry["id"]))
+                       for entry in state["batches"]}
+            if progress_callback:
+                done = sum(b.request_counts.completed + b.request_counts.failed for b in batches.values() if b.request_counts)
+                total = sum(b.request_counts.total for b in batches.values() if b.request_counts)
+                progress_callback(done, total)
+            if all(b.status in FINISHED_STATUSES for b in batches.values()):
+                return batches
+            time.sleep(self.poll_interval)
+
+    def _read_file(self, file_id: Optional[str]) -> List[dict]:
+        if not file_id:
+            return []
+        content = self._client().files.content(file_id).text
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    def collect(self, folder: str, batches: Dict[str, object]) -> List[ExtractionResult]:
+        """バッチの出力ファイルを読み、ファイル名ごとの結果にする"""
+        state = self.load_state(folder)
+        results = []
+        for entry in state["batches"]:
+            batch = batches[entry["id"]]
+            outputs = {}
+            for record in self._read_file(batch.output_file_id) + self._read_file(batch.error_file_id):
+                outputs[record["custom_id"]] = record
+            for name in entry["files"]:
+                result = ExtractionResult(0, os.path.join(folder, name))
+                record = outputs.get(name)
+                if record is None:
+                    result.error = f"バッチが完了しませんでした（{batch.status}）"
+                elif record.get("error") or record["response"]["status_code"] != 200:
+                    result.error = json.dumps(record.get("error") or record["response"]["body"], ensure_ascii=False)
+                else:
+                    choices = record["response"]["body"].get("choices") or []
+                    result.text = choices[0]["message"]["content"] if choices else "No data extracted"
+                results.append(result)
+
+        # 送らなかった画像は、要確認の結果か、代表の画像と同じ結果にする
+        copies: Dict[str, List[str]] = {}
+        for name, representative in state.get("duplicates", {}).items():
+            copies.setdefault(os.path.join(folder, representative), []).append(os.path.join(folder, name))
+        for result in list(results):
+            results.extend(self.extractor.link_duplicates(result, copies.get(result.image_path, [])))
+        results.extend(review_result(report) for report in self._rejected_reports(folder, state))
+        return results
+
+    def _rejected_reports(self, folder: str, state: dict) -> List[QualityReport]:
+        return [QualityReport(os.path.join(folder, entry["file"]), entry["metrics"], entry["reasons"])
+                for entry in state.get("rejected", [])]
+
+    def merge(self, folder: str, results: List[ExtractionResult]) -> None:
+        """結果をジャーナル・キャッシュ・CSVに反映する"""
+        journal = BatchJournal.for_folder(folder, self.extractor.run_key())
+        cache = self.extractor.cache
+        for result in results:
+            if result.review_reason:
+                # 要確認の画像は撮り直しやしきい値の変更に備えて、次回もチェックし直す
+                continue
+            journal.append(result.image_path, result.text, result.error, result.duplicate_of)
+            if cache is not None and result.ok and REFUSAL_MARKER not in result.text:
+                with open(result.image_path, "rb") as f:
+                    cache.put(self.extractor.cache_key(f.read()), self.extractor.prompt_template, result.text, MODEL_NAME)
+        merge_results_csv(os.path.join(folder, RESULT_CSV_NAME), results)
+        write_error_log(os.path.join(folder, ERROR_LOG_NAME), results)
+        write_duplicates_log(os.path.join(folder, DUPLICATES_LOG_NAME), results)
+        write_review_list(os.path.join(folder, REVIEW_LIST_NAME), self._rejected_reports(folder, self.load_state(folder)))
+        self.extractor.update_index(folder, results)
+        journal.compact()
+        os.remove(self._state_path(folder))
+
+    def cancel(self, folder: str) -> int:
+        """
+        提出済みのバッチのうち終わっていないものを取り消し、提出の記録を消す（結果は反映しない）
+        Returns:
+            int: 取り消したバッチの数
+        """
+        state = self.load_state(folder)
+        if state is None:
+            return 0
+        client = self._client()
+        cancelled = 0
+        for entry in state["batches"]:
+            batch = call_with_retry(lambda: client.batches.retrieve(entry["id"]))
+            if batch.status not in FINISHED_STATUSES:
+                call_with_retry(lambda: client.batches.cancel(entry["id"]))
+                cancelled += 1
+        os.remove(self._state_path(folder))
+        return cancelled
+
+    def run(self, folder: str, resume: bool = True,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> List[ExtractionResult]:
+        """
+        提出（未提出の場合のみ）→完了待ち→CSVへの反映までを行う
+        テンプレートや前処理の設定を変えた後で、前の設定で提出したバッチが残っている場合はValueErrorにする
+        （新しく提出すると前のバッチの記録が消え、料金のかかった結果を受け取れなくなるため）
+        """
+        state = self.load_state(folder)
+        if state is not None and state.get("run_key") != self.extractor.run_key():
+            raise ValueError("前回と違う設定（テンプレート・縮小など）で提出したバッチが残っています。"
+                             "設定を戻して実行すると前回の結果を反映できます。"
+                             "前回のバッチを取り消す場合は --cancel-batch を付けて実行してください")
+        if state is None:
+            state = self.submit(folder, resume)
+        if not state["batches"] and not state.get("rejected"):
+            return []
+        batches = self.wait(folder, progress_callback)
+        results = self.collect(folder, batches)
+        self.merge(folder, results)
+        return results
@@ -0,0 +1,108 @@
+#一括処理の途中経過を記録して、やり直し時に続きから処理するための部分
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Tuple
+
+JOURNAL_NAME = "results_RyoSyuSyo.journal"
+
+
+def file_signature(image_path: str) -> Optional[dict]:
+    """ファイルが変わっていないかを判定するためのサイズと更新日時"""
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class BatchJournal:
+    """
+    処理が終わった画像を1行ずつ追記するジャーナル（JSON Lines）
+    途中で落ちても書き終わった行までは残るので、再実行時は残りだけを処理すればよい
+    """
+    def __init__(self, path: str, run_key: str = ""):
+        self.path = path
+        # テンプレートや前処理の設定が変わった場合は別の実行とみなすためのキー
+        self.run_key = run_key
+
+    @classmethod
+    def for_folder(cls, folder: str, run_key: str = "") -> "BatchJournal":
+        return cls(os.path.join(folder, JOURNAL_NAME), run_key)
+
+    def load(self) -> Dict[str, dict]:
+        """ファイル名ごとに最後に記録された内容を返す"""
+        entries: Dict[str, dict] = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた最後の行は無視する
+                    continue
+                entries[entry["file"]] = entry
+        return entries
+
+    def completed(self, folder: str) -> Dict[str, dict]:
+        """
+        処理済みで、その後ファイルが変わっていないものだけを返す
+        失敗したもの、設定が変わったもの、ファイルが書き換えられたものは含まない
+        """
+        done = {}
+        for name, entry in self.load().items():
+            if entry.get("status") != "done" or entry.get("run_key") != self.run_key:
+                continue
+            signature = file_signature(os.path.join(folder, name))
+            if signature is None:
+                continue
+            if signature["size"] == entry.get("size") and signature["mtime_ns"] == entry.get("mtime_ns"):
+                done[name] = entry
+        return done
+
+    def moved(self, folder: str) -> Dict[Tuple[int, int], dict]:
+        """
+        処理済みで、その後ファイルが見当たらなくなったものを (サイズ, 更新日時) ごとに返す
+        リネームしたファイルはサイズも更新日時も変わらないので、新しい名前のファイルとこれで対応づけられる
+        """
+        moved = {}
+        for name, entry in self.load().items():
+            if entry.get("status") != "done" or entry.get("run_key") != self.run_key or "size" not in entry:
+                continue
+            if not os.path.exists(os.path.join(folder, name)):
+                moved[(entry["size"], entry["mtime_ns"])] = entry
+        return moved
+
+    def append(self, image_path: str, text: Optional[str] = None, error: Optional[str] = None,
+               duplicate_of: Optional[str] = None) -> None:
+        """
+        1枚分の結果を追記する（書き込むたびにディスクへ反映させる）
+        duplicate_ofはほぼ同じ画像の結果を使った場合のその画像のパス（再開したときも同じレシートとして扱う）
+        """
+        entry = {
+            "file": os.path.basename(image_path),
+            "status": "failed" if error is not None else "done",
+            "run_key": self.run_key,
+            "text": text,
+            "error": error,
+        }
+        if duplicate_of is not None:
+            entry["duplicate_of"] = os.path.basename(duplicate_of)
+        entry.update(file_signature(image_path) or {})
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self) -> None:
+        """同じファイルの古い記録を削除してジャーナルを小さくする"""
+        entries = self.load()
+        if not entries:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,661 @@
+#フォルダ内の画像をまとめてopenAIに投げる部分
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from batch_journal import BatchJournal, file_signature
+from duplicate_detector import DEFAULT_MAX_DISTANCE, find_duplicates
+from quality_gate import REVIEW_LIST_NAME, QualityGate, QualityReport, write_review_list
+from receipt_index import ReceiptIndex
+from run_metrics import PROMETHEUS_NAME, RUN_REPORT_NAME, build_run_report, write_prometheus, write_run_report
+from client_pool import configure_http_client
+from rate_limiter import AdaptiveRateLimiter, DEFAULT_MAX_RETRIES, call_with_retry, estimate_request_tokens
+from image_preprocessor import DEFAULT_JPEG_QUALITY, preprocess_image
+from process_pool import process_pool
+from result_cache import ResultCache, template_digest
+from tracing import instant, span, traced
+from text_extractor import (MODEL_NAME, SYSTEM_ROLE_CONTENT, ensure_settings_file, get_current_template, get_gpt_openai_apikey,
+                            gen_chat_response_with_gpt4, gen_chat_response_for_images, split_packed_response,
+                            encode_image, encode_image_bytes)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+RESULT_CSV_NAME = "results_RyoSyuSyo.csv"
+ERROR_LOG_NAME = "error_log_RyoSyuSyo.txt"
+DUPLICATES_LOG_NAME = "duplicates_RyoSyuSyo.txt"
+DEFAULT_MAX_WORKERS = 4
+REFUSAL_MARKER = "申し訳ありません"
+
+
+class ExtractionResult:
+    """1枚分の抽出結果"""
+    def __init__(self, index: int, image_path: str, text: Optional[str] = None, error: Optional[str] = None,
+                 cached: bool = False, resumed: bool = False):
+        self.index = index
+        self.image_path = image_path
+        self.text = text
+        self.error = error
+        self.cached = cached
+        self.resumed = resumed   # 前回の実行で処理済みだったもの
+        self.retries = 0         # 429やタイムアウトで再試行した回数
+        self.original_bytes = 0  # 縮小して送った画像の元のサイズ（キャッシュの結果を使った場合などは0のまま）
+        self.sent_bytes = 0      # 縮小して実際にAPIへ送った画像のサイズ
+        self.duplicate_of: Optional[str] = None  # ほぼ同じ画像の結果を使った場合は、その画像のパス
+        self.review_reason: Optional[str] = None  # 画質チェックでAPIに送らなかった場合は、その理由
+        self.metrics: Dict[str, float] = {}       # 段階ごとの所要時間・送信量・トークン数（run_metricsで集計する）
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.sent_bytes
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.image_path)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def list_image_files(folder: str) -> List[str]:
+    """フォルダ内の画像ファイルをファイル名順で返す"""
+    files = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            files.append(entry.path)
+    return sorted(files, key=lambda p: os.path.basename(p))
+
+
+def result_lines(text: str) -> List[str]:
+    """抽出テキストからCSVに書く行を取り出す（空行やコードブロックの囲みは除く）"""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("```"):
+            continue
+        lines.append(line)
+    return lines
+
+
+@traced("csv.write")
+def write_results_csv(csv_path: str, results: Iterable[ExtractionResult]) -> int:
+    """
+    抽出結果をファイル名順でCSVに書き出す
+    Returns:
+        int: 書き込んだ行数
+    """
+    with open(csv_path, 'w', encoding='shift_jis', errors='replace', newline='') as f:
+        return _write_result_rows(f, sorted(results, key=lambda r: r.filename))
+
+
+@traced("csv.write")
+def append_results_csv(csv_path: str, results: Iterable[ExtractionResult]) -> int:
+    """
+    抽出結果をCSVの末尾に追記する（フォルダ監視などで1件ずつ書き足す場合）
+    Returns:
+        int: 書き込んだ行数
+    """
+    with open(csv_path, 'a', encoding='shift_jis', errors='replace', newline='') as f:
+        count = _write_result_rows(f, results)
+        f.flush()
+        os.fsync(f.fileno())
+    return count
+
+
+@traced("csv.write")
+def merge_results_csv(csv_path: str, results: Iterable[ExtractionResult]) -> int:
+    """
+    既存のCSVのうち、同じファイル名の行だけを新しい結果で置き換えてファイル名順に書き直す
+    Returns:
+        int: 書き込んだ行数
+    """
+    results = [r for r in results if r.ok]
+    replaced = {r.filename for r in results}
+    rows = []
+    if os.path.exists(csv_path):
+        with open(csv_path, 'rb') as f:
+            raw = f.read()
+        try:
+            content = raw.decode('shift_jis')
+        except UnicodeDecodeError:
+            content = raw.decode('utf-8')
+        for line in content.splitlines():
+            if line and line.split(",", 1)[0] not in replaced:
+                rows.append(line)
+    for result in results:
+        rows.extend(f"{result.filename},{line}" for line in result_lines(result.text))
+
+    # 同じファイルの行の並び順は変えずにファイル名順にする
+    rows.sort(key=lambda line: line.split(",", 1)[0])
+    with open(csv_path, 'w', encoding='shift_jis', errors='replace', newline='') as f:
+        for line in rows:
+            f.write(line + "\r\n")
+    return len(rows)
+
+
+def _write_result_rows(f, results: Iterable[ExtractionResult]) -> int:
+    count = 0
+    for result in results:
+        if not result.ok:
+            continue
+        for line in result_lines(result.text):
+            f.write(f"{result.filename},{line}\r\n")
+            count += 1
+    return count
+
+
+def write_error_log(log_path: str, results: Iterable[ExtractionResult]) -> None:
+    """失敗した画像の一覧をログファイルに書き出す"""
+    failed = [r for r in results if not r.ok]
+    if not failed:
+        return
+    with open(log_path, 'w', encoding='utf-8') as f:
+        for result in sorted(failed, key=lambda r: r.filename):
+            f.write(f"{result.filename}: {result.error}\n")
+
+
+def review_result(report: QualityReport) -> ExtractionResult:
+    """画質チェックで除外した画像を、APIに送らなかった結果として表す"""
+    result = ExtractionResult(0, report.image_path, error=f"画質チェックで除外（{report.describe()}）")
+    result.review_reason = report.describe()
+    return result
+
+
+def summarize_saved_calls(results: Iterable[ExtractionResult]) -> Dict[str, int]:
+    """APIを呼ばずに済んだ画像の件数を理由ごとに数える"""
+    summary = {"quality_gate": 0, "duplicates": 0, "cache": 0, "resumed": 0}
+    for result in results:
+        if result.review_reason:
+            summary["quality_gate"] += 1
+        elif result.resumed:
+            summary["resumed"] += 1
+        elif result.duplicate_of:
+            summary["duplicates"] += 1
+        elif result.cached:
+            summary["cache"] += 1
+    return summary
+
+
+def format_saved_calls(results: Iterable[ExtractionResult]) -> str:
+    summary = summarize_saved_calls(results)
+    return (f"APIの呼び出しを省略: {sum(summary.values())}件"
+            f"（画質チェック {summary['quality_gate']}件 / 同じ画像 {summary['duplicates']}件 / "
+            f"キャッシュ {summary['cache']}件 / 前回の結果 {summary['resumed']}件）")
+
+
+def write_duplicates_log(log_path: str, results: Iterable[ExtractionResult]) -> None:
+    """ほかの画像の結果を使った画像の一覧をログファイルに書き出す"""
+    duplicates = [r for r in results if r.duplicate_of]
+    if not duplicates:
+        return
+    with open(log_path, 'w', encoding='utf-8') as f:
+        for result in sorted(duplicates, key=lambda r: r.filename):
+            f.write(f"{result.filename}: {os.path.basename(result.duplicate_of)} と同じ画像のため、その結果を使いました\n")
+
+
+class BatchExtractor:
+    def __init__(self, api_key: str, prompt_template: Optional[str] = None, max_workers: int = DEFAULT_MAX_WORKERS,
+                 base_url: Optional[str] = None, cache: Optional[ResultCache] = None,
+                 max_size: Optional[int] = None, jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+                 preprocess_workers: Optional[int] = None, rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES, pack_size: int = 1, stream: bool = False,
+                 dedupe_distance: Optional[int] = None, quality_gate: Optional[QualityGate] = None,
+                 auto_crop: bool = False, pricing: Optional[dict] = None, prometheus_file: Optional[str] = None,
+                 receipt_index: Optional[ReceiptIndex] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+        # max_sizeがNoneの場合は前処理をせず元の画像をそのまま送る
+        self.max_size = max_size
+        self.jpeg_quality = jpeg_quality
+        # Trueの場合は縮小の前にレシートの範囲だけを切り抜く（max_sizeがNoneの場合は何もしない）
+        self.auto_crop = auto_crop
+        # 実行レポートの料金計算に使う単価と、Prometheus用ファイルの出力先（Noneの場合はフォルダ内）
+        self.pricing = pricing
+        self.prometheus_file = prometheus_file
+        self.last_report: Optional[dict] = None
+        self.preprocess_workers = preprocess_workers or os.cpu_count() or 1
+        # テンプレートは画像ごとではなく実行開始時に1回だけ決める
+        if prompt_template is None:
+            prompt_template = get_current_template(ensure_settings_file())
+        self.prompt_template = prompt_template
+        self.max_workers = max(1, int(max_workers))
+        # 複数のフォルダを同時に処理する場合は、同じリミッターを渡して全体のリクエスト量を制限する
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(max_concurrency=self.max_workers)
+        self.max_retries = max_retries
+        # 1回のリクエストにまとめる画像の枚数（1の場合はまとめない）
+        self.pack_size = max(1, int(pack_size))
+        # Trueの場合は返答をストリーミングで受け取る
+        self.stream = stream
+        # ほぼ同じ画像とみなすハッシュの距離（Noneの場合は重複チェックをしない）
+        self.dedupe_distance = dedupe_distance
+        # 画質チェック（Noneの場合はすべての画像を送る）
+        self.quality_gate = quality_gate
+        # 全フォルダの結果を検索するためのインデックス（Noneの場合は書き込まない）
+        self.receipt_index = receipt_index
+        self.estimated_tokens = estimate_request_tokens(SYSTEM_ROLE_CONTENT + self.prompt_template)
+
+    @classmethod
+    def from_settings(cls, api_key: str, settings: dict, prompt_template: Optional[str] = None,
+                      max_workers: Optional[int] = None, max_size: Optional[int] = None,
+                      resize_enabled: Optional[bool] = None,
+                      rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                      pack_size: Optional[int] = None, stream: Optional[bool] = None,
+                      preprocess_workers: Optional[int] = None) -> "BatchExtractor":
+        """
+        settings.jsonの内容からBatchExtractorを作る（引数で渡した値は設定より優先する）
+        preprocess_workersは縮小・画質チェック・重複チェックのプロセス数（省略時はCPU数。複数フォルダを同時に処理する場合は分け合う）
+        """
+        configure_http_client(settings.get("http"))
+        if prompt_template is None:
+            prompt_template = get_current_template(settings)
+        if max_workers is None:
+            max_workers = settings.get("max_workers", DEFAULT_MAX_WORKERS)
+        if max_size is None:
+            max_size = settings.get("max_size", 1800)
+        if resize_enabled is None:
+            resize_enabled = settings.get("resize_enabled", False)
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter.from_settings(settings, max_workers)
+        if pack_size is None:
+            pack_size = settings.get("pack_size", 1)
+        if stream is None:
+            stream = settings.get("stream", False)
+        dedupe = settings.get("dedupe", {})
+        return cls(api_key, prompt_template, max_workers,
+                   base_url=settings.get("base_url") or None,
+                   preprocess_workers=preprocess_workers,
+                   cache=ResultCache.from_settings(settings),
+                   max_size=int(max_size) if resize_enabled else None,
+                   jpeg_quality=settings.get("jpeg_quality", DEFAULT_JPEG_QUALITY),
+                   rate_limiter=rate_limiter,
+                   max_retries=settings.get("rate_limit", {}).get("max_retries", DEFAULT_MAX_RETRIES),
+                   pack_size=pack_size,
+                   stream=stream,
+                   dedupe_distance=dedupe.get("max_distance", DEFAULT_MAX_DISTANCE) if dedupe.get("enabled", False) else None,
+                   quality_gate=QualityGate.from_settings(settings, preprocess_workers),
+                   auto_crop=settings.get("auto_crop", False),
+                   pricing=settings.get("pricing"),
+                   prometheus_file=settings.get("metrics", {}).get("prometheus_file") or None,
+                   receipt_index=ReceiptIndex.from_settings(settings))
+
+    def _resolve_paths(self, source: Union[str, Iterable[str]]) -> List[str]:
+        if isinstance(source, str):
+            return list_image_files(source)
+        return list(source)
+
+    def preprocess_params(self) -> dict:
+        """キャッシュのキーに含める前処理の設定"""
+        if self.max_size is None:
+            return {}
+        params = {"max_size": self.max_size, "quality": self.jpeg_quality}
+        if self.auto_crop:
+            params["auto_crop"] = True
+        return params
+
+    def run_key(self) -> str:
+        """テンプレート・モデル・前処理の設定が同じ実行かどうかを判定するためのキー"""
+        key = json.dumps({"template": template_digest(self.prompt_template), "model": MODEL_NAME,
+                          "preprocess": self.preprocess_params()}, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def cache_key(self, image_bytes: bytes) -> str:
+        return ResultCache.make_key(image_bytes, self.prompt_template, MODEL_NAME, self.preprocess_params())
+
+    def _lookup_cache(self, result: ExtractionResult) -> Optional[str]:
+        """キャッシュを確認し、あれば結果に入れる。キャッシュのキーを返す"""
+        if self.cache is None:
+            return None
+        with span("image.read"):
+            with open(result.image_path, "rb") as f:
+                data = f.read()
+        cache_key = self.cache_key(data)
+        text = self.cache.get(cache_key, self.prompt_template)
+        if text is not None:
+            result.text = text
+            result.cached = True
+        return cache_key
+
+    def _prepare_image(self, result: ExtractionResult, preprocess_pool: Optional[Executor]) -> str:
+        """APIに送る画像のdata URLを作る"""
+        if preprocess_pool is None:
+            started = time.perf_counter()
+            image_base64 = encode_image(result.image_path)
+            result.metrics["encode_seconds"] = time.perf_counter() - started
+            return image_base64
+        # 画像の縮小は別プロセスで行い、ここではネットワーク待ちだけをする（1〜2枚だけの場合はその場で縮小する）
+        started = time.perf_counter()
+        with span("preprocess"):
+            image = preprocess_pool.submit(preprocess_image, result.image_path, self.max_size, self.jpeg_quality,
+                                           self.auto_crop).result()
+        result.metrics["preprocess_seconds"] = time.perf_counter() - started
+        result.original_bytes = image.original_bytes
+        result.sent_bytes = image.sent_bytes
+        started = time.perf_counter()
+        image_base64 = encode_image_bytes(image.data, image.mime)
+        result.metrics["encode_seconds"] = time.perf_counter() - started
+        return image_base64
+
+    def _store_text(self, result: ExtractionResult, cache_key: Optional[str], text: str) -> None:
+        result.text = text
+        # 読み取りに失敗した返答はキャッシュせず、次回もう一度APIに投げる
+        if cache_key is not None and REFUSAL_MARKER not in text:
+            self.cache.put(cache_key, self.prompt_template, text, MODEL_NAME)
+
+    def _request_single(self, result: ExtractionResult, cache_key: Optional[str], image_base64: str) -> None:
+        def on_retry(attempt, error, delay):
+            result.retries += 1
+            instant("api.retry", attempt=attempt, delay=delay)
+
+        try:
+            text = call_with_retry(
+                lambda: gen_chat_response_with_gpt4(result.image_path, self.api_key, self.prompt_template, self.base_url,
+                                                    image_base64, self.stream, result.metrics),
+                self.rate_limiter, self.estimated_tokens, self.max_retries, on_retry)
+            self._store_text(result, cache_key, text)
+        except Exception as e:
+            result.error = str(e)
+
+    def _request_packed(self, pending: List[tuple]) -> None:
+        """
+        複数の画像を1回のリクエストで送り、返答をファイル名ごとに分ける
+        返答に含まれなかった画像は1枚ずつ送り直す
+        """
+        def on_retry(attempt, error, delay):
+            for result, _, _ in pending:
+                result.retries += 1
+            instant("api.retry", attempt=attempt, delay=delay, images=len(pending))
+
+        images = [(result.filename, image_base64) for result, _, image_base64 in pending]
+        request_metrics: Dict[str, float] = {}
+        try:
+            text = call_with_retry(
+                lambda: gen_chat_response_for_images(images, self.api_key, self.prompt_template, self.base_url, self.stream,
+                                                     request_metrics),
+                self.rate_limiter, estimate_request_tokens(SYSTEM_ROLE_CONTENT + self.prompt_template, len(images)),
+                self.max_retries, on_retry)
+            parts = split_packed_response(text, [name for name, _ in images])
+        except Exception as e:
+            print(f"まとめて送信できなかったため1枚ずつ送ります: {str(e)}")
+            parts = {}
+
+        for result, cache_key, image_base64 in pending:
+            if parts.get(result.filename):
+                self._share_request_metrics(result, request_metrics, len(pending), len(image_base64))
+                self._store_text(result, cache_key, parts[result.filename])
+            else:
+                self._request_single(result, cache_key, image_base64)
+
+    @staticmethod
+    def _share_request_metrics(result: ExtractionResult, request_metrics: Dict[str, float], count: int,
+                               upload_bytes: int) -> None:
+        """まとめて送ったリクエストの計測値を画像1枚分にする（時間はそのまま、トークン数は枚数で割る）"""
+        for key in ("ttfb_seconds", "latency_seconds"):
+            if key in request_metrics:
+                result.metrics[key] = request_metrics[key]
+        for key in ("prompt_tokens", "completion_tokens"):
+            if key in request_metrics:
+                result.metrics[key] = request_metrics[key] / count
+        result.metrics["upload_bytes"] = upload_bytes
+
+    @traced("extract")
+    def _extract_pack(self, items: List[tuple], preprocess_pool: Optional[Executor]) -> List[ExtractionResult]:
+        """
+        (index, パス) のリストを処理する
+        pack_sizeが2以上の場合は、キャッシュになかった画像をまとめて1回で問い合わせる
+        """
+        results = []
+        pending = []
+        for index, image_path in items:
+            result = ExtractionResult(index, image_path)
+            results.append(result)
+            try:
+                started = time.perf_counter()
+                cache_key = self._lookup_cache(result)
+                result.metrics["read_seconds"] = time.perf_counter() - started
+                if not result.cached:
+                    pending.append((result, cache_key, self._prepare_image(result, preprocess_pool)))
+            except Exception as e:
+                result.error = str(e)
+
+        names = [result.filename for result, _, _ in pending]
+        if len(pending) > 1 and len(set(names)) == len(names):
+            self._request_packed(pending)
+        else:
+            for result, cache_key, image_base64 in pending:
+                self._request_single(result, cache_key, image_base64)
+        return results
+
+    def iter_results(self, source: Union[str, Iterable[str]],
+                     cancel_event: Optional[threading.Event] = None) -> Iterator[ExtractionResult]:
+        """
+        フォルダまたはパスのリストを処理し、終わった順に結果を返す
+        同時に投げるリクエストはmax_workers件まで
+        cancel_eventがセットされると新しい画像は投げず、実行中の分だけを返して終わる
+        """
+        paths = self._resolve_paths(source)
+        items = list(enumerate(paths))
+        # pack_size枚ずつを1つの仕事としてスレッドに渡す
+        queue = iter([items[i:i + self.pack_size] for i in range(0, len(items), self.pack_size)])
+        pending = set()
+
+        preprocess_pool = None
+        if self.max_size is not None and paths:
+            # フォルダ監視で1〜2枚ずつ処理する場合は、プロセスを起動せずにその場で縮小する
+            preprocess_pool = process_pool(len(paths), self.preprocess_workers)
+
+        def submit_next(executor) -> None:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            pack = next(queue, None)
+            if pack is not None:
+                pending.add(executor.submit(self._extract_pack, pack, preprocess_pool))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # 全件を一気にsubmitせず、同時実行数の2倍までに抑える
+                for _ in range(self.max_workers * 2):
+                    submit_next(executor)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    if cancel_event is not None and cancel_event.is_set():
+                        # まだ始まっていない分は取り消す
+                        for future in pending - done:
+                            if future.cancel():
+                                pending.discard(future)
+                    for future in done:
+                        pending.discard(future)
+                        submit_next(executor)
+                        yield from future.result()
+        finally:
+            if preprocess_pool is not None:
+                preprocess_pool.shutdown(cancel_futures=True)
+
+    def _find_duplicates(self, paths: List[str]) -> Dict[str, List[str]]:
+        """{代表の画像のパス: ほぼ同じ画像のパスのリスト} を返す"""
+        if self.dedupe_distance is None or len(paths) < 2:
+            return {}
+        try:
+            duplicates = find_duplicates(paths, self.dedupe_distance, self.preprocess_workers)
+        except Exception as e:
+            # 重複チェックに失敗しても、全部送れば結果は得られる
+            print(f"重複チェックのエラー: {str(e)}")
+            return {}
+        copies: Dict[str, List[str]] = {}
+        for path, representative in duplicates.items():
+            copies.setdefault(representative, []).append(path)
+        return copies
+
+    def screen(self, paths: List[str]) -> Tuple[List[str], List[QualityReport], Dict[str, List[str]]]:
+        """
+        APIに送る前に、画質チェックに通らない画像と、ほかの画像とほぼ同じ画像を除く
+        Returns:
+            (APIに送る画像のパス, 画質チェックで除外した画像の結果, {代表の画像のパス: ほぼ同じ画像のパスのリスト})
+        """
+        rejected = []
+        if self.quality_gate is not None:
+            with span("quality_gate", images=len(paths)):
+                paths, rejected = self.quality_gate.screen(paths)
+        with span("dedupe", images=len(paths)):
+            copies = self._find_duplicates(paths)
+        duplicated = {path for group in copies.values() for path in group}
+        return [path for path in paths if path not in duplicated], rejected, copies
+
+    def link_duplicates(self, result: ExtractionResult, paths: List[str]) -> List[ExtractionResult]:
+        """代表の画像の結果を、ほぼ同じ画像の結果としても使う"""
+        linked = []
+        for path in paths:
+            copy = ExtractionResult(0, path, text=result.text, error=result.error, cached=result.cached)
+            copy.duplicate_of = result.image_path
+            linked.append(copy)
+        return linked
+
+    @traced("batch.run")
+    def run(self, source: Union[str, Iterable[str]], csv_path: Optional[str] = None,
+            progress_callback: Optional[Callable[[int, int, ExtractionResult], None]] = None,
+            resume: bool = True, cancel_event: Optional[threading.Event] = None) -> List[ExtractionResult]:
+        """
+        一括処理してCSVを書き出す
+        Args:
+            source: フォルダのパス、または画像パスのリスト
+            csv_path: 出力先CSV（省略時はフォルダ内のresults_RyoSyuSyo.csv）
+            progress_callback: (完了件数, 全件数, 結果) を受け取る関数
+            resume: Trueの場合、ジャーナルに記録済みの画像は処理せずに前回の結果を使う
+            cancel_event: セットされると途中で止める（それまでの結果はCSVとジャーナルに残るので、次回は続きから処理する）
+        """
+        started = time.perf_counter()
+        paths = self._resolve_paths(source)
+        if csv_path is None:
+            base_dir = source if isinstance(source, str) else os.path.dirname(paths[0]) if paths else "."
+            csv_path = os.path.join(base_dir, RESULT_CSV_NAME)
+        folder = os.path.dirname(csv_path)
+        journal = BatchJournal.for_folder(folder, self.run_key())
+
+        # 前回までに処理済みの画像は結果だけを引き継ぐ
+        finished = journal.completed(folder) if resume else {}
+        results = []
+        todo = []
+        for index, path in enumerate(paths):
+            entry = finished.get(os.path.basename(path))
+            if entry is not None:
+                result = ExtractionResult(index, path, text=entry["text"], resumed=True)
+                if entry.get("duplicate_of"):
+                    result.duplicate_of = os.path.join(os.path.dirname(path), entry["duplicate_of"])
+                results.append(result)
+            else:
+                todo.append(path)
+
+        # 画質チェックに通らなかった画像はAPIに送らず、要確認リストに回す
+        # ほぼ同じ画像（同じレシートを2回撮ったものなど）は1枚だけを送り、残りは同じ結果を使う
+        unique, rejected, copies = self.screen(todo)
+        for report in rejected:
+            result = review_result(report)
+            results.append(result)
+            if progress_callback:
+                progress_callback(len(results), len(paths), result)
+
+        # 前回までの結果を先に書き、終わった画像から順に追記していく（落ちても処理中の分しか失われない）
+        write_results_csv(csv_path, results)
+        for extracted in self.iter_results(unique, cancel_event):
+            for result in [extracted] + self.link_duplicates(extracted, copies.get(extracted.image_path, [])):
+                journal.append(result.image_path, result.text, result.error, result.duplicate_of)
+                append_results_csv(csv_path, [result])
+                results.append(result)
+                if progress_callback:
+                    progress_callback(len(results), len(paths), result)
+
+        order = {path: index for index, path in enumerate(paths)}
+        for result in results:
+            result.index = order[result.image_path]
+        # 最後にファイル名順に並べ直して書き直す
+        results.sort(key=lambda r: r.index)
+        write_results_csv(csv_path, results)
+        write_error_log(os.path.join(folder, ERROR_LOG_NAME), results)
+        write_duplicates_log(os.path.join(folder, DUPLICATES_LOG_NAME), results)
+        write_review_list(os.path.join(folder, REVIEW_LIST_NAME), rejected)
+        self._write_reports(folder, results, time.perf_counter() - started)
+        self.update_index(folder, results)
+        journal.compact()
+        if self.cache is not None:
+            self.cache.evict()
+        return results
+
+    @traced("index.write")
+    def update_index(self, folder: str, results: List[ExtractionResult]) -> None:
+        """結果をインデックスに書き込む（失敗してもCSVには書き出し済みなので、処理結果には影響させない）"""
+        if self.receipt_index is None:
+            return
+        try:
+            self.receipt_index.upsert_results(folder, results)
+        except Exception as e:
+            print(f"インデックスの書き込みエラー: {str(e)}")
+
+    @traced("report.write")
+    def _write_reports(self, folder: str, results: List[ExtractionResult], wall_seconds: float) -> None:
+        """実行レポート（JSON）とPrometheus用のファイルを書き出す（失敗しても処理結果には影響させない）"""
+        try:
+            report = build_run_report(results, wall_seconds, self.pricing)
+            report["folder"] = os.path.abspath(folder)
+            self.last_report = report
+            write_run_report(os.path.join(folder, RUN_REPORT_NAME), report)
+            write_prometheus(self.prometheus_file or os.path.join(folder, PROMETHEUS_NAME), report,
+                             {"folder": os.path.basename(os.path.abspath(folder))})
+        except Exception as e:
+            print(f"実行レポートの書き出しエラー: {str(e)}")
+
+    def run_incremental(self, paths: Iterable[str], csv_path: str,
+                        progress_callback: Optional[Callable[[int, int, ExtractionResult], None]] = None) -> List[ExtractionResult]:
+        """
+        追加された画像だけを処理して、終わったものから順にCSVへ追記する
+        ジャーナルに処理済みとして記録されている画像と、処理済みの画像をリネームしただけのものは処理しない
+        一括処理と同じく、画質チェックに通らない画像とほぼ同じ画像はAPIに送らない
+        """
+        folder = os.path.dirname(csv_path)
+        journal = BatchJournal.for_folder(folder, self.run_key())
+        finished = journal.completed(folder)
+        moved = journal.moved(folder)
+        todo = []
+        for path in paths:
+            if os.path.basename(path) in finished:
+                continue
+            signature = file_signature(path)
+            entry = moved.get((signature["size"], signature["mtime_ns"])) if signature else None
+            if entry is not None:
+                # リネームされた画像の行はCSVにもう入っているので、ジャーナルの名前だけ付け替えてCSVには書き足さない
+                journal.append(path, entry["text"], None, entry.get("duplicate_of"))
+                continue
+            todo.append(path)
+        unique, rejected, copies = self.screen(todo)
+
+        results = []
+        for report in rejected:
+            result = review_result(report)
+            results.append(result)
+            if progress_callback:
+                progress_callback(len(results), len(todo), result)
+        for extracted in self.iter_results(unique):
+            for result in [extracted] + self.link_duplicates(extracted, copies.get(extracted.image_path, [])):
+                journal.append(result.image_path, result.text, result.error, result.duplicate_of)
+                append_results_csv(csv_path, [result])
+                results.append(result)
+                if progress_callback:
+                    progress_callback(len(results), len(todo), result)
+        write_review_list(os.path.join(folder, REVIEW_LIST_NAME), rejected, append=True)
+        self.update_index(folder, results)
+        return results
+
+
+def process_folder(folder: str, api_key: Optional[str] = None, prompt_template: Optional[str] = None,
+                   max_workers: Optional[int] = None, max_size: Optional[int] = None,
+                   resize_enabled: Optional[bool] = None,
+                   progress_callback: Optional[Callable[[int, int, ExtractionResult], None]] = None,
+                   resume: bool = True) -> List[ExtractionResult]:
+    """スクリプトから使うための一括処理の入口"""
+    if api_key is None:
+        api_key = get_gpt_openai_apikey()
+    extractor = BatchExtractor.from_settings(api_key, ensure_settings_file(), prompt_template, max_workers,
+                                             max_size, resize_enabled)
+    return extractor.run(folder, progress_callback=progress_callback, resume=resume)
@@ -0,0 +1,66 @@
+#ベンチマーク用のレシート画像フォルダを作る部分
+import io
+import os
+import random
+import struct
+from typing import Dict, Tuple
+
+from PIL import Image, ImageDraw
+
+# 名前と (幅, 高さ)
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "small": (960, 1280),
+    "medium": (2016, 2688),
+    "large": (3024, 4032),
+}
+
+
+def render_receipt(size: Tuple[int, int], seed: int = 0, quality: int = 85) -> bytes:
+    """机の上に置いたレシートのような画像をJPEGで作る"""
+    rng = random.Random(seed)
+    width, height = size
+    img = Image.new("RGB", size, (105, 80, 58))
+    draw = ImageDraw.Draw(img)
+    left, top = int(width * 0.25), int(height * 0.1)
+    right, bottom = int(width * 0.75), int(height * 0.9)
+    draw.rectangle([left, top, right, bottom], fill=(238, 236, 230))
+    line_height = max(8, height // 60)
+    y = top + line_height
+    while y < bottom - line_height:
+        length = rng.randint((right - left) // 5, (right - left) * 4 // 5)
+        draw.rectangle([left + line_height, y, left + line_height + length, y + line_height // 2], fill=(35, 35, 35))
+        y += line_height
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _with_comment(jpeg: bytes, comment: bytes) -> bytes:
+    """JPEGの先頭（SOIの直後）にコメントを入れる（見た目は同じで、内容のハッシュだけが変わる）"""
+    segment = b"\xff\xfe" + struct.pack(">H", len(comment) + 2) + comment
+    return jpeg[:2] + segment + jpeg[2:]
+
+
+def make_receipt_folder(folder: str, count: int, resolution: str = "medium", variants: int = 20,
+                        seed: int = 0) -> str:
+    """
+    count枚のレシート画像を置いたフォルダを作る（既に同じ枚数があれば作り直さない）
+    画像はvariants種類だけ描画し、残りはコメントだけを変えて書き出すので、5万枚でもすぐに作れる
+    ファイルの内容はすべて異なるので、結果キャッシュには当たらない
+    """
+    os.makedirs(folder, exist_ok=True)
+    existing = [name for name in os.listdir(folder) if name.startswith("receipt_") and name.endswith(".jpg")]
+    if len(existing) == count:
+        return folder
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    size = RESOLUTIONS[resolution]
+    bases = [render_receipt(size, seed + i) for i in range(min(variants, count))]
+    for i in range(count):
+        data = _with_comment(bases[i % len(bases)], f"benchmark {seed} {i}".encode("ascii"))
+        with open(os.path.join(folder, f"receipt_{i:06d}.jpg"), "wb") as f:
+            f.write(data)
+    return folder
@@ -0,0 +1,274 @@
+#ベンチマーク用に、chat completionsとBatch API（files・batches）のエンドポイントの代わりをする手元のHTTPサーバー
+import email
+import email.policy
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+FAKE_ROW = "2025/01/15,ベンチマーク商店,文房具,1200,消耗品費"
+PACKED_FILENAME_PREFIX = "ファイル名: "
+
+
+class FakeOpenAIServer:
+    """
+    POST /v1/chat/completions に、決まった抽出結果を返すサーバー
+    latency秒（±jitter秒）待ってから返し、rate_limit_ratioの割合で429（retry-after-ms付き）を返す
+    画像の枚数に合わせてトークン数を返すので、実行レポートの料金計算もそのまま試せる
+    Batch API用に /v1/files（アップロード・中身の取得）と /v1/batches（作成・取得・取り消し）も受け付ける
+    バッチはlatency秒たつと完了し、入力の各行にchat completionsと同じ結果を返す
+    """
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, rate_limit_ratio: float = 0.0,
+                 retry_after_ms: int = 200, seed: Optional[int] = None, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_ms = retry_after_ms
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.files: Dict[str, dict] = {}
+        self.batches: Dict[str, dict] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="FakeOpenAIServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _decide(self):
+        """(429を返すか, 待つ秒数)"""
+        with self._lock:
+            self.requests += 1
+            limited = self._random.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        return limited, delay
+
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def _add_file(self, filename: str, content: bytes, purpose: str) -> dict:
+        file_id = self._new_id("file")
+        info = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        with self._lock:
+            self.files[file_id] = {"info": info, "content": content}
+        return info
+
+    def _create_batch(self, request: dict) -> dict:
+        batch = {"id": self._new_id("batch"), "object": "batch", "endpoint": request.get("endpoint"),
+                 "input_file_id": request.get("input_file_id"), "completion_window": request.get("completion_window"),
+                 "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                 "error_file_id": None, "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch,), name="FakeBatch", daemon=True).start()
+        return batch
+
+    def _run_batch(self, batch: dict) -> None:
+        """latency秒待ってから入力ファイルの全行に答える（その間に取り消されたら何もしない）"""
+        time.sleep(self.latency)
+        with self._lock:
+            if batch["status"] != "in_progress":
+                return
+            content = self.files[batch["input_file_id"]]["content"]
+        lines = []
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({"id": self._new_id("response"), "custom_id": request["custom_id"],
+                                     "response": {"status_code": 200, "body": _completion_body(request["body"])},
+                                     "error": None}, ensure_ascii=False))
+        output = self._add_file("batch_output.jsonl", ("\n".join(lines) + "\n").encode("utf-8"), "batch_output")
+        with self._lock:
+            batch["request_counts"] = {"total": len(lines), "completed": len(lines), "failed": 0}
+            batch["output_file_id"] = output["id"]
+            batch["status"] = "completed"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+            def _send_not_found(self) -> None:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].rstrip("/").split("/")
+                with server._lock:
+                    if len(parts) >= 2 and parts[-2] == "files" and parts[-1] in server.files:
+                        body = server.files[parts[-1]]["info"]
+                    elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" \
+                            and parts[-2] in server.files:
+                        content = server.files[parts[-2]]["content"]
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/octet-stream")
+                        self.send_header("Content-Length", str(len(content)))
+                        self.end_headers()
+                        self.wfile.write(content)
+                        return
+                    elif len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in server.batches:
+                        body = dict(server.batches[parts[-1]])
+                    else:
+                        body = None
+                if body is None:
+                    self._send_not_found()
+                else:
+                    self._send_json(200, body)
+
+            def _upload_file(self) -> None:
+                # multipart/form-dataを、ヘッダーを付けたメールとして読む
+                message = email.message_from_bytes(
+                    f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("latin-1") + self._read_body(),
+                    policy=email.policy.HTTP)
+                fields, filename, content = {}, "upload", b""
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    if name == "file":
+                        filename = part.get_filename() or filename
+                        content = part.get_payload(decode=True) or b""
+                    else:
+                        fields[name] = part.get_content().strip()
+                self._send_json(200, server._add_file(filename, content, fields.get("purpose", "batch")))
+
+            def do_POST(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if path.endswith("/files"):
+                    self._upload_file()
+                    return
+                request = json.loads(self._read_body() or b"{}")
+                if path.endswith("/batches"):
+                    self._send_json(200, server._create_batch(request))
+                    return
+                if path.endswith("/cancel"):
+                    batch_id = path.split("/")[-2]
+                    with server._lock:
+                        batch = server.batches.get(batch_id)
+                        if batch is not None and batch["status"] == "in_progress":
+                            batch["status"] = "cancelled"
+                        body = dict(batch) if batch is not None else None
+                    if body is None:
+                        self._send_not_found()
+                    else:
+                        self._send_json(200, body)
+                    return
+                if not path.endswith("/chat/completions"):
+                    self._send_not_found()
+                    return
+                limited, delay = server._decide()
+                if limited:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                    "code": "rate_limit_exceeded"}},
+                                    {"retry-after-ms": str(server.retry_after_ms)})
+                    return
+
+                body = _completion_body(request)
+                text = body["choices"][0]["message"]["content"]
+                usage = body["usage"]
+
+                if request.get("stream"):
+                    # 最初のチャンクまでを待ち時間の大半にして、TTFBも計測できるようにする
+                    time.sleep(delay * 0.8)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+                    for piece in pieces:
+                        chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                        self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        time.sleep(delay * 0.2 / len(pieces))
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                                 "choices": [], "usage": usage}
+                        self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                    return
+
+                time.sleep(delay)
+                self._send_json(200, body)
+
+        return Handler
+
+
+def _completion_body(request: dict) -> dict:
+    """chat completionsの返答（まとめて送られた場合はファイル名ごとに1行ずつ返す）"""
+    filenames, image_count, prompt_chars = _inspect_messages(request.get("messages", []))
+    if filenames:
+        text = "\n".join(f"{name},{FAKE_ROW}" for name in filenames)
+    else:
+        text = FAKE_ROW
+    usage = {"prompt_tokens": prompt_chars + 765 * image_count, "completion_tokens": 20 * max(1, image_count)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return {
+        "id": "bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def _inspect_messages(messages):
+    """まとめて送られたファイル名・画像の枚数・テキストの文字数を数える"""
+    filenames, image_count, prompt_chars = [], 0, 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt_chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                image_count += 1
+            elif part.get("type") == "text":
+                text = part.get("text", "")
+                prompt_chars += len(text)
+                if text.startswith(PACKED_FILENAME_PREFIX):
+                    filenames.append(text[len(PACKED_FILENAME_PREFIX):])
+    return filenames, image_count, prompt_chars
@@ -0,0 +1,204 @@
+#一括処理・リネーム・バックアップの速度を、手元の偽APIサーバーを相手に計測して基準値と比べる入口
+#使い方: python -m benchmarks.run_benchmark --sizes 100,1000 --resolutions small,large
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windowsではピークメモリを計測しない
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_manager import BackupManager
+from batch_processor import BatchExtractor, RESULT_CSV_NAME
+from benchmarks.datasets import RESOLUTIONS, make_receipt_folder
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from file_renamer import FileRenamer
+from rate_limiter import AdaptiveRateLimiter
+from rename_journal import RenameJournal
+from text_extractor import encode_image
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_WORK_DIR = os.path.join(BENCHMARK_DIR, ".work")
+BENCHMARK_PROMPT = "画像から、取引年月日(yyyy/mm/ddのみ時間なし)、店舗名、商品名(要約)、合計金額(通貨記号は削除)、推測される勘定科目名を抽出しカンマ区切り(,)でreturnせよ"
+ENCODE_SAMPLE = 50
+# 大きいほど良い指標（それ以外は小さいほど良い）
+HIGHER_IS_BETTER = ("images_per_minute",)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="偽のAPIサーバーを相手に処理速度を計測します")
+    parser.add_argument("--sizes", default="100,1000", help="画像の枚数（カンマ区切り。例: 100,1000,50000）")
+    parser.add_argument("--resolutions", default="medium", help=f"画像の大きさ（カンマ区切り。{', '.join(RESOLUTIONS)}）")
+    parser.add_argument("--workers", type=int, default=8, help="同時にAPIへ投げるリクエスト数")
+    parser.add_argument("--max-size", type=int, default=1600, help="縮小する場合の最大辺（0の場合は縮小しない）")
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.5, help="偽のAPIの応答時間（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="応答時間のばらつき（秒）")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429を返す割合（0〜1）")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="画像フォルダを作る場所")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="比較する基準値のファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="基準値より何割悪くなったら遅くなったとみなすか")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser
+
+
+def _peak_rss_mb() -> Dict[str, Optional[float]]:
+    """このプロセスと子プロセス（前処理用のプロセスプール）のピークメモリ"""
+    if resource is None:
+        return {"peak_rss_mb": None, "children_peak_rss_mb": None}
+    # Linuxはキロバイト、macOSはバイト
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+
+def run_scenario(args: argparse.Namespace, count: int, resolution: str) -> dict:
+    """1つの組み合わせ（枚数×解像度）を計測する（ピークメモリを分けるため子プロセスで呼ぶ）"""
+    folder = make_receipt_folder(os.path.join(args.work_dir, f"{resolution}_{count}"), count, resolution)
+    for name in os.listdir(folder):
+        if not name.startswith("receipt_"):
+            os.remove(os.path.join(folder, name))
+    metrics: Dict[str, Optional[float]] = {}
+
+    images = sorted(os.listdir(folder))[:ENCODE_SAMPLE]
+    started = time.perf_counter()
+    for name in images:
+        encode_image(os.path.join(folder, name))
+    metrics["encode_image_ms"] = (time.perf_counter() - started) * 1000 / len(images)
+
+    with FakeOpenAIServer(args.latency, args.jitter, args.rate_limit_ratio, seed=count) as server:
+        extractor = BatchExtractor("benchmark", BENCHMARK_PROMPT, args.workers, base_url=server.base_url,
+                                   max_size=args.max_size or None,
+                                   rate_limiter=AdaptiveRateLimiter(None, None, args.workers),
+                                   pack_size=args.pack_size, stream=args.stream)
+        results = extractor.run(folder, resume=False)
+        report = extractor.last_report
+        metrics["server_rate_limited"] = server.rate_limited
+    metrics["failed"] = sum(1 for r in results if not r.ok)
+    metrics["extract_seconds"] = report["wall_seconds"]
+    metrics["images_per_minute"] = report["images_per_minute"]
+    metrics["retries"] = report["retries"]
+    for stage, summary in report["timings"].items():
+        for p in ("p50", "p95"):
+            if summary[p] is not None:
+                metrics[f"{stage[:-len('_seconds')]}_{p}_ms"] = summary[p] * 1000
+    metrics["upload_bytes_p50"] = report["upload_bytes"]["p50"]
+
+    # リネームと、ジャーナルからの取り消し（フォルダを元に戻して次回も使えるようにする）
+    journal = RenameJournal.for_folder(folder)
+    journal.begin()
+    started = time.perf_counter()
+    FileRenamer(os.path.join(folder, RESULT_CSV_NAME), folder, journal=journal).rename_files()
+    metrics["rename_seconds"] = time.perf_counter() - started
+    started = time.perf_counter()
+    journal.rollback()
+    metrics["rename_rollback_seconds"] = time.perf_counter() - started
+
+    # バックアップ（1回目は全件、2回目は変更がないので差分なし）
+    backup_manager = BackupManager(folder)
+    shutil.rmtree(backup_manager.store_dir, ignore_errors=True)
+    started = time.perf_counter()
+    backup_manager.create_snapshot()
+    metrics["snapshot_full_seconds"] = time.perf_counter() - started
+    started = time.perf_counter()
+    BackupManager(folder).create_snapshot()
+    metrics["snapshot_incremental_seconds"] = time.perf_counter() - started
+    shutil.rmtree(backup_manager.store_dir, ignore_errors=True)
+
+    metrics.update(_peak_rss_mb())
+    return metrics
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """基準値よりtoleranceの割合以上悪くなった指標を返す"""
+    regressions = []
+    for scenario, metrics in results.items():
+        for key, value in metrics.items():
+            base = baseline.get(scenario, {}).get(key)
+            if value is None or not base or key in ("failed", "retries", "server_rate_limited"):
+                continue
+            if key in HIGHER_IS_BETTER:
+                change = (base - value) / base
+            else:
+                change = (value - base) / base
+            if change > tolerance:
+                regressions.append(f"{scenario} {key}: {base:.4g} → {value:.4g}（{change * 100:.0f}%悪化）")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.child:
+        count, resolution = args.child.split(":")
+        print(json.dumps(run_scenario(args, int(count), resolution)))
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    resolutions = [r for r in args.resolutions.split(",") if r]
+    for resolution in resolutions:
+        if resolution not in RESOLUTIONS:
+            print(f"解像度 '{resolution}' はありません（{', '.join(RESOLUTIONS)}）", file=sys.stderr)
+            return 2
+
+    child_args = [a for a in (argv if argv is not None else sys.argv[1:])
+                  if a not in ("--save-baseline",)]
+    results = {}
+    for resolution in resolutions:
+        for count in sizes:
+            scenario = f"{resolution}_{count}"
+            print(f"計測中: {scenario}", flush=True)
+            completed = subprocess.run([sys.executable, "-m", "benchmarks.run_benchmark", *child_args,
+                                        "--child", f"{count}:{resolution}"],
+                                       cwd=os.path.dirname(BENCHMARK_DIR), capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                return 1
+            results[scenario] = json.loads(completed.stdout.strip().splitlines()[-1])
+            print(json.dumps(results[scenario], ensure_ascii=False, indent=2), flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=4)
+        print(f"基準値を保存しました: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("基準値がないため比較しません（--save-baselineで保存できます）")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("基準値より遅くなった項目:")
+        for line in regressions:
+            print(f"- {line}")
+        return 1
+    print("基準値と比べて遅くなった項目はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
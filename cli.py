@@ -0,0 +1,198 @@
+#画面を使わずにコマンドラインから一括処理するための入口（tkinterはimportしない）
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from backup_manager import BackupManager
+from batch_api import BatchApiRunner
+from batch_processor import BatchExtractor, RESULT_CSV_NAME, DEFAULT_MAX_WORKERS, format_saved_calls
+from file_renamer import FileRenamer
+from rate_limiter import AdaptiveRateLimiter
+from receipt_index import ReceiptIndex
+from rename_journal import RenameJournal
+from text_extractor import ensure_settings_file, get_gpt_openai_apikey
+from tracing import TRACE_NAME, tracing_options, tracing_session
+
+# 同時に処理するフォルダ数の初期値（APIの同時リクエスト数は--workersで全フォルダ合計に抑えているので、多くしても速くならない）
+DEFAULT_FOLDER_WORKERS = 2
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="レシート画像のフォルダを一括処理します")
+    parser.add_argument("folders", nargs="+", help="処理するフォルダ（複数指定すると同時に処理します）")
+    parser.add_argument("--template", help="使うテンプレートのキー（省略時は現在選択中のテンプレート）")
+    parser.add_argument("--workers", type=int, help="全フォルダ合計で同時にAPIへ投げるリクエスト数")
+    parser.add_argument("--folder-workers", type=int,
+                        help=f"同時に処理するフォルダ数（省略時は{DEFAULT_FOLDER_WORKERS}。画像の縮小などのプロセスはフォルダ間でCPU数を分け合う）")
+    resize = parser.add_mutually_exclusive_group()
+    resize.add_argument("--resize", dest="resize_enabled", action="store_true", default=None, help="APIに送る画像を縮小する")
+    resize.add_argument("--no-resize", dest="resize_enabled", action="store_false", help="画像を縮小せずに送る")
+    parser.add_argument("--max-size", type=int, help="縮小する場合の最大辺のピクセル数")
+    parser.add_argument("--pack-size", type=int, help="1回のリクエストにまとめる画像の枚数（省略時はsettings.jsonのpack_size）")
+    parser.add_argument("--stream", action="store_true", default=None, help="返答をストリーミングで受け取る")
+    parser.add_argument("--no-resume", action="store_true", help="処理済みの画像も含めて最初から処理する")
+    parser.add_argument("--rename", action="store_true", help="処理後にCSVの内容で画像をリネームする")
+    parser.add_argument("--backup", action="store_true",
+                        help="リネーム前にフォルダのスナップショットとCSVのバックアップを作成する（変わったファイルだけを保存する）")
+    parser.add_argument("--restore-backup", metavar="MANIFEST", help="処理は行わず、指定したスナップショットからフォルダを復元する")
+    parser.add_argument("--undo-rename", action="store_true", help="処理は行わず、前回のリネームを元に戻す")
+    parser.add_argument("--batch-api", action="store_true", help="Batch APIで処理する（安いが結果が出るまで最大24時間かかる）")
+    parser.add_argument("--cancel-batch", action="store_true",
+                        help="処理は行わず、Batch APIに提出済みで終わっていないバッチを取り消す（結果は反映しない）")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Batch APIの完了を確認する間隔（秒）")
+    parser.add_argument("--api-key", help="OpenAI APIキー（省略時は環境変数またはsecret.json）")
+    parser.add_argument("--trace", nargs="?", const="", metavar="FILE",
+                        help=f"処理の段階ごとの時間を記録する（FILE省略時は最初のフォルダの{TRACE_NAME}）")
+    parser.add_argument("--profile", action="store_true", help="--traceと一緒に使い、cProfileの結果も書き出す")
+    parser.add_argument("--trace-memory", action="store_true", help="--traceと一緒に使い、tracemallocでメモリ使用量も記録する")
+    return parser
+
+
+def rename_folder(folder: str, backup: bool) -> List[str]:
+    """CSVの内容で画像をリネームし、出力するメッセージを返す"""
+    csv_path = os.path.join(folder, RESULT_CSV_NAME)
+    messages = []
+    csv_backup = None
+    if backup:
+        backup_manager = BackupManager(folder)
+        snapshot = backup_manager.create_snapshot()
+        csv_backup = backup_manager.backup_csv_file(csv_path)
+        if not snapshot or not csv_backup:
+            return ["バックアップの作成に失敗したためリネームを中止しました"]
+        messages.append(f"スナップショットを作成しました: {snapshot}")
+
+    # 画像はコピーせず、リネームの内容だけを記録しておく（--undo-renameで元に戻せる）
+    journal = RenameJournal.for_folder(folder)
+    journal.begin(csv_path, csv_backup)
+    renamer = FileRenamer(csv_path, folder, journal=journal,
+                          receipt_index=ReceiptIndex.from_settings(ensure_settings_file()))
+    success_count, error_count, errors = renamer.rename_files()
+    messages.append(f"リネーム 成功: {success_count}件 / 失敗: {error_count}件")
+    messages.extend(f"- {error}" for error in errors)
+    return messages
+
+
+def undo_rename_folder(folder: str) -> bool:
+    """前回のリネームを元に戻す（戻せなかったファイルがなければTrue）"""
+    journal = RenameJournal.for_folder(folder)
+    if not journal.can_rollback():
+        print(f"[{folder}] 元に戻せるリネームの記録がありません", flush=True)
+        return False
+    restored, errors = journal.rollback()
+    receipt_index = ReceiptIndex.from_settings(ensure_settings_file())
+    if receipt_index is not None:
+        receipt_index.restore_original_names(folder)
+    lines = [f"[{folder}] リネームを元に戻しました: {restored}件"]
+    lines.extend(f"- {error}" for error in errors)
+    print("\n".join(lines), flush=True)
+    return not errors
+
+
+def process_one_folder(folder: str, extractor: BatchExtractor, args: argparse.Namespace) -> bool:
+    """1フォルダ分の処理（失敗した画像がなければTrue）"""
+    def on_progress(done, total, result):
+        status = "OK" if result.ok else f"NG {result.error}"
+        print(f"[{os.path.basename(folder)}] {done}/{total} {result.filename} {status}", flush=True)
+
+    if args.cancel_batch:
+        cancelled = BatchApiRunner(extractor).cancel(folder)
+        print(f"[{folder}] バッチを取り消しました: {cancelled}件", flush=True)
+        return True
+
+    if args.batch_api:
+        def on_batch_progress(done, total):
+            print(f"[{os.path.basename(folder)}] バッチ処理中 {done}/{total}", flush=True)
+
+        try:
+            results = BatchApiRunner(extractor, args.poll_interval).run(folder, resume=not args.no_resume,
+                                                                        progress_callback=on_batch_progress)
+        except ValueError as e:
+            print(f"[{folder}] {str(e)}", flush=True)
+            return False
+    else:
+        results = extractor.run(folder, progress_callback=on_progress, resume=not args.no_resume)
+    # 画質チェックで除外した画像はCSVに行がないだけなので、リネームの妨げにはしない
+    review_count = sum(1 for r in results if r.review_reason is not None)
+    error_count = sum(1 for r in results if not r.ok) - review_count
+    lines = [f"[{folder}] 完了 成功: {len(results) - error_count - review_count}件 / 失敗: {error_count}件"
+             f" / 要確認: {review_count}件", format_saved_calls(results)]
+    if extractor.last_report and not args.batch_api:
+        report = extractor.last_report
+        lines.append(f"処理速度: {report['images_per_minute'] or 0:.1f}枚/分 / 料金の目安: {report['cost']['yen']:.1f}円"
+                     f"（1枚あたり{report['cost']['yen_per_image'] or 0:.2f}円）")
+    if args.rename and error_count == 0:
+        lines.extend(rename_folder(folder, args.backup))
+    elif args.rename:
+        lines.append("失敗した画像があるためリネームは行いませんでした")
+    print("\n".join(lines), flush=True)
+    return error_count == 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    folders = [os.path.abspath(f) for f in args.folders]
+    for folder in folders:
+        if not os.path.isdir(folder):
+            print(f"フォルダが見つかりません: {folder}", file=sys.stderr)
+            return 2
+
+    if args.restore_backup:
+        if len(folders) != 1:
+            print("--restore-backupではフォルダを1つだけ指定してください", file=sys.stderr)
+            return 2
+        return 0 if BackupManager(folders[0]).restore_from_backup(args.restore_backup) else 1
+
+    if args.undo_rename:
+        ok = all([undo_rename_folder(folder) for folder in folders])
+        return 0 if ok else 1
+
+    # --traceを付けた場合と、settings.jsonの"tracing"が有効な場合にトレースする
+    if args.trace is not None:
+        options = {"profile": args.profile, "trace_memory": args.trace_memory}
+    else:
+        options = tracing_options(ensure_settings_file())
+    with tracing_session(options, args.trace or os.path.join(folders[0], TRACE_NAME)):
+        return run_folders(folders, args)
+
+
+def run_folders(folders: List[str], args: argparse.Namespace) -> int:
+    """フォルダを一括処理する（失敗した画像がなければ0）"""
+    settings = ensure_settings_file()
+    prompt_template = None
+    if args.template:
+        templates = settings.get("prompt_templates", {})
+        if args.template not in templates:
+            print(f"テンプレート '{args.template}' が見つかりません。", file=sys.stderr)
+            return 2
+        prompt_template = templates[args.template]["template"]
+
+    try:
+        api_key = args.api_key or get_gpt_openai_apikey()
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    # レート制限と同時実行数は全フォルダで共有する（各フォルダは空いていれば上限いっぱいまで使える）
+    workers = args.workers or settings.get("max_workers", DEFAULT_MAX_WORKERS)
+    rate_limiter = AdaptiveRateLimiter.from_settings(settings, workers)
+    # フォルダごとに前処理のプロセスプールを作るので、同時に動くフォルダでCPU数を分け合う
+    folder_workers = max(1, min(args.folder_workers or DEFAULT_FOLDER_WORKERS, len(folders)))
+    preprocess_workers = max(1, (os.cpu_count() or 1) // folder_workers)
+    extractors = [
+        BatchExtractor.from_settings(api_key, settings, prompt_template, workers,
+                                     args.max_size, args.resize_enabled, rate_limiter, args.pack_size, args.stream,
+                                     preprocess_workers=preprocess_workers)
+        for _ in folders
+    ]
+
+    with ThreadPoolExecutor(max_workers=folder_workers) as executor:
+        futures = [executor.submit(process_one_folder, folder, extractor, args)
+                   for folder, extractor in zip(folders, extractors)]
+        ok = all(future.result() for future in futures)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
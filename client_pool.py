@@ -0,0 +1,71 @@
+#openAIクライアントを使い回すための部分
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import OpenAI
+
+DEFAULT_HTTP_OPTIONS = {
+    "max_connections": 20,            # 同時に張る接続の上限
+    "max_keepalive_connections": 10,  # 使い回すために残しておく接続数
+    "keepalive_expiry": 60.0,         # 使われていない接続を残しておく秒数
+    "connect_timeout": 10.0,
+    "read_timeout": 120.0,
+    "max_retries": 0,                 # 再試行はrate_limiterで行うのでクライアント側ではしない
+}
+
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_http_options = dict(DEFAULT_HTTP_OPTIONS)
+_lock = threading.Lock()
+
+
+def _build_http_client(options: dict) -> httpx.Client:
+    limits = httpx.Limits(
+        max_connections=options["max_connections"],
+        max_keepalive_connections=options["max_keepalive_connections"],
+        keepalive_expiry=options["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(options["read_timeout"], connect=options["connect_timeout"])
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+def configure_http_client(options: Optional[dict] = None) -> None:
+    """
+    接続プールの設定を変更する（settings.jsonの"http"）
+    設定が変わった場合は作成済みのクライアントを閉じて作り直させる
+    """
+    global _http_options
+    new_options = dict(DEFAULT_HTTP_OPTIONS)
+    new_options.update(options or {})
+    with _lock:
+        if new_options == _http_options:
+            return
+        _http_options = new_options
+        _close_clients_locked()
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """APIキーと接続先ごとに1つのクライアントを共有する"""
+    key = (api_key, base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=_http_options["max_retries"],
+                            http_client=_build_http_client(_http_options))
+            _clients[key] = client
+        return client
+
+
+def _close_clients_locked() -> None:
+    for client in _clients.values():
+        try:
+            client.close()
+        except Exception as e:
+            print(f"クライアント終了エラー: {str(e)}")
+    _clients.clear()
+
+
+def close_all_clients() -> None:
+    """作成済みのクライアントをすべて閉じる"""
+    with _lock:
+        _close_clients_locked()
@@ -0,0 +1,74 @@
+#results_RyoSyuSyo.csvを1回だけ読み込んで、リネーム処理の各所で使い回すための部分
+import csv
+import io
+import os
+from typing import List, Optional, Tuple
+
+ERROR_MARKER = "申し訳ありません"
+ERROR_ROWS_MESSAGE = ("CSVファイルにエラーメッセージが含まれています。\n先にCSVファイルの内容を修正してください。\n\n"
+                      "修正方法：\n1. CSVファイルを開いて、「申し訳ありません」を含む行を削除\n"
+                      "2. または、update_csv.pyを実行してCSVファイルを更新")
+ENCODINGS = ['shift_jis', 'utf-8']
+
+
+class ResultsTable:
+    """読み込み済みのCSV（エンコーディングの判定・パース・エラー行の検出を1回の読み込みで済ませたもの）"""
+    def __init__(self, path: str, encoding: str, rows: List[List[str]], error_rows: List[int],
+                 signature: Optional[Tuple[int, int]]):
+        self.path = path
+        self.encoding = encoding
+        self.rows = rows              # 空行を除き、各列の前後の空白を削除した全行
+        self.error_rows = error_rows  # エラーメッセージを含む行の番号（rowsの添字）
+        self.signature = signature
+
+    @property
+    def has_errors(self) -> bool:
+        return bool(self.error_rows)
+
+    def valid_rows(self) -> List[List[str]]:
+        """エラー行と列数が足りない行を除いた行（呼び出し側で書き換えても良いようにコピーを返す）"""
+        errors = set(self.error_rows)
+        return [list(row) for i, row in enumerate(self.rows) if i not in errors and len(row) >= 3]
+
+    def is_current(self) -> bool:
+        """読み込んだ後にファイルが書き換えられていないか"""
+        return _file_signature(self.path) == self.signature
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_results_csv(csv_path: str) -> ResultsTable:
+    """
+    CSVを1回だけ読み込み、Shift-JIS→UTF-8の順でデコードしてパースする
+    エラーメッセージを含む行の検出も同じループで行う
+    """
+    signature = _file_signature(csv_path)
+    with open(csv_path, 'rb') as f:
+        raw = f.read()
+
+    for encoding in ENCODINGS:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError("CSVファイルのエンコーディングが対応していません")
+
+    rows = []
+    error_rows = []
+    for row in csv.reader(io.StringIO(text, newline='')):
+        # 空行をスキップ
+        if not row or not any(row):
+            continue
+        if any(ERROR_MARKER in col for col in row):
+            error_rows.append(len(rows))
+        # 各列の前後の空白を削除
+        rows.append([col.strip() if col else "" for col in row])
+    return ResultsTable(csv_path, encoding, rows, error_rows, signature)
@@ -0,0 +1,236 @@
+#同じレシートの画像（同じファイルのコピーや、保存し直しただけの画像）を、APIに送る前に見つけてまとめる部分
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from process_pool import process_pool
+
+# 同じ店のレシートはレイアウトが同じなので、縮小画像のハッシュはほとんど同じになる
+# ハッシュは候補を絞るためだけに使い、最後は元の解像度の画素で確かめる
+DEFAULT_MAX_DISTANCE = 1
+DHASH_SIZE = 8
+PHASH_SIZE = 32
+PHASH_LOW = 8
+# 画素で確かめるときに、JPEGの保存し直しによる誤差とみなす明るさの差
+PIXEL_TOLERANCE = 48
+# 画素を比べる区画の大きさと、区画内でこの割合を超える画素が違えば別の画像とみなす（日付や金額の数字1つでも見分ける）
+PIXEL_BLOCK = 32
+MAX_BLOCK_DIFF_RATIO = 0.01
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _load_thumbnails(image_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ハッシュの計算に使う小さいグレースケール画像（dHash用9x8・pHash用32x32）を作る
+    ProcessPoolExecutorから呼ばれるのでモジュール直下の関数にしている
+    """
+    with Image.open(image_path) as img:
+        # JPEGは縮小しながら読み込めるので、元の大きさでデコードしない
+        img.draft("L", (PHASH_SIZE * 4, PHASH_SIZE * 4))
+        gray = ImageOps.exif_transpose(img).convert("L")
+        small = np.asarray(gray.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS), dtype=np.int16)
+        large = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+    return small, large
+
+
+def _file_digest(image_path: str) -> str:
+    h = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_pixels(image_path: str) -> Image.Image:
+    with Image.open(image_path) as img:
+        return ImageOps.exif_transpose(img).convert("L")
+
+
+def pixels_match(path_a: str, path_b: str) -> bool:
+    """
+    2枚の画像が元の解像度で同じ内容かどうか（ProcessPoolExecutorから呼ばれる）
+    大きさが違う場合は縦横比が同じときだけ小さい方に合わせる
+    区画ごとに違う画素の割合を見るので、全体のほとんどが同じでも数字が1つ違えば別の画像になる
+    """
+    a, b = _load_pixels(path_a), _load_pixels(path_b)
+    if a.size != b.size:
+        (wa, ha), (wb, hb) = a.size, b.size
+        if abs(wa / ha - wb / hb) > 0.01:
+            return False
+        if wa * ha > wb * hb:
+            a = a.resize(b.size, Image.LANCZOS)
+        else:
+            b = b.resize(a.size, Image.LANCZOS)
+    diff = np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)) > PIXEL_TOLERANCE
+    height = -(-diff.shape[0] // PIXEL_BLOCK) * PIXEL_BLOCK
+    width = -(-diff.shape[1] // PIXEL_BLOCK) * PIXEL_BLOCK
+    padded = np.zeros((height, width), dtype=bool)
+    padded[:diff.shape[0], :diff.shape[1]] = diff
+    blocks = padded.reshape(height // PIXEL_BLOCK, PIXEL_BLOCK, width // PIXEL_BLOCK, PIXEL_BLOCK).sum(axis=(1, 3))
+    return int(blocks.max()) <= PIXEL_BLOCK * PIXEL_BLOCK * MAX_BLOCK_DIFF_RATIO
+
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """(n, 64)のbool配列を64bitの整数n個にする"""
+    return np.packbits(bits.astype(np.uint8), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)[:, None]
+    x = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def dhash(small: np.ndarray) -> np.ndarray:
+    """隣り合う画素の明るさの大小からハッシュを作る（small: (n, 8, 9)）"""
+    return _pack_bits((small[:, :, 1:] > small[:, :, :-1]).reshape(len(small), -1))
+
+
+def phash(large: np.ndarray) -> np.ndarray:
+    """DCTの低周波成分が中央値より大きいかどうかでハッシュを作る（large: (n, 32, 32)）"""
+    matrix = _dct_matrix(PHASH_SIZE)
+    coefficients = matrix @ large @ matrix.T
+    low = coefficients[:, :PHASH_LOW, :PHASH_LOW].reshape(len(large), -1)
+    # 直流成分（全体の明るさ）は中央値の計算から外す
+    median = np.median(low[:, 1:], axis=1)
+    return _pack_bits(low > median[:, None])
+
+
+def compute_hashes(paths: List[str], workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """
+    画像ごとのdHashとpHashをまとめて計算する
+    Returns:
+        (dHash, pHash, 読み込めた画像の添字)  読み込めない画像はハッシュを作らず、重複なしとして扱う
+    """
+    smalls, larges, indexes = [], [], []
+    with process_pool(len(paths), workers) as pool:
+        futures = [pool.submit(_load_thumbnails, path) for path in paths]
+        for i, future in enumerate(futures):
+            try:
+                small, large = future.result()
+            except Exception as e:
+                print(f"重複チェック用の読み込みエラー {paths[i]}: {str(e)}")
+                continue
+            smalls.append(small)
+            larges.append(large)
+            indexes.append(i)
+    if not indexes:
+        empty = np.zeros(0, dtype=np.uint64)
+        return empty, empty, indexes
+    return dhash(np.stack(smalls)), phash(np.stack(larges)), indexes
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """64bitハッシュ同士の異なるビットの数"""
+    x = np.atleast_1d(np.bitwise_xor(a, b))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    # NumPy 2.0より前はバイトごとの表で数える
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[x.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class HammingIndex:
+    """
+    ハミング距離がmax_distance以下のハッシュの組を探すための索引
+    64bitを(max_distance+1)個の区間に分けると、距離がmax_distance以下の2つは少なくとも1つの区間が完全に一致する
+    区間ごとに値で分類し、同じ値になった組だけを比べるので、全組を比べる必要がない
+    """
+    def __init__(self, hashes: np.ndarray, max_distance: int):
+        self.hashes = hashes
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = -(-64 // bands)
+        self._buckets: List[Dict[int, List[int]]] = []
+        for band in range(bands):
+            shift = np.uint64(band * width)
+            mask = np.uint64((1 << min(width, 64 - band * width)) - 1)
+            values = (hashes >> shift) & mask
+            buckets: Dict[int, List[int]] = {}
+            for i, value in enumerate(values.tolist()):
+                buckets.setdefault(value, []).append(i)
+            self._buckets.append(buckets)
+
+    def candidate_pairs(self) -> List[Tuple[int, int]]:
+        """いずれかの区間が一致する組（i < j）"""
+        pairs = set()
+        for buckets in self._buckets:
+            for members in buckets.values():
+                for a in range(len(members)):
+                    for b in range(a + 1, len(members)):
+                        pairs.add((members[a], members[b]))
+        return sorted(pairs)
+
+    def close_pairs(self) -> List[Tuple[int, int]]:
+        """ハミング距離がmax_distance以下の組"""
+        pairs = self.candidate_pairs()
+        if not pairs:
+            return []
+        left, right = np.array(pairs).T
+        distances = hamming_distance(self.hashes[left], self.hashes[right])
+        return [pair for pair, distance in zip(pairs, distances.tolist()) if distance <= self.max_distance]
+
+
+def find_duplicates(paths: List[str], max_distance: int = DEFAULT_MAX_DISTANCE,
+                    workers: Optional[int] = None) -> Dict[str, str]:
+    """
+    同じ画像をまとめ、{重複した画像のパス: 代表の画像のパス} を返す
+    ファイルの中身が同じ画像はそのまままとめる。それ以外は、dHashとpHashの両方がmax_distance以内の組を
+    元の解像度の画素で比べ（pixels_match）、同じだった場合だけまとめる（同じ店の別のレシートはまとめない）
+    代表はpathsの中で最初に出てくる画像
+    """
+    if len(paths) < 2:
+        return {}
+    parent = list(range(len(paths)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(a: int, b: int) -> None:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            # 添字の小さい方（先に出てくる画像）を代表にする
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    with process_pool(len(paths), workers) as pool:
+        first_seen: Dict[str, int] = {}
+        for i, future in enumerate([pool.submit(_file_digest, path) for path in paths]):
+            try:
+                digest = future.result()
+            except OSError:
+                continue
+            if digest in first_seen:
+                union(first_seen[digest], i)
+            else:
+                first_seen[digest] = i
+
+    d_hashes, p_hashes, indexes = compute_hashes(paths, workers)
+    if len(indexes) >= 2:
+        candidates = []
+        for a, b in HammingIndex(d_hashes, max_distance).close_pairs():
+            path_a, path_b = indexes[a], indexes[b]
+            if find(path_a) != find(path_b) and int(hamming_distance(p_hashes[a], p_hashes[b])[0]) <= max_distance:
+                candidates.append((path_a, path_b))
+        if candidates:
+            with process_pool(len(candidates), workers) as pool:
+                futures = [pool.submit(pixels_match, paths[a], paths[b]) for a, b in candidates]
+                for (a, b), future in zip(candidates, futures):
+                    try:
+                        if future.result():
+                            union(a, b)
+                    except Exception as e:
+                        print(f"重複チェックの比較エラー {paths[a]}: {str(e)}")
+
+    duplicates = {}
+    for i in range(len(paths)):
+        root = find(i)
+        if root != i:
+            duplicates[paths[i]] = paths[root]
+    return duplicates
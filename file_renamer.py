@@ -3,20 +3,57 @@ import csv
 import shutil
 from datetime import datetime
 import re
-from typing import Tuple, List, Dict
+import threading
+from typing import Callable, Tuple, List, Dict, Optional, Set
+from csv_loader import ERROR_ROWS_MESSAGE, ResultsTable, load_results_csv
+from rename_journal import RenameJournal
+from receipt_index import ReceiptIndex
+from tracing import traced
 
 class FileRenamer:
-    def __init__(self, csv_path: str, target_dir: str):
+    def __init__(self, csv_path: str, target_dir: str, table: Optional[ResultsTable] = None,
+                 journal: Optional[RenameJournal] = None, receipt_index: Optional[ReceiptIndex] = None):
         self.csv_path = csv_path
         self.target_dir = target_dir
+        # 元に戻すためのジャーナル（渡された場合はリネームの前に記録する）
+        self.journal = journal
+        # 渡された場合はリネーム後のファイル名をインデックスにも反映する
+        self.receipt_index = receipt_index
+        # 事前チェックで読み込み済みのCSVがあれば使い回す
+        self.table = table
         self.renamed_files: Dict[str, str] = {}
         self.errors: List[str] = []
         self.different_year_files: List[tuple[str, str]] = []  # 年が異なるファイルを記録
+        # フォルダ内のファイル名の一覧（最初に1回だけscandirで作り、リネームのたびに更新する）
+        self._dir_index: Optional[Set[str]] = None
+        # 連番を付けたファイル名ごとの、次に試す番号
+        self._suffix_counters: Dict[str, int] = {}
+
+    def _index(self) -> Set[str]:
+        """フォルダ内のファイル名の一覧（Windowsでは大文字小文字を区別しない）"""
+        if self._dir_index is None:
+            with os.scandir(self.target_dir) as entries:
+                self._dir_index = {os.path.normcase(entry.name) for entry in entries}
+        return self._dir_index
+
+    def _name_exists(self, filename: str) -> bool:
+        return os.path.normcase(filename) in self._index()
+
+    def _record_rename(self, old_filename: str, new_filename: str) -> None:
+        index = self._index()
+        index.discard(os.path.normcase(old_filename))
+        index.add(os.path.normcase(new_filename))
 
     def validate_csv_exists(self) -> bool:
         """CSVファイルの存在チェック"""
         return os.path.exists(self.csv_path)
 
+    def _load_table(self) -> ResultsTable:
+        """CSVを読み込む（読み込み済みで、その後ファイルが変わっていなければ読み直さない）"""
+        if self.table is None or not self.table.is_current():
+            self.table = load_results_csv(self.csv_path)
+        return self.table
+
     def check_csv_content(self) -> Tuple[bool, str]:
         """
         CSVファイルの内容をチェック
@@ -24,15 +61,8 @@ class FileRenamer:
             Tuple[bool, str]: (エラーあり, エラーメッセージ)
         """
         try:
-            encodings = ['shift_jis', 'utf-8']
-            for encoding in encodings:
-                try:
-                    with open(self.csv_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                        if "申し訳ありません" in content:
-                            return True, "CSVファイルにエラーメッセージが含まれています。\n先にCSVファイルの内容を修正してください。\n\n修正方法：\n1. CSVファイルを開いて、「申し訳ありません」を含む行を削除\n2. または、update_csv.pyを実行してCSVファイルを更新"
-                except UnicodeDecodeError:
-                    continue
+            if self._load_table().has_errors:
+                return True, ERROR_ROWS_MESSAGE
             return False, ""
         except Exception as e:
             return True, f"CSVファイルの読み込み中にエラーが発生しました: {str(e)}"
@@ -41,29 +71,9 @@ class FileRenamer:
         """
         CSVファイルを適切なエンコーディングで読み込む
         Shift-JISを優先し、失敗した場合はUTF-8を試みる
+        空行・エラーメッセージを含む行・列が足りない行は除く
         """
-        encodings = ['shift_jis', 'utf-8']
-        for encoding in encodings:
-            try:
-                with open(self.csv_path, 'r', encoding=encoding) as f:
-                    reader = csv.reader(f)
-                    # 全行を読み込んでフィルタリング
-                    rows = []
-                    for row in reader:
-                        # 空行をスキップ
-                        if not row or not any(row):
-                            continue
-                        # エラーメッセージを含む行をスキップ
-                        if any("申し訳ありません" in col for col in row):
-                            continue
-                        # 各列の前後の空白を削除
-                        row = [col.strip() if col else "" for col in row]
-                        if len(row) >= 3:  # 必要な列が存在する場合のみ追加
-                            rows.append(row)
-                    return rows
-            except UnicodeDecodeError:
-                continue
-        raise ValueError("CSVファイルのエンコーディングが対応していません")
+        return self._load_table().valid_rows()
 
     def sanitize_filename(self, filename: str) -> str:
         """ファイル名から不正な文字を除去"""
@@ -105,14 +115,17 @@ class FileRenamer:
         # 新しいファイル名の生成
         new_filename = f"{date}_{store}{ext}"
         
-        # 重複チェックと連番付与
-        counter = 1
+        # 重複チェックと連番付与（ディスクではなくフォルダの一覧で確認する）
         base_filename = new_filename
-        while os.path.exists(os.path.join(self.target_dir, new_filename)):
-            name, ext = os.path.splitext(base_filename)
+        base_key = os.path.normcase(base_filename)
+        counter = self._suffix_counters.get(base_key, 1)
+        name, ext = os.path.splitext(base_filename)
+        while self._name_exists(new_filename):
             new_filename = f"{name}({counter}){ext}"
             counter += 1
-            
+        if new_filename != base_filename:
+            self._suffix_counters[base_key] = counter
+
         return new_filename
 
     def update_csv_with_renamed_files(self) -> None:
@@ -138,10 +151,27 @@ class FileRenamer:
         with open(self.csv_path, 'w', encoding='shift_jis', newline='') as f:
             writer = csv.writer(f)
             writer.writerows(data)
+        self.table = None
+
+    def _update_index(self) -> None:
+        if self.receipt_index is None:
+            return
+        try:
+            self.receipt_index.record_renames(self.target_dir, self.renamed_files)
+        except Exception as e:
+            # インデックスはCSVから取り込み直せるので、リネーム自体は失敗にしない
+            print(f"インデックスの更新エラー: {str(e)}")
 
-    def rename_files(self) -> Tuple[int, int, List[str]]:
+    @traced("rename")
+    def rename_files(self, progress_callback: Optional[Callable[[int, int], None]] = None,
+                     cancel_event: Optional[threading.Event] = None,
+                     log_callback: Optional[Callable[[str], None]] = None) -> Tuple[int, int, List[str]]:
         """
         ファイルのリネーム処理を実行
+        Args:
+            progress_callback: (処理した行数, 全行数) を受け取る関数
+            cancel_event: セットされると残りの行はリネームせずに終わる（それまでの分はCSVに反映する）
+            log_callback: エラーが起きるたびにそのメッセージを受け取る関数（終わるのを待たずに画面に出す場合）
         Returns:
             Tuple[成功件数, 失敗件数, エラーメッセージリスト]
         """
@@ -155,14 +185,24 @@ class FileRenamer:
 
         success_count = 0
         error_count = 0
+
+        def add_error(message: str) -> None:
+            self.errors.append(message)
+            if log_callback:
+                log_callback(message)
         
         try:
             data = self.read_csv_with_encoding()
             
-            for row in data:
+            for row_index, row in enumerate(data):
+                if cancel_event is not None and cancel_event.is_set():
+                    add_error(f"中止しました（{len(data) - row_index}件は未処理）")
+                    break
+                if progress_callback:
+                    progress_callback(row_index, len(data))
                 try:
                     if len(row) < 3:
-                        self.errors.append(f"データ不足: {','.join(row)}")
+                        add_error(f"データ不足: {','.join(row)}")
                         error_count += 1
                         continue
                         
@@ -171,31 +211,35 @@ class FileRenamer:
                     
                     # 日付の妥当性チェック
                     if not self.validate_date(date):
-                        self.errors.append(f"無効な日付: {old_filename} - {date}")
+                        add_error(f"無効な日付: {old_filename} - {date}")
                         error_count += 1
                         continue
                     
                     # ファイルの存在確認
                     old_path = os.path.join(self.target_dir, old_filename)
-                    if not os.path.exists(old_path):
-                        self.errors.append(f"ファイルが見つかりません: {old_filename}")
+                    if not self._name_exists(old_filename):
+                        add_error(f"ファイルが見つかりません: {old_filename}")
                         error_count += 1
                         continue
                     
                     # ファイル名変更
                     new_filename = self.generate_new_filename(old_filename, date, store)
                     new_path = os.path.join(self.target_dir, new_filename)
+                    if self.journal is not None:
+                        self.journal.record(old_filename, new_filename)
                     os.rename(old_path, new_path)
+                    self._record_rename(old_filename, new_filename)
                     self.renamed_files[old_filename] = new_filename
                     success_count += 1
                     
                 except Exception as e:
-                    self.errors.append(f"リネーム失敗 {old_filename if 'old_filename' in locals() else '不明'}: {str(e)}")
+                    add_error(f"リネーム失敗 {old_filename if 'old_filename' in locals() else '不明'}: {str(e)}")
                     error_count += 1
 
             # CSVファイルの更新
             if success_count > 0:
                 self.update_csv_with_renamed_files()
+                self._update_index()
             
             # 年の違いがあるファイルの報告を追加
             if self.different_year_files:
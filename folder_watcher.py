@@ -0,0 +1,172 @@
+#フォルダを監視して、新しく置かれた画像を順次処理に回す部分
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from batch_journal import file_signature
+from batch_processor import IMAGE_EXTENSIONS
+
+# inotifyのイベント（linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_image(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class _PollingBackend:
+    """一定間隔でフォルダを見に行く方式（Windowsなどinotifyが使えない環境用）"""
+    def __init__(self, folder: str, interval: float):
+        self.folder = folder
+        self.interval = interval
+        self._known: Dict[str, Tuple[int, int]] = {}
+        self._scan()
+
+    def _scan(self) -> Set[str]:
+        changed = set()
+        current = {}
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or not _is_image(entry.name):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            current[entry.name] = (st.st_size, st.st_mtime_ns)
+            if self._known.get(entry.name) != current[entry.name]:
+                changed.add(entry.name)
+        self._known = current
+        return changed
+
+    def wait(self, stop_event: threading.Event) -> Set[str]:
+        stop_event.wait(self.interval)
+        return self._scan()
+
+    def close(self) -> None:
+        pass
+
+
+class _InotifyBackend:
+    """Linuxのinotifyでファイルの追加・書き込み完了を受け取る方式"""
+    def __init__(self, folder: str, interval: float):
+        self.interval = interval
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1に失敗しました")
+        mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watchに失敗しました")
+
+    def wait(self, stop_event: threading.Event) -> Set[str]:
+        changed = set()
+        readable, _, _ = select.select([self._fd], [], [], self.interval)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(sys.getfilesystemencoding(), "replace")
+            offset += length
+            if name and _is_image(name):
+                changed.add(name)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class FolderWatcher:
+    """
+    フォルダに置かれた画像を検知し、書き込みが落ち着いたものからコールバックに渡す
+    サイズと更新日時がsettle_seconds秒変わらなければ書き込み完了とみなす
+    """
+    def __init__(self, folder: str, on_ready: Callable[[List[str]], None],
+                 settle_seconds: float = 2.0, poll_interval: float = 1.0, process_existing: bool = True):
+        self.folder = folder
+        self.on_ready = on_ready
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.process_existing = process_existing
+        self.errors: List[str] = []
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _create_backend(self):
+        if sys.platform.startswith("linux"):
+            try:
+                return _InotifyBackend(self.folder, self.poll_interval)
+            except (OSError, AttributeError) as e:
+                print(f"inotifyが使えないためポーリングで監視します: {str(e)}")
+        return _PollingBackend(self.folder, self.poll_interval)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="FolderWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        backend = self._create_backend()
+        # 書き込み中かどうかを判定するため、最後にサイズか更新日時が変わった時刻を覚えておく
+        pending: Dict[str, Tuple[Optional[dict], float]] = {}
+        if self.process_existing:
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and _is_image(entry.name):
+                    pending[entry.name] = (None, time.monotonic())
+        try:
+            while not self._stop_event.is_set():
+                for name in backend.wait(self._stop_event):
+                    pending[name] = (None, time.monotonic())
+                ready = self._collect_ready(pending)
+                if ready:
+                    try:
+                        self.on_ready(ready)
+                    except Exception as e:
+                        self.errors.append(str(e))
+                        print(f"監視中の処理エラー: {str(e)}")
+        finally:
+            backend.close()
+
+    def _collect_ready(self, pending: Dict[str, Tuple[Optional[dict], float]]) -> List[str]:
+        now = time.monotonic()
+        ready = []
+        for name, (last_signature, changed_at) in list(pending.items()):
+            path = os.path.join(self.folder, name)
+            signature = file_signature(path)
+            if signature is None:
+                # 一時ファイルが消えた、または別名に変えられた
+                del pending[name]
+            elif signature != last_signature:
+                pending[name] = (signature, now)
+            elif now - changed_at >= self.settle_seconds:
+                ready.append(path)
+                del pending[name]
+        return sorted(ready)
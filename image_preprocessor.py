@@ -0,0 +1,201 @@
+#APIに送る前に画像を縮小する部分（元のファイルは書き換えない）
+import io
+import math
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+DEFAULT_JPEG_QUALITY = 85
+# レシートの範囲を探すときに使う画像の長辺のピクセル数
+CROP_ANALYSIS_SIZE = 512
+# 見つかった範囲がこれより小さい場合は誤検出とみなして切り抜かない（画像全体に対する割合）
+MIN_CROP_AREA = 0.05
+# 見つかった範囲がこれより大きい場合は切り抜いても得がないので切り抜かない
+MAX_CROP_AREA = 0.9
+# 傾きの補正はこの範囲の角度の場合だけ行う（それより大きいものは誤検出の可能性が高い）
+MIN_DESKEW_DEGREES = 0.5
+MAX_DESKEW_DEGREES = 15.0
+CROP_MARGIN = 0.02
+# EXIFの向き（1が回転なし）
+EXIF_ORIENTATION_TAG = 0x0112
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+def guess_image_mime(image_path: str) -> str:
+    """拡張子から画像のMIMEタイプを返す"""
+    return MIME_TYPES.get(os.path.splitext(image_path)[1].lower(), "image/jpeg")
+
+
+class PreprocessedImage:
+    """前処理済みの画像データ（プロセス間で受け渡せるようにbytesだけを持つ）"""
+    def __init__(self, data: bytes, mime: str, original_bytes: int):
+        self.data = data
+        self.mime = mime
+        self.original_bytes = original_bytes
+
+    @property
+    def sent_bytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.sent_bytes
+
+
+def _otsu_threshold(pixels: np.ndarray) -> Tuple[float, float]:
+    """大津の方法で明るさのしきい値を決める（しきい値, 明るい側の画素の割合）"""
+    histogram = np.bincount(pixels.ravel().astype(np.uint8), minlength=256).astype(np.float64)
+    probability = histogram / histogram.sum()
+    omega = np.cumsum(probability)
+    mu = np.cumsum(probability * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    if np.all(np.isnan(between)):
+        # 全体が同じ明るさ
+        return 0.0, 0.0
+    threshold = int(np.nanargmax(between))
+    return float(threshold), float(1 - omega[threshold])
+
+
+def _fill_gaps(mask: np.ndarray, radius: int) -> np.ndarray:
+    """周りの画素の半分以上が明るい画素を明るいとみなし、文字などの小さな暗い部分を埋める"""
+    size = 2 * radius + 1
+    padded = np.pad(mask.astype(np.float64), radius, mode="edge")
+    integral = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    total = (integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size])
+    return total / (size * size) > 0.5
+
+
+def _skew_degrees(mask: np.ndarray) -> float:
+    """明るい部分（レシート）の長い方の軸が、縦または横からどれだけ傾いているか（反時計回りが正）"""
+    ys, xs = np.nonzero(mask)
+    if len(xs) < 100:
+        return 0.0
+    covariance = np.cov(np.vstack([xs, ys]).astype(np.float64))
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    vx, vy = eigenvectors[:, np.argmax(eigenvalues)]
+    # 画像の座標はyが下向きなので、縦軸からの角度をそのまま反時計回りの回転量として使える
+    angle = math.degrees(math.atan2(vx, vy))
+    angle = (angle + 90) % 180 - 90
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return -angle
+
+
+def _longest_run(flags: np.ndarray) -> Optional[Tuple[int, int]]:
+    """Trueが最も長く続く範囲（開始, 終了+1）"""
+    best, start = None, None
+    for i, flag in enumerate(np.append(flags, False)):
+        if flag and start is None:
+            start = i
+        elif not flag and start is not None:
+            if best is None or i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+    return best
+
+
+def _bright_box(mask: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """明るい画素が多い行・列が続く範囲を、レシートの範囲（左, 上, 右, 下）とする"""
+    rows = mask.mean(axis=1)
+    row_run = _longest_run(rows > 0.5 * np.percentile(rows, 95))
+    if row_run is None:
+        return None
+    columns = mask[row_run[0]:row_run[1]].mean(axis=0)
+    column_run = _longest_run(columns > 0.5 * np.percentile(columns, 95))
+    if column_run is None:
+        return None
+    return column_run[0], row_run[0], column_run[1], row_run[1]
+
+
+def crop_receipt(img: Image.Image) -> Optional[Image.Image]:
+    """
+    背景（机など）より明るいレシートの範囲を探し、傾きを直して切り抜く
+    見つからない場合や、切り抜いても小さくならない場合はNoneを返す
+    """
+    small = img.convert("L")
+    small.thumbnail((CROP_ANALYSIS_SIZE, CROP_ANALYSIS_SIZE), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.float64)
+    threshold, bright_ratio = _otsu_threshold(pixels)
+    if not 0.05 <= bright_ratio <= 0.95:
+        # 背景とレシートの区別がつかない
+        return None
+
+    mask = _fill_gaps(pixels > threshold, max(1, max(pixels.shape) // 50))
+    angle = _skew_degrees(mask)
+    if not MIN_DESKEW_DEGREES <= abs(angle) <= MAX_DESKEW_DEGREES:
+        angle = 0.0
+    if angle:
+        mask_image = Image.fromarray(mask.astype(np.uint8) * 255).rotate(angle, Image.NEAREST, expand=True)
+        mask = np.asarray(mask_image) > 127
+
+    box = _bright_box(mask)
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    area = (right - left) * (bottom - top) / mask.size
+    if area < MIN_CROP_AREA:
+        return None
+    if area > MAX_CROP_AREA and not angle:
+        return None
+
+    if angle:
+        fill = (255,) * len(img.getbands()) if len(img.getbands()) > 1 else 255
+        img = img.rotate(angle, Image.BICUBIC, expand=True, fillcolor=fill)
+    scale_x = img.width / mask.shape[1]
+    scale_y = img.height / mask.shape[0]
+    margin_x = int(img.width * CROP_MARGIN)
+    margin_y = int(img.height * CROP_MARGIN)
+    return img.crop((max(0, int(left * scale_x) - margin_x), max(0, int(top * scale_y) - margin_y),
+                     min(img.width, int(right * scale_x) + margin_x), min(img.height, int(bottom * scale_y) + margin_y)))
+
+
+def preprocess_image(image_path: str, max_size: int, quality: int = DEFAULT_JPEG_QUALITY,
+                     auto_crop: bool = False) -> PreprocessedImage:
+    """
+    画像を読み込み、EXIFの向きを反映してmax_size以内に縮小し、メモリ上でJPEGにする
+    auto_cropがTrueの場合は、先にレシートの範囲だけを傾きを直して切り抜く
+    ProcessPoolExecutorから呼ばれるのでモジュール直下の関数にしている
+    """
+    with open(image_path, "rb") as f:
+        original = f.read()
+
+    with Image.open(io.BytesIO(original)) as img:
+        # exif_transposeは向きが変わらなくても新しい画像を返すので、回転したかどうかはEXIFの向きで判定する
+        upright = img.getexif().get(EXIF_ORIENTATION_TAG, 1) in (None, 0, 1)
+        rotated = ImageOps.exif_transpose(img)
+        cropped = crop_receipt(rotated) if auto_crop else None
+        if cropped is not None:
+            rotated = cropped
+        if max(rotated.size) > max_size:
+            rotated.thumbnail((max_size, max_size), Image.LANCZOS)
+        data = _encode_jpeg(rotated, quality)
+
+    # 向きも切り抜きも変わらない場合は、元の画像でも同じ内容なので小さい方を送る
+    # （圧縮済みの小さなJPEGは、再エンコードするとかえって大きくなることがある）
+    if upright and cropped is None and len(data) >= len(original):
+        return PreprocessedImage(original, guess_image_mime(image_path), len(original))
+    return PreprocessedImage(data, "image/jpeg", len(original))
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    if img.mode in ("RGBA", "LA", "P"):
+        # 透過部分は白で塗りつぶす
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
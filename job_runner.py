@@ -0,0 +1,132 @@
+#時間のかかる処理を別スレッドで順番に実行し、画面を固まらせないための部分
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobContext:
+    """ジョブの関数に渡される、進捗・ログの通知と中止の確認のためのオブジェクト"""
+    def __init__(self, job: "Job", messages: "queue.Queue"):
+        self._job = job
+        self._messages = messages
+
+    @property
+    def cancel_event(self) -> threading.Event:
+        return self._job.cancel_event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job.cancel_event.is_set()
+
+    def progress(self, done: int, total: int) -> None:
+        self._messages.put((self._job, "progress", (done, total)))
+
+    def log(self, text: str) -> None:
+        self._messages.put((self._job, "log", text))
+
+
+class Job:
+    """キューに入れた1件の処理"""
+    def __init__(self, name: str, func: Callable[[JobContext], Any],
+                 on_progress: Optional[Callable[[int, int], None]] = None,
+                 on_log: Optional[Callable[[str], None]] = None,
+                 on_done: Optional[Callable[["Job"], None]] = None):
+        self.name = name
+        self.func = func
+        self.on_progress = on_progress
+        self.on_log = on_log
+        self.on_done = on_done
+        self.status = QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self) -> None:
+        """中止を依頼する（実行中の場合は、関数が中止を確認したところで止まる）"""
+        self.cancel_event.set()
+
+
+class JobRunner:
+    """
+    ジョブを別スレッドで実行し、進捗・ログ・結果をキュー経由で画面側のスレッドに渡す
+    キューはTkのafter()で定期的に取り出すので、コールバックの中では画面を自由に操作してよい
+    """
+    def __init__(self, root, max_parallel: int = 1, poll_ms: int = 100):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.jobs: List[Job] = []
+        self._messages: "queue.Queue" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="JobRunner")
+        self._lock = threading.Lock()
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, name: str, func: Callable[[JobContext], Any],
+               on_progress: Optional[Callable[[int, int], None]] = None,
+               on_log: Optional[Callable[[str], None]] = None,
+               on_done: Optional[Callable[[Job], None]] = None) -> Job:
+        """ジョブをキューに入れる（実行中のジョブがあれば、終わってから順に実行する）"""
+        job = Job(name, func, on_progress, on_log, on_done)
+        with self._lock:
+            self.jobs.append(job)
+        self._executor.submit(self._execute, job)
+        return job
+
+    def _execute(self, job: Job) -> None:
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            self._messages.put((job, "done", None))
+            return
+        job.status = RUNNING
+        try:
+            job.result = job.func(JobContext(job, self._messages))
+            job.status = CANCELLED if job.cancel_event.is_set() else DONE
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            print(f"ジョブ「{job.name}」のエラー: {str(e)}")
+        self._messages.put((job, "done", None))
+
+    def _drain(self) -> None:
+        """キューに溜まった通知を画面側のスレッドで処理する"""
+        try:
+            while True:
+                job, kind, payload = self._messages.get_nowait()
+                try:
+                    if kind == "progress" and job.on_progress:
+                        job.on_progress(*payload)
+                    elif kind == "log" and job.on_log:
+                        job.on_log(payload)
+                    elif kind == "done":
+                        with self._lock:
+                            if job in self.jobs:
+                                self.jobs.remove(job)
+                        if job.on_done:
+                            job.on_done(job)
+                except Exception as e:
+                    # 通知先の画面が閉じられた場合など
+                    print(f"ジョブ「{job.name}」の通知エラー: {str(e)}")
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_ms, self._drain)
+
+    def active_jobs(self) -> List[Job]:
+        """実行中と待機中のジョブ"""
+        with self._lock:
+            return list(self.jobs)
+
+    def cancel_all(self) -> None:
+        for job in self.active_jobs():
+            job.cancel()
+
+    def shutdown(self) -> None:
+        """すべてのジョブに中止を依頼し、実行中のジョブが止まるのを待たずに終わる"""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
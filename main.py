@@ -1,17 +1,21 @@
+import multiprocessing
 import os
 from tkinter import Tk, Label, Button, Entry, StringVar, Frame, BooleanVar, IntVar, ttk
-from settings_manager import load_settings, save_settings
+from settings_store import get_settings_store
 from file_handler import select_folder, open_processed_folder
-from image_processor import process_images
-from ui_components import open_advanced_settings, open_rename_dialog
+from ui_components import open_advanced_settings, open_rename_dialog, run_batch_processing, toggle_folder_watch, cancel_jobs
+from job_runner import JobRunner
 
 def main():
     global api_key_var, max_size_var, resize_enabled_var
-    settings = load_settings()
+    settings = get_settings_store().load()
     
     root = Tk()
     root.title("AI_レシート一括処理")
 
+    # 時間のかかる処理は別スレッドで順番に実行する
+    job_runner = JobRunner(root)
+
     # Add a button to open advanced settings, positioned at the top right
     settings_frame = Frame(root)
     settings_frame.pack(anchor="ne", padx=20, pady=10)
@@ -36,20 +40,36 @@ def main():
     progress_bar = ttk.Progressbar(root, maximum=100, variable=progress_var, mode='determinate')
     progress_bar.pack(side="top", fill="x", padx=20, pady=(10, 5))
 
+    # 実行中の処理の状態表示
+    job_status_label = Label(root, text="")
+    job_status_label.pack(side="top", anchor="w", padx=20)
+
+    # フォルダ監視の状態表示
+    watch_status_label = Label(root, text="")
+    watch_status_label.pack(side="top", anchor="w", padx=20)
+
     # ボタンを配置するフレーム
     button_frame = Frame(root)
     button_frame.pack(side="top", fill="x", padx=20, pady=(0, 10))
 
     # Start processing button
-    process_button = Button(button_frame, text="レシート一括処理開始", command=lambda: process_images(api_key_var.get(), max_size_var.get(), resize_enabled_var.get(), folder_entry, progress_var, root))
+    process_button = Button(button_frame, text="レシート一括処理開始", command=lambda: run_batch_processing(job_runner, api_key_var.get(), max_size_var.get(), resize_enabled_var.get(), folder_entry, progress_var, job_status_label))
     process_button.configure(bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"))  # 緑色の背景と白い文字
     process_button.pack(side="left", expand=True, padx=5)
 
+    # 中止ボタン（実行中と順番待ちの処理を止める）
+    Button(button_frame, text="中止", command=lambda: cancel_jobs(job_runner, job_status_label)).pack(side="left", expand=True, padx=5)
+
+    # フォルダ監視ボタン（新しく置かれた画像をその都度処理する）
+    watch_button = Button(button_frame, text="フォルダ監視開始")
+    watch_button.configure(command=lambda: toggle_folder_watch(api_key_var.get(), max_size_var.get(), resize_enabled_var.get(), folder_entry, watch_button, watch_status_label, root))
+    watch_button.pack(side="left", expand=True, padx=5)
+
     # フォルダを開くボタン
     Button(button_frame, text="フォルダを開く", command=lambda: open_processed_folder(folder_entry.get())).pack(side="left", expand=True, padx=5)
 
     # ファイル名変更ボタン
-    rename_button = Button(button_frame, text="画像をリネーム", command=lambda: open_rename_dialog(root, folder_entry.get()))
+    rename_button = Button(button_frame, text="画像をリネーム", command=lambda: open_rename_dialog(root, folder_entry.get(), job_runner))
     rename_button.configure(bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"))  # 緑色の背景と白い文字
     rename_button.pack(side="left", expand=True, padx=5)
 
@@ -66,11 +86,14 @@ def main():
     resize_enabled_var = BooleanVar(value=settings["resize_enabled"])
 
     def on_close():
-        save_settings(api_key_var.get(), max_size_var.get(), resize_enabled_var.get())
+        get_settings_store().update(api_key=api_key_var.get(), max_size=max_size_var.get(), resize_enabled=resize_enabled_var.get())
+        job_runner.shutdown()
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_close)
     root.mainloop()
 
 if __name__ == "__main__":
+    # 画像の前処理を別プロセスで行うため（exe化した場合に必要）
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,125 @@
+#月ごと・勘定科目ごとの合計金額を、レシートの追加・修正のたびに差分だけ更新して、すぐに集計表を出せるようにする部分
+#合計はreceipt_index.dbの中にmonthly_totalsとして持ち、receiptsへの書き込みと同じトランザクションでトリガーが更新する
+import csv
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+UNKNOWN_ACCOUNT = "（勘定科目なし）"
+_MONTH_PATTERN = re.compile(r"^\s*(\d{4})[/\-年.](\d{1,2})")
+_TRIGGERS = ("monthly_totals_insert", "monthly_totals_delete", "monthly_totals_update_old", "monthly_totals_update_new")
+
+# 日付のない行は月が分からないので集計しない。金額が読めない行は件数だけ数える
+# ほかの画像と同じレシート（duplicate_ofがある行）は代表の画像の行で数えるので集計しない
+# トリガーの条件を変えたときはreceipt_index.SCHEMA_VERSIONを上げる（次に開いたときに1回だけ作り直す）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS monthly_totals (
+    month TEXT NOT NULL,
+    account TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    receipts INTEGER NOT NULL,
+    PRIMARY KEY (month, account)
+);
+CREATE TRIGGER IF NOT EXISTS monthly_totals_insert AFTER INSERT ON receipts
+WHEN NEW.date IS NOT NULL AND NEW.duplicate_of IS NULL
+BEGIN
+    INSERT INTO monthly_totals (month, account, amount, receipts)
+    VALUES (substr(NEW.date, 1, 7), COALESCE(NEW.account, ''), COALESCE(NEW.amount, 0), 1)
+    ON CONFLICT (month, account) DO UPDATE SET amount = amount + excluded.amount, receipts = receipts + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS monthly_totals_delete AFTER DELETE ON receipts
+WHEN OLD.date IS NOT NULL AND OLD.duplicate_of IS NULL
+BEGIN
+    UPDATE monthly_totals SET amount = amount - COALESCE(OLD.amount, 0), receipts = receipts - 1
+    WHERE month = substr(OLD.date, 1, 7) AND account = COALESCE(OLD.account, '');
+    DELETE FROM monthly_totals WHERE receipts <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS monthly_totals_update_old AFTER UPDATE OF date, amount, account, duplicate_of ON receipts
+WHEN OLD.date IS NOT NULL AND OLD.duplicate_of IS NULL
+BEGIN
+    UPDATE monthly_totals SET amount = amount - COALESCE(OLD.amount, 0), receipts = receipts - 1
+    WHERE month = substr(OLD.date, 1, 7) AND account = COALESCE(OLD.account, '');
+    DELETE FROM monthly_totals WHERE receipts <= 0;
+END;
+CREATE TRIGGER IF NOT EXISTS monthly_totals_update_new AFTER UPDATE OF date, amount, account, duplicate_of ON receipts
+WHEN NEW.date IS NOT NULL AND NEW.duplicate_of IS NULL
+BEGIN
+    INSERT INTO monthly_totals (month, account, amount, receipts)
+    VALUES (substr(NEW.date, 1, 7), COALESCE(NEW.account, ''), COALESCE(NEW.amount, 0), 1)
+    ON CONFLICT (month, account) DO UPDATE SET amount = amount + excluded.amount, receipts = receipts + 1;
+END;
+"""
+
+
+def normalize_month(value: str) -> Optional[str]:
+    """2025/1・2025-01・2025年1月 などを 2025-01 にする（月でなければNone）"""
+    match = _MONTH_PATTERN.match(value or "")
+    if not match:
+        return None
+    return f"{int(match.group(1)):04d}-{int(match.group(2)):02d}"
+
+
+def install(conn: sqlite3.Connection) -> None:
+    """
+    集計用のテーブルとトリガーを作り直し、全行から合計を作る（receiptsテーブルを作った後に呼ぶ）
+    古い条件のトリガーで数えた合計が残らないよう、インデックスの形式を上げたときに1回だけ呼ぶ
+    """
+    for trigger in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.executescript(_SCHEMA)
+    rebuild(conn)
+
+
+def rebuild(conn: sqlite3.Connection) -> None:
+    """合計を全行から作り直す（トリガーを通さずにreceiptsを書き換えた場合の修復用）"""
+    conn.execute("DELETE FROM monthly_totals")
+    conn.execute("INSERT INTO monthly_totals (month, account, amount, receipts) "
+                 "SELECT substr(date, 1, 7), COALESCE(account, ''), SUM(COALESCE(amount, 0)), COUNT(*) "
+                 "FROM receipts WHERE date IS NOT NULL AND duplicate_of IS NULL GROUP BY substr(date, 1, 7), COALESCE(account, '')")
+
+
+def monthly_summary(conn: sqlite3.Connection, month_from: Optional[str] = None,
+                    month_to: Optional[str] = None, account: Optional[str] = None) -> List[dict]:
+    """
+    月・勘定科目ごとの合計を返す（レシートの行数によらず、月数×勘定科目数の行を読むだけで済む）
+    Args:
+        month_from, month_to: 月の範囲（両端を含む。2024/01 の形でもよい）
+        account: 勘定科目（完全一致）
+    Returns:
+        {"month", "account", "amount", "receipts"} のリスト（月・勘定科目の順）
+    """
+    conditions, params = [], []
+    if month_from:
+        conditions.append("month >= ?")
+        params.append(normalize_month(month_from) or month_from)
+    if month_to:
+        conditions.append("month <= ?")
+        params.append(normalize_month(month_to) or month_to)
+    if account:
+        conditions.append("account = ?")
+        params.append(account)
+    sql = "SELECT month, account, amount, receipts FROM monthly_totals"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY month, account"
+    return [{"month": row[0], "account": row[1] or UNKNOWN_ACCOUNT, "amount": row[2], "receipts": row[3]}
+            for row in conn.execute(sql, params)]
+
+
+def write_summary_csv(csv_path: str, summary: List[dict]) -> None:
+    """
+    勘定科目を行・月を列にした集計表をCSVに書き出す（Excelでそのまま開けるようにShift-JISで書く）
+    最後の列と最後の行は合計
+    """
+    months = sorted({row["month"] for row in summary})
+    table: Dict[str, Dict[str, int]] = {}
+    for row in summary:
+        table.setdefault(row["account"], {})[row["month"]] = row["amount"]
+    with open(csv_path, 'w', encoding='shift_jis', errors='replace', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["勘定科目"] + months + ["合計"])
+        for account in sorted(table):
+            amounts = [table[account].get(month, 0) for month in months]
+            writer.writerow([account] + amounts + [sum(amounts)])
+        totals = [sum(table[account].get(month, 0) for account in table) for month in months]
+        writer.writerow(["合計"] + totals + [sum(totals)])
@@ -0,0 +1,29 @@
+#画像の縮小・画質チェック・重複チェックを別プロセスで行うためのExecutorを用意する部分
+#フォルダ監視では1〜2枚ずつ処理するので、そのたびにプロセスを起動すると処理そのものより起動の方が時間がかかる
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Optional
+
+# この件数以下の処理は別プロセスを起動せず、呼び出したスレッドでそのまま行う
+INLINE_MAX_JOBS = 2
+
+
+class InlineExecutor(Executor):
+    """submitした関数をその場で実行するExecutor（ProcessPoolExecutorと同じように使える）"""
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def process_pool(jobs: int, workers: Optional[int] = None) -> Executor:
+    """
+    jobs件の処理に使うExecutorを返す（withで使う）
+    INLINE_MAX_JOBS件以下の場合はプロセスを起動せずにその場で実行し、それより多い場合はworkers個までのプロセスで実行する
+    """
+    if jobs <= INLINE_MAX_JOBS:
+        return InlineExecutor()
+    return ProcessPoolExecutor(max_workers=max(1, min(workers or os.cpu_count() or 1, jobs)))
@@ -0,0 +1,130 @@
+#ピンぼけ・暗すぎる・何も写っていない画像を、APIに送る前に手元で見分ける部分
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from process_pool import process_pool
+
+REVIEW_LIST_NAME = "review_RyoSyuSyo.txt"
+# 判定に使う画像の長辺のピクセル数（撮影時の解像度によらず同じ基準で比べるため）
+ANALYSIS_SIZE = 1024
+# 文字の輪郭とみなす、隣の画素との明るさの差
+EDGE_THRESHOLD = 40
+
+# どの値も画像全体で測るので、白い紙にレシートが小さく写ったスキャンでも通るように、明らかにだめな画像だけを止める値にしている
+# 白い紙の上のレシートは全体の平均が明るく、ばらつきも小さくなるため、明るすぎる・コントラストが低いという判定はしない
+# （真っ白な画像や白飛びした画像は文字の輪郭がないので、min_text_densityで止まる）
+DEFAULT_THRESHOLDS = {
+    "min_sharpness": 3.0,        # ラプラシアンの分散（小さいほどぼけている）
+    "min_brightness": 20.0,      # 平均の明るさ（0〜255）
+    "min_text_density": 0.0005,  # 文字の輪郭とみなした画素の割合
+}
+
+REASON_LABELS = {
+    "min_sharpness": "ピンぼけ",
+    "min_brightness": "暗すぎる",
+    "min_text_density": "文字が見つからない",
+}
+
+
+def measure_image(image_path: str) -> Dict[str, float]:
+    """
+    画質の指標を計算する
+    ProcessPoolExecutorから呼ばれるのでモジュール直下の関数にしている
+    """
+    with Image.open(image_path) as img:
+        # JPEGは縮小しながら読み込めるので、元の大きさでデコードしない
+        img.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+        gray = ImageOps.exif_transpose(img).convert("L")
+        gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR)
+        pixels = np.asarray(gray, dtype=np.float32)
+
+    laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                 - 4 * pixels[1:-1, 1:-1])
+    edges = (np.abs(np.diff(pixels, axis=1))[:-1, :] > EDGE_THRESHOLD) | \
+            (np.abs(np.diff(pixels, axis=0))[:, :-1] > EDGE_THRESHOLD)
+    return {
+        "sharpness": float(laplacian.var()),
+        "brightness": float(pixels.mean()),
+        "text_density": float(edges.mean()),
+    }
+
+
+class QualityReport:
+    """1枚分の画質チェックの結果"""
+    def __init__(self, image_path: str, metrics: Dict[str, float], reasons: List[str]):
+        self.image_path = image_path
+        self.metrics = metrics
+        self.reasons = reasons
+
+    @property
+    def ok(self) -> bool:
+        return not self.reasons
+
+    def describe(self) -> str:
+        return "、".join(REASON_LABELS.get(reason, reason) for reason in self.reasons)
+
+
+class QualityGate:
+    """しきい値を満たさない画像を、APIに送らずに要確認リストへ回す"""
+    def __init__(self, thresholds: Optional[Dict[str, float]] = None, workers: Optional[int] = None):
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.workers = workers
+
+    @classmethod
+    def from_settings(cls, settings: dict, workers: Optional[int] = None) -> Optional["QualityGate"]:
+        """settings.jsonの"quality_gate"から作成する（無効の場合はNone）"""
+        options = dict(settings.get("quality_gate", {}))
+        if not options.pop("enabled", True):
+            return None
+        return cls({k: v for k, v in options.items() if k in DEFAULT_THRESHOLDS}, workers)
+
+    def evaluate(self, image_path: str, metrics: Dict[str, float]) -> QualityReport:
+        t = self.thresholds
+        reasons = []
+        if metrics["sharpness"] < t["min_sharpness"]:
+            reasons.append("min_sharpness")
+        if metrics["brightness"] < t["min_brightness"]:
+            reasons.append("min_brightness")
+        if metrics["text_density"] < t["min_text_density"]:
+            reasons.append("min_text_density")
+        return QualityReport(image_path, metrics, reasons)
+
+    def screen(self, paths: List[str]) -> Tuple[List[str], List[QualityReport]]:
+        """
+        画像を別プロセスでまとめてチェックする（フォルダ監視などで1〜2枚だけの場合はその場でチェックする）
+        Returns:
+            (送ってよい画像のパス, 要確認の画像の結果)  読み込めない画像はAPI側の結果に任せるため送る側に入れる
+        """
+        if not paths:
+            return [], []
+        passed, rejected = [], []
+        with process_pool(len(paths), self.workers) as pool:
+            futures = [pool.submit(measure_image, path) for path in paths]
+            for path, future in zip(paths, futures):
+                try:
+                    report = self.evaluate(path, future.result())
+                except Exception as e:
+                    print(f"画質チェックの読み込みエラー {path}: {str(e)}")
+                    passed.append(path)
+                    continue
+                if report.ok:
+                    passed.append(path)
+                else:
+                    rejected.append(report)
+        return passed, rejected
+
+
+def write_review_list(list_path: str, reports: List[QualityReport], append: bool = False) -> None:
+    """
+    要確認の画像と理由をファイルに書き出す（撮り直すか、しきい値を下げて再実行する）
+    append=Trueの場合は既存のリストの末尾に書き足す（フォルダ監視などで少しずつ処理する場合）
+    """
+    if not reports:
+        return
+    with open(list_path, 'a' if append else 'w', encoding='utf-8') as f:
+        for report in sorted(reports, key=lambda r: r.image_path):
+            metrics = ", ".join(f"{k}={v:.3f}" for k, v in report.metrics.items())
+            f.write(f"{report.image_path}: {report.describe()} ({metrics})\n")
@@ -0,0 +1,204 @@
+#APIのレート制限（429）に合わせてリクエストの量を調整する部分
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, TypeVar
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+T = TypeVar("T")
+
+# 1分あたりの上限は初期値では設けない（アカウントごとに上限が違うので、429とRetry-Afterに合わせて待つ）
+# 固定の見積もりで割ると、実際の上限よりずっと少ない枚数しか送れなくなるため
+DEFAULT_REQUESTS_PER_MINUTE: Optional[float] = None
+DEFAULT_TOKENS_PER_MINUTE: Optional[float] = None
+DEFAULT_MAX_RETRIES = 6
+# gpt-4oで画像1枚（768x1024程度に縮小される）を送った場合のおおよそのトークン数と、返答の分
+IMAGE_TOKEN_ESTIMATE = 765
+COMPLETION_TOKEN_ESTIMATE = 300
+
+
+class TokenBucket:
+    """1分あたりの上限を秒単位で少しずつ補充するトークンバケット"""
+    def __init__(self, per_minute: Optional[float], burst_seconds: float = 10.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.rate = per_minute / 60.0 if per_minute else None
+        # 一度に使える量は数秒分までにしておく（分の頭にまとめて投げると429になりやすいため）
+        self.capacity = max(1.0, self.rate * burst_seconds) if self.rate else 0.0
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """amount分を使えるようになるまでの秒数（上限なしの場合は常に0）"""
+        if self.rate is None:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate is None:
+            return
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdaptiveRateLimiter:
+    """
+    1分あたりのリクエスト数・トークン数の上限を守りつつ、同時実行数を429の発生状況に合わせて調整する
+    429が返ると同時実行数を半分にし、成功が続くと1ずつ戻す
+    clockはテストで時刻を差し替えるためのもの
+    """
+    def __init__(self, requests_per_minute: Optional[float] = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: Optional[float] = DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency: int = 4, min_concurrency: int = 1, increase_after: int = 10,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.increase_after = increase_after
+        self.concurrency = self.max_concurrency
+        self.rate_limited_count = 0
+        self._requests = TokenBucket(requests_per_minute, clock=clock)
+        self._tokens = TokenBucket(tokens_per_minute, clock=clock)
+        self._in_flight = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_settings(cls, settings: dict, max_concurrency: int) -> "AdaptiveRateLimiter":
+        """settings.jsonの"rate_limit"から作成する"""
+        options = settings.get("rate_limit", {})
+        return cls(options.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE),
+                   options.get("tokens_per_minute", DEFAULT_TOKENS_PER_MINUTE),
+                   max_concurrency)
+
+    @contextmanager
+    def slot(self, estimated_tokens: int = 0):
+        """リクエスト1回分の枠を確保する（空くまで待つ）"""
+        self._acquire(estimated_tokens)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def wait_seconds(self, estimated_tokens: int = 0) -> Optional[float]:
+        """
+        リクエストを送れるようになるまでの秒数（0なら今すぐ送れる）
+        同時実行数の上限に達している場合は、どれかが終わるまで待つのでNoneを返す
+        """
+        with self._cond:
+            now = self.clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._in_flight >= self.concurrency:
+                return None
+            return max(self._requests.delay(1), self._tokens.delay(estimated_tokens))
+
+    def _acquire(self, estimated_tokens: int) -> None:
+        with self._cond:
+            while True:
+                delay = self.wait_seconds(estimated_tokens)
+                if delay is None or delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._requests.take(1)
+                self._tokens.take(estimated_tokens)
+                self._in_flight += 1
+                return
+
+    def on_success(self) -> None:
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        with self._cond:
+            self.rate_limited_count += 1
+            self._successes = 0
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            if retry_after:
+                # 全ワーカーがRetry-Afterの間は投げないようにする
+                self._paused_until = max(self._paused_until, self.clock() + retry_after)
+            self._cond.notify_all()
+
+
+def estimate_request_tokens(prompt_text: str, image_count: int = 1) -> int:
+    """トークン数の上限管理に使う見積もり（日本語は1文字1トークン程度として数える）"""
+    return len(prompt_text) + (IMAGE_TOKEN_ESTIMATE + COMPLETION_TOKEN_ESTIMATE) * image_count
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """429のレスポンスヘッダ（retry-after-ms / retry-after）から待つべき秒数を取り出す"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # 日付形式のRetry-Afterは使わずに通常のバックオフにする
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """ジッター付きの指数バックオフ（0〜base*2^attempt秒のランダム）"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_retry(func: Callable[[], T], limiter: Optional[AdaptiveRateLimiter] = None, estimated_tokens: int = 0,
+                    max_retries: int = DEFAULT_MAX_RETRIES,
+                    on_retry: Optional[Callable[[int, Exception, float], None]] = None,
+                    sleep: Callable[[float], None] = time.sleep) -> T:
+    """
+    429・タイムアウト・接続エラー・5xxの場合は待ってから再試行する
+    再試行しても失敗した場合は最後の例外をそのまま投げる
+    sleepはテストで待ち時間を差し替えるためのもの
+    """
+    attempt = 0
+    while True:
+        error = None
+        try:
+            if limiter is None:
+                result = func()
+            else:
+                with limiter.slot(estimated_tokens):
+                    result = func()
+                limiter.on_success()
+            return result
+        except RateLimitError as e:
+            error = e
+            retry_after = retry_after_seconds(e)
+            if limiter is not None:
+                limiter.on_rate_limited(retry_after)
+            if attempt >= max_retries:
+                raise
+            delay = retry_after + random.uniform(0, 1.0) if retry_after else backoff_delay(attempt)
+        except (APITimeoutError, APIConnectionError, InternalServerError) as e:
+            error = e
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+        if on_retry:
+            on_retry(attempt + 1, error, delay)
+        sleep(delay)
+        attempt += 1
@@ -0,0 +1,423 @@
+#すべてのフォルダの読み取り結果をSQLiteにまとめて、日付・店舗・金額・勘定科目で検索できるようにする部分
+#使い方: python receipt_index.py --store セブン --from 2024/01/01 --to 2024/12/31 --min-amount 5000
+import argparse
+import contextlib
+import csv
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import monthly_totals
+from csv_loader import ERROR_MARKER, load_results_csv
+from settings_store import get_settings_store
+
+DEFAULT_INDEX_PATH = "receipt_index.db"
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_LIMIT = 100
+# インデックスの形式（テーブル・列・トリガーを変えたら上げる。PRAGMA user_versionに記録する）
+# 1: duplicate_of列を追加 / 2: 月ごとの合計をduplicate_ofのない行だけで数える
+SCHEMA_VERSION = 2
+_DATE_PATTERN = re.compile(r"^\s*(\d{4})[/\-年.](\d{1,2})[/\-月.](\d{1,2})")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    original_filename TEXT,
+    file_hash TEXT,
+    file_size INTEGER,
+    file_mtime_ns INTEGER,
+    date TEXT,
+    store TEXT,
+    item TEXT,
+    amount INTEGER,
+    account TEXT,
+    duplicate_of TEXT,
+    raw TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (folder, filename, line_no)
+);
+CREATE INDEX IF NOT EXISTS receipts_date ON receipts (date);
+CREATE INDEX IF NOT EXISTS receipts_store ON receipts (store, date);
+CREATE INDEX IF NOT EXISTS receipts_amount ON receipts (amount);
+CREATE INDEX IF NOT EXISTS receipts_account ON receipts (account, date);
+CREATE INDEX IF NOT EXISTS receipts_file_hash ON receipts (file_hash);
+"""
+
+
+def normalize_date(value: str) -> Optional[str]:
+    """2025/1/5・2025-01-05・2025年1月5日 などを 2025-01-05 にする（日付でなければNone）"""
+    match = _DATE_PATTERN.match(value or "")
+    if not match:
+        return None
+    year, month, day = (int(part) for part in match.groups())
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def parse_amount(value: str) -> Optional[int]:
+    """「¥1,200」「1200円」などを整数にする（金額でなければNone）"""
+    cleaned = re.sub(r"[¥￥円,，\s]", "", value or "")
+    try:
+        return int(round(float(cleaned)))
+    except ValueError:
+        return None
+
+
+def parse_receipt_columns(columns: List[str]) -> dict:
+    """
+    ファイル名を除いたCSVの列（白色申告用テンプレートの順: 日付・店舗名・商品名・金額・勘定科目）を項目にする
+    テンプレートを変えて列の並びが違う場合も、検索できない項目がNoneになるだけでrawには全列が残る
+    """
+    def column(i: int) -> str:
+        return columns[i].strip() if len(columns) > i else ""
+
+    return {
+        "date": normalize_date(column(0)),
+        "store": column(1) or None,
+        "item": column(2) or None,
+        "amount": parse_amount(column(3)),
+        "account": column(4) or None,
+        "raw": ",".join(columns),
+    }
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ReceiptIndex:
+    """
+    読み取り結果（1行＝1レシート）をフォルダ・ファイル名・行番号をキーにしてupsertする
+    書き込みのたびに接続を開くので、複数のフォルダを別スレッドで処理していても使える
+    """
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        with self._connect() as conn:
+            # 開くたびにスキーマを作り直すとトリガーの削除・作成とコミットが毎回走るので、形式が古い場合だけ行う
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """テーブル・インデックス・トリガーを今の形式にする"""
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(receipts)")}
+        if "duplicate_of" not in columns:
+            # duplicate_ofを入れる前に作ったインデックス
+            conn.execute("ALTER TABLE receipts ADD COLUMN duplicate_of TEXT")
+        monthly_totals.install(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> Optional["ReceiptIndex"]:
+        """settings.jsonの"index"から作成する（無効の場合はNone）"""
+        options = settings.get("index", {})
+        if not options.get("enabled", True):
+            return None
+        return cls(options.get("path") or DEFAULT_INDEX_PATH)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """接続を開き、withを抜けるときにコミットして閉じる（例外の場合はロールバックする）"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            # 書き込み中も検索できるようにし、コミットごとのfsyncを減らす
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _known_hashes(self, conn: sqlite3.Connection, folder: str) -> Dict[str, Tuple[int, int, str]]:
+        """{ファイル名: (サイズ, 更新日時, ハッシュ)}（変わっていないファイルはハッシュを計算し直さない）"""
+        rows = conn.execute("SELECT filename, file_size, file_mtime_ns, file_hash FROM receipts "
+                            "WHERE folder = ? AND line_no = 0 AND file_hash IS NOT NULL", (folder,))
+        return {row["filename"]: (row["file_size"], row["file_mtime_ns"], row["file_hash"]) for row in rows}
+
+    def upsert_rows(self, folder: str, rows: Iterable[Tuple[str, List[List[str]]]],
+                    duplicates: Optional[Dict[str, str]] = None) -> int:
+        """
+        (ファイル名, そのファイルのCSVの列のリスト) をまとめて書き込む
+        同じファイルの前回の行は消してから書くので、行数が減った場合も古い行は残らない（列のリストが空なら行を消すだけ）
+        画像が見つからないファイルと、フォルダから消えたファイルの行は消す
+        duplicatesは {ファイル名: 同じレシートを写した代表の画像のファイル名}（月ごとの合計で二重に数えないようにする）
+        Returns:
+            int: 書き込んだ行数
+        """
+        folder = os.path.abspath(folder)
+        duplicates = duplicates or {}
+        now = time.time()
+        count = 0
+        with self._connect() as conn:
+            known = self._known_hashes(conn, folder)
+            for filename, lines in rows:
+                path = os.path.join(folder, filename)
+                try:
+                    st = os.stat(path)
+                    previous = known.get(filename)
+                    if previous is not None and previous[:2] == (st.st_size, st.st_mtime_ns):
+                        file_hash = previous[2]
+                    else:
+                        file_hash = _file_hash(path)
+                    size, mtime_ns = st.st_size, st.st_mtime_ns
+                except OSError:
+                    file_hash, size, mtime_ns = None, None, None
+                    lines = []
+                conn.execute("DELETE FROM receipts WHERE folder = ? AND filename = ?", (folder, filename))
+                for line_no, columns in enumerate(lines):
+                    fields = parse_receipt_columns(columns)
+                    conn.execute(
+                        "INSERT INTO receipts (folder, filename, line_no, file_hash, file_size, file_mtime_ns, "
+                        "date, store, item, amount, account, duplicate_of, raw, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (folder, filename, line_no, file_hash, size, mtime_ns, fields["date"], fields["store"],
+                         fields["item"], fields["amount"], fields["account"], duplicates.get(filename),
+                         fields["raw"], now))
+                    count += 1
+            self._remove_missing(conn, folder)
+        return count
+
+    def _remove_missing(self, conn: sqlite3.Connection, folder: str) -> None:
+        """削除・移動されてフォルダにないファイルの行を消す（リネームはrecord_renamesで付け替える）"""
+        try:
+            with os.scandir(folder) as entries:
+                existing = {entry.name for entry in entries}
+        except OSError:
+            # フォルダごと読めない場合は、一時的なものかもしれないので消さない
+            return
+        filenames = [row["filename"] for row in
+                     conn.execute("SELECT DISTINCT filename FROM receipts WHERE folder = ?", (folder,))]
+        for filename in filenames:
+            if filename not in existing:
+                conn.execute("DELETE FROM receipts WHERE folder = ? AND filename = ?", (folder, filename))
+
+    def upsert_results(self, folder: str, results: Iterable) -> int:
+        """
+        ExtractionResultのリストを書き込む
+        失敗した結果と読み取りに失敗した返答は書き込まず、そのファイルの前回の行も消す（CSVに行がないのと合わせる）
+        """
+        rows = []
+        duplicates = {}
+        for result in results:
+            if not result.ok or not result.text or ERROR_MARKER in result.text:
+                rows.append((result.filename, []))
+                continue
+            lines = [line.strip() for line in result.text.splitlines()]
+            lines = [line for line in lines if line and not line.startswith("```")]
+            rows.append((result.filename, [next(csv.reader([line])) for line in lines]))
+            if result.duplicate_of:
+                duplicates[result.filename] = os.path.basename(result.duplicate_of)
+        return self.upsert_rows(folder, rows, duplicates)
+
+    def import_csv(self, folder: str, csv_path: str) -> int:
+        """既にあるフォルダのCSVをまとめて取り込む（インデックスを作る前のフォルダ用）"""
+        table = load_results_csv(csv_path)
+        grouped: Dict[str, List[List[str]]] = {}
+        for row in table.valid_rows():
+            grouped.setdefault(row[0], []).append(row[1:])
+        return self.upsert_rows(folder, grouped.items())
+
+    def record_renames(self, folder: str, renamed_files: Dict[str, str]) -> int:
+        """リネームしたファイルの行を新しいファイル名に付け替える（元のファイル名も残す）"""
+        folder = os.path.abspath(folder)
+        count = 0
+        with self._connect() as conn:
+            for old_filename, new_filename in renamed_files.items():
+                # 新しいファイル名に前のファイルの行が残っていると付け替えられないので、先に消す
+                conn.execute("DELETE FROM receipts WHERE folder = ? AND filename = ?", (folder, new_filename))
+                cursor = conn.execute(
+                    "UPDATE receipts SET filename = ?, original_filename = COALESCE(original_filename, ?), "
+                    "updated_at = ? WHERE folder = ? AND filename = ?",
+                    (new_filename, old_filename, time.time(), folder, old_filename))
+                count += cursor.rowcount
+                conn.execute("UPDATE receipts SET duplicate_of = ? WHERE folder = ? AND duplicate_of = ?",
+                             (new_filename, folder, old_filename))
+        return count
+
+    def restore_original_names(self, folder: str) -> int:
+        """リネームを元に戻した後に、ファイル名が元に戻った行を付け替える"""
+        folder = os.path.abspath(folder)
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT filename, original_filename FROM receipts "
+                                "WHERE folder = ? AND original_filename IS NOT NULL", (folder,)).fetchall()
+        renamed = {row["filename"]: row["original_filename"] for row in rows
+                   if not os.path.exists(os.path.join(folder, row["filename"]))
+                   and os.path.exists(os.path.join(folder, row["original_filename"]))}
+        count = 0
+        with self._connect() as conn:
+            for filename, original in renamed.items():
+                conn.execute("DELETE FROM receipts WHERE folder = ? AND filename = ?", (folder, original))
+                cursor = conn.execute("UPDATE receipts SET filename = ?, original_filename = NULL, updated_at = ? "
+                                      "WHERE folder = ? AND filename = ?", (original, time.time(), folder, filename))
+                count += cursor.rowcount
+                conn.execute("UPDATE receipts SET duplicate_of = ? WHERE folder = ? AND duplicate_of = ?",
+                             (original, folder, filename))
+        return count
+
+    def correct(self, folder: str, filename: str, line_no: int = 0, date: Optional[str] = None,
+                amount: Optional[int] = None, account: Optional[str] = None) -> bool:
+        """
+        1行分の日付・金額・勘定科目を修正する（指定しなかった項目は変えない）
+        月ごとの合計も同じトランザクションで差分だけ更新される
+        Returns:
+            bool: 修正する行が見つかった場合True
+        """
+        updates, params = [], []
+        if date is not None:
+            updates.append("date = ?")
+            params.append(normalize_date(date))
+        if amount is not None:
+            updates.append("amount = ?")
+            params.append(int(amount))
+        if account is not None:
+            updates.append("account = ?")
+            params.append(account or None)
+        if not updates:
+            return False
+        updates.append("updated_at = ?")
+        params.extend([time.time(), os.path.abspath(folder), filename, line_no])
+        with self._connect() as conn:
+            cursor = conn.execute(f"UPDATE receipts SET {', '.join(updates)} "
+                                  "WHERE folder = ? AND filename = ? AND line_no = ?", params)
+            return cursor.rowcount > 0
+
+    def monthly_summary(self, month_from: Optional[str] = None, month_to: Optional[str] = None,
+                        account: Optional[str] = None) -> List[dict]:
+        """月・勘定科目ごとの合計（monthly_totals.monthly_summaryを参照）"""
+        with self._connect() as conn:
+            return monthly_totals.monthly_summary(conn, month_from, month_to, account)
+
+    def search(self, store: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+               min_amount: Optional[int] = None, max_amount: Optional[int] = None, account: Optional[str] = None,
+               folder: Optional[str] = None, file_hash: Optional[str] = None,
+               limit: Optional[int] = DEFAULT_LIMIT) -> List[dict]:
+        """
+        条件に合うレシートを日付順で返す（指定しなかった条件は絞り込まない）
+        Args:
+            store: 店舗名に含まれる文字列
+            date_from, date_to: 日付の範囲（両端を含む。2024/01/01 の形でもよい）
+            min_amount, max_amount: 金額の範囲（両端を含む）
+            account: 勘定科目（完全一致）
+            folder: フォルダ（完全一致）
+            file_hash: 画像のSHA-256（同じ画像が別のフォルダにもないかを探す場合）
+            limit: 最大件数（Noneの場合はすべて）
+        """
+        conditions, params = [], []
+        if store:
+            conditions.append("store LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([%_\\])", r"\\\1", store) + "%")
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(normalize_date(date_from) or date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(normalize_date(date_to) or date_to)
+        if min_amount is not None:
+            conditions.append("amount >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append("amount <= ?")
+            params.append(max_amount)
+        if account:
+            conditions.append("account = ?")
+            params.append(account)
+        if folder:
+            conditions.append("folder = ?")
+            params.append(os.path.abspath(folder))
+        if file_hash:
+            conditions.append("file_hash = ?")
+            params.append(file_hash)
+        sql = "SELECT * FROM receipts"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date, folder, filename, line_no"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="読み取り済みのレシートを検索します")
+    parser.add_argument("--index", help=f"インデックスのファイル（省略時はsettings.jsonの\"index\"、なければ{DEFAULT_INDEX_PATH}）")
+    parser.add_argument("--import", dest="import_folders", nargs="+", metavar="FOLDER",
+                        help="フォルダのresults_RyoSyuSyo.csvをインデックスに取り込む")
+    parser.add_argument("--store", help="店舗名に含まれる文字列")
+    parser.add_argument("--from", dest="date_from", help="この日付以降（例: 2024/01/01）")
+    parser.add_argument("--to", dest="date_to", help="この日付以前（例: 2024/12/31）")
+    parser.add_argument("--min-amount", type=int, help="この金額以上")
+    parser.add_argument("--max-amount", type=int, help="この金額以下")
+    parser.add_argument("--account", help="勘定科目")
+    parser.add_argument("--folder", help="フォルダ")
+    parser.add_argument("--hash", dest="file_hash", help="画像のSHA-256")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT, help="表示する最大件数（0ですべて）")
+    parser.add_argument("--summary", action="store_true",
+                        help="検索の代わりに月・勘定科目ごとの合計を表示する（--from/--toは月で絞り込む）")
+    parser.add_argument("--output", help="--summaryと一緒に使い、勘定科目×月の集計表をCSVに書き出す")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    path = args.index
+    if path is None:
+        path = get_settings_store().load().get("index", {}).get("path") or DEFAULT_INDEX_PATH
+    index = ReceiptIndex(path)
+
+    if args.import_folders:
+        # batch_processorはこのモジュールをimportするので、取り込むときだけ読み込む
+        from batch_processor import RESULT_CSV_NAME
+        for folder in args.import_folders:
+            try:
+                print(f"{folder}: {index.import_csv(folder, os.path.join(folder, RESULT_CSV_NAME))}行を取り込みました")
+            except (OSError, ValueError) as e:
+                print(f"{folder}: 取り込めませんでした（{str(e)}）", file=sys.stderr)
+        return 0
+
+    if args.summary:
+        started = time.perf_counter()
+        summary = index.monthly_summary(args.date_from, args.date_to, args.account)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if args.output:
+            monthly_totals.write_summary_csv(args.output, summary)
+            print(f"集計表を書き出しました: {args.output}")
+        else:
+            writer = csv.writer(sys.stdout)
+            for row in summary:
+                writer.writerow([row["month"], row["account"], row["amount"], row["receipts"]])
+        print(f"{len(summary)}行（{elapsed_ms:.1f}ms）", file=sys.stderr)
+        return 0
+
+    started = time.perf_counter()
+    records = index.search(args.store, args.date_from, args.date_to, args.min_amount, args.max_amount, args.account,
+                           args.folder, args.file_hash, args.limit or None)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    writer = csv.writer(sys.stdout)
+    for record in records:
+        writer.writerow([record["date"] or "", record["store"] or "", record["item"] or "",
+                         "" if record["amount"] is None else record["amount"], record["account"] or "",
+                         os.path.join(record["folder"], record["filename"])])
+    print(f"{len(records)}件（{elapsed_ms:.1f}ms）", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#リネームの内容（旧ファイル名→新ファイル名）を記録して、あとから元に戻すための部分
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from tracing import traced
+
+RENAME_JOURNAL_NAME = "rename_journal_RyoSyuSyo.jsonl"
+
+
+class RenameJournal:
+    """
+    リネーム1回分（1回の実行）の取引ジャーナル（JSON Lines）
+    リネームする前に「旧→新」を書き込んでディスクに反映させるので、途中で落ちても元に戻せる
+    画像の中身はコピーしないため、記録・復元にかかる時間はリネームした件数だけで決まる
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def for_folder(cls, folder: str) -> "RenameJournal":
+        return cls(os.path.join(folder, RENAME_JOURNAL_NAME))
+
+    def _write(self, entry: dict, mode: str = "a") -> None:
+        with open(self.path, mode, encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def begin(self, csv_path: Optional[str] = None, csv_backup: Optional[str] = None) -> None:
+        """新しいリネームを始める（前回のジャーナルは上書きする）"""
+        # フォルダごと移動しても戻せるように、CSVはファイル名だけを記録する（どちらも同じフォルダにある）
+        self._write({"type": "begin", "time": datetime.now().isoformat(timespec="seconds"),
+                     "csv": os.path.basename(csv_path) if csv_path else None,
+                     "csv_backup": os.path.basename(csv_backup) if csv_backup else None}, mode="w")
+
+    def record(self, old_filename: str, new_filename: str) -> None:
+        """これから行うリネームを記録する（os.renameの前に呼ぶ）"""
+        self._write({"type": "rename", "old": old_filename, "new": new_filename})
+
+    def load(self) -> Tuple[Optional[dict], List[dict]]:
+        """開始時の記録と、リネームの記録（記録した順）を返す"""
+        header = None
+        renames = []
+        if not os.path.exists(self.path):
+            return header, renames
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた最後の行は無視する（その行のリネームはまだ行われていない）
+                    continue
+                if entry.get("type") == "begin":
+                    header = entry
+                elif entry.get("type") == "rename":
+                    renames.append(entry)
+                elif entry.get("type") == "rolled_back":
+                    # 元に戻し済み
+                    return None, []
+        return header, renames
+
+    def can_rollback(self) -> bool:
+        return bool(self.load()[1])
+
+    @traced("rename.rollback")
+    def rollback(self) -> Tuple[int, List[str]]:
+        """
+        記録を逆順にたどってリネームを元に戻し、CSVもリネーム前の状態に戻す
+        Returns:
+            Tuple[元に戻した件数, エラーメッセージリスト]
+        """
+        header, renames = self.load()
+        folder = os.path.dirname(os.path.abspath(self.path))
+        restored = 0
+        errors = []
+        for entry in reversed(renames):
+            old_path = os.path.join(folder, entry["old"])
+            new_path = os.path.join(folder, entry["new"])
+            if not os.path.exists(new_path):
+                if not os.path.exists(old_path):
+                    errors.append(f"ファイルが見つかりません: {entry['new']}")
+                # 記録した直後に落ちて、リネームされていない場合はそのまま
+                continue
+            if os.path.exists(old_path):
+                errors.append(f"元のファイル名が既に使われています: {entry['old']}")
+                continue
+            try:
+                os.rename(new_path, old_path)
+                restored += 1
+            except OSError as e:
+                errors.append(f"復元失敗 {entry['new']}: {str(e)}")
+
+        csv_backup = os.path.join(folder, header["csv_backup"]) if header and header.get("csv_backup") else None
+        if csv_backup and os.path.exists(csv_backup):
+            try:
+                shutil.copy2(csv_backup, os.path.join(folder, header["csv"]))
+            except OSError as e:
+                errors.append(f"CSVファイルの復元失敗: {str(e)}")
+
+        if not errors:
+            self._write({"type": "rolled_back", "time": datetime.now().isoformat(timespec="seconds")})
+        return restored, errors
@@ -0,0 +1,117 @@
+#抽出結果をディスクにキャッシュする部分
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+DEFAULT_CACHE_DIR = "extraction_cache"
+DEFAULT_MAX_MB = 500
+DEFAULT_MAX_AGE_DAYS = 180
+
+
+def template_digest(prompt_template: str) -> str:
+    """テンプレート本文のハッシュ（キャッシュのフォルダ名に使う）"""
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    画像・テンプレート・モデル・前処理の設定が同じなら前回のAPIの返答を使い回す
+    テンプレートごとにフォルダを分けているので、テンプレートを編集したときはそのフォルダだけ消せばよい
+    """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_MAX_MB,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> Optional["ResultCache"]:
+        """settings.jsonの"cache"から作成する（無効の場合はNone）"""
+        options = settings.get("cache", {})
+        if not options.get("enabled", True):
+            return None
+        return cls(options.get("dir", DEFAULT_CACHE_DIR),
+                   options.get("max_mb", DEFAULT_MAX_MB),
+                   options.get("max_age_days", DEFAULT_MAX_AGE_DAYS))
+
+    @staticmethod
+    def make_key(image_bytes: bytes, prompt_template: str, model: str, preprocess_params: Optional[dict] = None) -> str:
+        """画像の中身・テンプレート・モデル・前処理の設定からキーを作る"""
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(image_bytes).digest())
+        h.update(prompt_template.encode("utf-8"))
+        h.update(b"\0" + model.encode("utf-8") + b"\0")
+        h.update(json.dumps(preprocess_params or {}, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _entry_path(self, key: str, prompt_template: str) -> str:
+        return os.path.join(self.cache_dir, template_digest(prompt_template), key[:2], f"{key}.json")
+
+    def get(self, key: str, prompt_template: str) -> Optional[str]:
+        """キャッシュされた返答を返す（ない場合や期限切れの場合はNone）"""
+        path = self._entry_path(key, prompt_template)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age_seconds:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # 更新日時を最終使用日時として扱う（期限切れの判定と容量超過時の削除順に使う）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key: str, prompt_template: str, text: str, model: str = "") -> None:
+        """返答を保存する"""
+        path = self._entry_path(key, prompt_template)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"text": text, "model": model, "created": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def invalidate_template(self, prompt_template: str) -> None:
+        """指定したテンプレートのキャッシュだけを削除する"""
+        target = os.path.join(self.cache_dir, template_digest(prompt_template))
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+
+    def evict(self) -> int:
+        """
+        期限切れのものを削除し、さらに上限サイズを超えている分を古い順に削除する
+        Returns:
+            int: 削除した件数
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age_seconds:
+                    os.remove(path)
+                    removed += 1
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,147 @@
+#一括処理の時間・送信量・トークン数・料金を集計して、レポートとPrometheus用のファイルに書き出す部分
+import json
+import math
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+RUN_REPORT_NAME = "run_report_RyoSyuSyo.json"
+PROMETHEUS_NAME = "metrics_RyoSyuSyo.prom"
+METRIC_PREFIX = "aishiwake"
+
+# gpt-4oの料金（100万トークンあたりのドル）と為替レート（settings.jsonの"pricing"で変えられる）
+DEFAULT_PRICING = {
+    "input_usd_per_million": 2.5,
+    "output_usd_per_million": 10.0,
+    "yen_per_usd": 150.0,
+}
+
+# 画像ごとに記録する時間の項目（秒）
+TIMING_KEYS = ("read_seconds", "preprocess_seconds", "encode_seconds", "ttfb_seconds", "latency_seconds")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近傍順位法によるパーセンタイル（値がなければNone）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _distribution(values: List[float]) -> dict:
+    summary = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    summary["count"] = len(values)
+    summary["sum"] = sum(values)
+    return summary
+
+
+def build_run_report(results: Iterable, wall_seconds: float, pricing: Optional[Dict[str, float]] = None) -> dict:
+    """
+    ExtractionResultのリストから実行1回分のレポートを作る
+    Args:
+        results: 結果（各結果のmetricsに計測値が入っている）
+        wall_seconds: 実行開始から終了までの時間
+        pricing: 料金の設定（省略時はDEFAULT_PRICING）
+    """
+    rates = dict(DEFAULT_PRICING)
+    rates.update(pricing or {})
+    results = list(results)
+
+    timings = {key: [] for key in TIMING_KEYS}
+    upload_bytes, prompt_tokens, completion_tokens = [], 0, 0
+    for result in results:
+        metrics = result.metrics
+        for key in TIMING_KEYS:
+            if key in metrics:
+                timings[key].append(metrics[key])
+        if "upload_bytes" in metrics:
+            upload_bytes.append(metrics["upload_bytes"])
+        prompt_tokens += metrics.get("prompt_tokens", 0)
+        completion_tokens += metrics.get("completion_tokens", 0)
+
+    usd = (prompt_tokens * rates["input_usd_per_million"] + completion_tokens * rates["output_usd_per_million"]) / 1_000_000
+    yen = usd * rates["yen_per_usd"]
+    api_images = sum(1 for r in results if "latency_seconds" in r.metrics)
+    return {
+        "images": len(results),
+        "succeeded": sum(1 for r in results if r.ok),
+        "failed": sum(1 for r in results if not r.ok),
+        "api_images": api_images,
+        "cache_hits": sum(1 for r in results if r.cached),
+        "resumed": sum(1 for r in results if r.resumed),
+        "retries": sum(r.retries for r in results),
+        "wall_seconds": wall_seconds,
+        "images_per_minute": len(results) * 60.0 / wall_seconds if wall_seconds > 0 else None,
+        "timings": {key: _distribution(values) for key, values in timings.items()},
+        "upload_bytes": _distribution(upload_bytes),
+        "tokens": {"prompt": prompt_tokens, "completion": completion_tokens},
+        "cost": {
+            "usd": usd,
+            "yen": yen,
+            "yen_per_image": yen / len(results) if results else None,
+            "yen_per_api_image": yen / api_images if api_images else None,
+        },
+        "pricing": rates,
+    }
+
+
+def _atomic_write(path: str, content: str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_run_report(path: str, report: dict) -> None:
+    _atomic_write(path, json.dumps(report, ensure_ascii=False, indent=4))
+
+
+def _format_value(value) -> str:
+    return "NaN" if value is None else repr(float(value))
+
+
+def prometheus_text(report: dict, labels: Optional[Dict[str, str]] = None) -> str:
+    """レポートをPrometheusのテキスト形式にする（node_exporterのtextfile collectorで読み込める形）"""
+    label_text = ",".join(f'{k}="{v}"' for k, v in sorted((labels or {}).items()))
+
+    def with_labels(extra: str = "") -> str:
+        joined = ",".join(part for part in (label_text, extra) if part)
+        return "{" + joined + "}" if joined else ""
+
+    lines = []
+
+    def gauge(name: str, help_text: str, value, extra_labels: str = "") -> None:
+        full_name = f"{METRIC_PREFIX}_{name}"
+        if not any(line.startswith(f"# TYPE {full_name} ") for line in lines):
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} gauge")
+        lines.append(f"{full_name}{with_labels(extra_labels)} {_format_value(value)}")
+
+    gauge("run_images", "Images in the last run", report["images"])
+    gauge("run_failed_images", "Images that failed in the last run", report["failed"])
+    gauge("run_api_images", "Images sent to the API in the last run", report["api_images"])
+    gauge("run_cache_hits", "Images served from the result cache in the last run", report["cache_hits"])
+    gauge("run_retries", "Retried API requests in the last run", report["retries"])
+    gauge("run_wall_seconds", "Wall-clock duration of the last run", report["wall_seconds"])
+    gauge("run_images_per_minute", "Throughput of the last run", report["images_per_minute"])
+    for key, summary in report["timings"].items():
+        stage = key[:-len("_seconds")]
+        for p in PERCENTILES:
+            gauge("run_stage_seconds", "Per-image stage duration quantiles in the last run",
+                  summary[f"p{p}"], f'stage="{stage}",quantile="{p / 100}"')
+    for p in PERCENTILES:
+        gauge("run_upload_bytes", "Per-image upload size quantiles in the last run",
+              report["upload_bytes"][f"p{p}"], f'quantile="{p / 100}"')
+    gauge("run_tokens", "Tokens used in the last run", report["tokens"]["prompt"], 'kind="prompt"')
+    gauge("run_tokens", "Tokens used in the last run", report["tokens"]["completion"], 'kind="completion"')
+    gauge("run_cost_yen", "Estimated API cost of the last run in yen", report["cost"]["yen"])
+    gauge("run_cost_yen_per_image", "Estimated API cost per image in the last run", report["cost"]["yen_per_image"])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, report: dict, labels: Optional[Dict[str, str]] = None) -> None:
+    # スクレイパーが書きかけのファイルを読まないように置き換えで書く
+    _atomic_write(path, prometheus_text(report, labels))
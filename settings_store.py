@@ -0,0 +1,205 @@
+#settings.jsonの読み書きをまとめた部分
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+from tracing import traced
+
+SETTINGS_PATH = "settings.json"
+# 丸ごと利用者が編集する項目（デフォルトと混ぜると、削除したテンプレートが戻ってきてしまう）
+USER_SECTIONS = ("prompt_templates",)
+
+
+def default_settings() -> dict:
+    """
+    デフォルト設定（設定の初期値はここだけに書く）
+    settings.jsonにない項目は読み込むときにここから補うので、settings.jsonには変えたい項目だけを書けばよい
+    """
+    return {
+        "api_key": "",
+        "max_size": 1800,
+        "resize_enabled": False,
+        "auto_crop": False,  # 縮小する場合に、レシートの範囲だけを傾きを直して切り抜くかどうか
+        "max_workers": 4,  # 同時にAPIへ投げる画像の数
+        "pack_size": 1,    # 1回のリクエストにまとめる画像の数
+        "stream": False,   # 返答をストリーミングで受け取るかどうか
+        "http": {
+            "max_connections": 20,
+            "max_keepalive_connections": 10,
+            "keepalive_expiry": 60.0,
+            "connect_timeout": 10.0,
+            "read_timeout": 120.0
+        },
+        "rate_limit": {
+            "requests_per_minute": None,  # nullの場合は上限を設けず、429が返ったときだけ待って同時実行数を減らす
+            "tokens_per_minute": None,
+            "max_retries": 6
+        },
+        "dedupe": {
+            "enabled": False,  # 同じ画像を1回だけ送る（ハッシュが近い画像は元の解像度の画素で確かめてからまとめる）
+            "max_distance": 1  # 候補にするハッシュの距離（同じ店のレシートはハッシュが近いので、大きくしても画素の比較は省かない）
+        },
+        "quality_gate": {
+            "enabled": True,
+            "min_sharpness": 3.0,       # 小さいほどぼけた画像も送る
+            "min_brightness": 20.0,
+            "min_text_density": 0.0005
+        },
+        "pricing": {
+            "input_usd_per_million": 2.5,   # 入力100万トークンあたりの料金（ドル）
+            "output_usd_per_million": 10.0,
+            "yen_per_usd": 150.0
+        },
+        "metrics": {
+            "prometheus_file": ""  # 空の場合は処理したフォルダ内のmetrics_RyoSyuSyo.promに書き出す
+        },
+        "index": {
+            "enabled": True,
+            "path": "receipt_index.db"  # 全フォルダの読み取り結果を検索するためのデータベース
+        },
+        "tracing": {
+            "enabled": False,       # 処理の段階ごとの時間をフォルダ内のtrace_RyoSyuSyo.jsonに書き出す
+            "profile": False,       # cProfileの結果も書き出す（処理が遅くなる）
+            "trace_memory": False   # tracemallocでメモリ使用量も記録する（処理が遅くなる）
+        },
+        "cache": {
+            "enabled": True,
+            "dir": "extraction_cache",
+            "max_mb": 500,
+            "max_age_days": 180
+        },
+        "current_template": "white_tax",
+        "default_folder_path": os.path.expanduser("~\\Documents"),  # デフォルトのフォルダパス
+        "prompt_templates": {
+            "white_tax": {
+                "name": "白色申告用",
+                "template": "画像から、取引年月日(yyyy/mm/ddのみ時間なし)、店舗名、商品名(要約)、合計金額(通貨記号は削除)、推測される勘定科目名を抽出しカンマ区切り(,)でreturnせよ"
+            }
+        }
+    }
+
+
+def with_defaults(settings: dict) -> dict:
+    """
+    settings.jsonにない項目をデフォルト設定で補う（"rate_limit"などの項目の中のキーも1つずつ補う）
+    古いsettings.jsonを使っていても、後から増えた設定はデフォルトの値で動く
+    """
+    merged = default_settings()
+    for key, value in settings.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict) and key not in USER_SECTIONS:
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def without_defaults(settings: dict) -> dict:
+    """
+    デフォルト設定と同じ値の項目を除く（保存するときに使い、settings.jsonには変えた項目だけを残す）
+    USER_SECTIONSの項目は丸ごと残す
+    """
+    defaults = default_settings()
+    minimal = {}
+    for key, value in settings.items():
+        default = defaults.get(key)
+        if key in USER_SECTIONS:
+            minimal[key] = value
+        elif isinstance(value, dict) and isinstance(default, dict):
+            changed = {k: v for k, v in value.items() if k not in default or default[k] != v}
+            if changed:
+                minimal[key] = changed
+        elif key not in defaults or default != value:
+            minimal[key] = value
+    return minimal
+
+
+class SettingsStore:
+    """
+    設定ファイルを1回だけ読み込んでキャッシュする
+    ファイルの更新日時とサイズが変わったときだけ読み直し、書き込みは一時ファイル経由で置き換える
+    """
+    def __init__(self, path: str = SETTINGS_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._cache: Optional[dict] = None
+        self._version: Optional[Tuple[int, int]] = None
+
+    def _stat_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @traced("settings.load")
+    def load(self) -> dict:
+        """
+        設定を返す（呼び出し側で書き換えても良いようにコピーを返す）
+        ファイルが存在しない場合はデフォルト設定で作成し、ファイルにない項目はデフォルト設定で補う
+        """
+        with self._lock:
+            version = self._stat_version()
+            if version is None:
+                self._write(default_settings())
+            elif version != self._version or self._cache is None:
+                try:
+                    with open(self.path, "r", encoding='utf-8') as f:
+                        self._cache = with_defaults(json.load(f))
+                except json.JSONDecodeError:
+                    raise ValueError("settings.jsonの形式が正しくありません。")
+                self._version = version
+            return copy.deepcopy(self._cache)
+
+    def save(self, settings: dict) -> None:
+        """設定を保存する"""
+        with self._lock:
+            self._write(copy.deepcopy(settings))
+
+    def update(self, **values) -> dict:
+        """指定した項目だけを書き換えて保存する"""
+        with self._lock:
+            settings = self.load()
+            settings.update(values)
+            self._write(settings)
+            return copy.deepcopy(settings)
+
+    def _write(self, settings: dict) -> None:
+        # 同じフォルダに一時ファイルを書いてから置き換えるので、読み込み側が書きかけのファイルを見ることはない
+        # ファイルにはデフォルトと違う項目だけを書く（デフォルトを変えたときに、保存済みのファイルにも反映されるようにする）
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings_", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding='utf-8') as f:
+                json.dump(without_defaults(settings), f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            self._replace(tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._cache = with_defaults(settings)
+        self._version = self._stat_version()
+
+    def _replace(self, tmp_path: str) -> None:
+        # Windowsでは他のプロセスが開いている間は置き換えに失敗することがあるので少し待って再試行する
+        for attempt in range(5):
+            try:
+                os.replace(tmp_path, self.path)
+                return
+            except PermissionError:
+                if attempt == 4:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+
+_store = SettingsStore()
+
+
+def get_settings_store() -> SettingsStore:
+    """アプリ全体で共有する設定ストアを返す"""
+    return _store
@@ -0,0 +1,24 @@
+#同じ秒に続けて作ったスナップショットが上書きされず、それぞれの時点に戻せることの確認
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_manager import BackupManager
+
+
+def test_snapshots_in_the_same_second_are_kept_separately(tmp_path):
+    folder = tmp_path / "receipts"
+    folder.mkdir()
+    target = folder / "results_RyoSyuSyo.csv"
+    manager = BackupManager(str(folder))
+
+    snapshots = []
+    for content in ("first", "second", "third"):
+        target.write_text(content, encoding="utf-8")
+        snapshots.append(manager.create_snapshot())
+
+    assert len(set(snapshots)) == 3
+    assert manager.latest_snapshot() == snapshots[-1]
+    assert manager.restore_from_backup(snapshots[0])
+    assert target.read_text(encoding="utf-8") == "first"
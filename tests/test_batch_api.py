@@ -0,0 +1,50 @@
+#Batch APIの提出から反映までを手元の偽サーバーで通し、設定を変えたときに提出済みのバッチを上書きしないことの確認
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_api import BatchApiRunner
+from batch_processor import BatchExtractor, RESULT_CSV_NAME
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+def make_folder(folder, count):
+    for i in range(count):
+        img = Image.new("RGB", (400, 600), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for row in range(30):
+            draw.text((20, 20 + row * 18), f"ITEM {i:03d}-{row:02d}  {i * 100 + row:>6,}", fill=(20, 20, 20))
+        img.save(os.path.join(folder, f"IMG_{i}.jpg"), quality=90)
+
+
+def test_batch_round_trip(tmp_path):
+    folder = str(tmp_path)
+    make_folder(folder, 3)
+    with FakeOpenAIServer(0.1, 0.0, 0.0) as server:
+        extractor = BatchExtractor("test", "prompt", 2, base_url=server.base_url)
+        results = BatchApiRunner(extractor, poll_interval=0.05).run(folder)
+    assert sorted(r.filename for r in results if r.ok) == ["IMG_0.jpg", "IMG_1.jpg", "IMG_2.jpg"]
+    with open(os.path.join(folder, RESULT_CSV_NAME), "rb") as f:
+        assert len(f.read().splitlines()) == 3
+
+
+def test_changed_settings_do_not_orphan_submitted_batches(tmp_path):
+    folder = str(tmp_path)
+    make_folder(folder, 2)
+    with FakeOpenAIServer(60.0, 0.0, 0.0) as server:
+        first = BatchApiRunner(BatchExtractor("test", "prompt A", 2, base_url=server.base_url))
+        state = first.submit(folder)
+        (batch_id,) = [entry["id"] for entry in state["batches"]]
+
+        second = BatchApiRunner(BatchExtractor("test", "prompt B", 2, base_url=server.base_url))
+        with pytest.raises(ValueError):
+            second.run(folder)
+        assert first.load_state(folder) == state
+
+        assert second.cancel(folder) == 1
+        assert server.batches[batch_id]["status"] == "cancelled"
+        assert first.load_state(folder) is None
@@ -0,0 +1,75 @@
+#途中で落ちた一括処理をやり直すと、終わっていない画像と追加・変更された画像だけをAPIに送ることの確認
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_processor
+from batch_journal import BatchJournal
+from batch_processor import BatchExtractor, RESULT_CSV_NAME
+
+
+class Crash(BaseException):
+    """プロセスが落ちたことの代わり（except Exceptionでは捕まらない）"""
+
+
+def write_image(folder, name, content=None):
+    with open(os.path.join(folder, name), "wb") as f:
+        f.write((content or name).encode("utf-8"))
+
+
+def csv_files(folder):
+    with open(os.path.join(folder, RESULT_CSV_NAME), "rb") as f:
+        return [line.split(",", 1)[0] for line in f.read().decode("shift_jis").splitlines()]
+
+
+def test_rerun_sends_only_unfinished_new_and_changed_images(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    for i in range(4):
+        write_image(folder, f"IMG_{i}.jpg")
+    calls = []
+    failing = {"IMG_1.jpg"}
+
+    def fake_response(image_path, *args):
+        name = os.path.basename(image_path)
+        calls.append(name)
+        if name in failing:
+            raise RuntimeError("timeout")
+        return f"2024/05/10,{name},文具,100,消耗品費"
+
+    def crash_after_two(done, total, result):
+        if done == 2:
+            raise Crash()
+
+    monkeypatch.setattr(batch_processor, "gen_chat_response_with_gpt4", fake_response)
+    extractor = BatchExtractor("test", "prompt", 1, max_retries=0)
+    with pytest.raises(Crash):
+        extractor.run(folder, progress_callback=crash_after_two)
+    # 落ちる前に受け取った2枚分だけが記録されている
+    entries = BatchJournal.for_folder(folder, extractor.run_key()).load()
+    assert len(entries) == 2
+    done = {name for name, entry in entries.items() if entry["status"] == "done"}
+    assert "IMG_1.jpg" not in done
+
+    # 再開すると、失敗した画像とまだの画像だけを送る
+    calls.clear()
+    failing.clear()
+    results = extractor.run(folder)
+    assert sorted(calls) == sorted({"IMG_0.jpg", "IMG_1.jpg", "IMG_2.jpg", "IMG_3.jpg"} - done)
+    assert [r.resumed for r in results] == [r.filename in done for r in results]
+    assert csv_files(folder) == ["IMG_0.jpg", "IMG_1.jpg", "IMG_2.jpg", "IMG_3.jpg"]
+
+    # 写真を追加・撮り直しした場合は、その分だけを送る
+    calls.clear()
+    write_image(folder, "IMG_4.jpg")
+    write_image(folder, "IMG_0.jpg", "retaken")
+    extractor.run(folder)
+    assert sorted(calls) == ["IMG_0.jpg", "IMG_4.jpg"]
+    assert csv_files(folder) == ["IMG_0.jpg", "IMG_1.jpg", "IMG_2.jpg", "IMG_3.jpg", "IMG_4.jpg"]
+
+    # テンプレートを変えた場合は、前回の結果を使わない
+    calls.clear()
+    BatchExtractor("test", "another prompt", 1).run(folder)
+    assert len(calls) == 5
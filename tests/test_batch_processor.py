@@ -0,0 +1,49 @@
+#一括処理が終わった順に結果を返しつつ、CSVはいつもファイル名順に書くことの確認
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_processor
+from batch_processor import BatchExtractor, RESULT_CSV_NAME
+
+# 名前順で先の画像ほど返答が遅い
+DELAYS = {"IMG_0.jpg": 0.6, "IMG_1.jpg": 0.3, "IMG_2.jpg": 0.0}
+
+
+def fake_response(image_path, *args):
+    name = os.path.basename(image_path)
+    time.sleep(DELAYS[name])
+    return f"2024/05/10,{name}のお店,文具,100,消耗品費\n2024/05/10,{name}のお店,お茶,150,会議費"
+
+
+def make_folder(folder):
+    for name in DELAYS:
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(name.encode("utf-8"))
+
+
+def test_results_come_in_completion_order(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_folder(folder)
+    monkeypatch.setattr(batch_processor, "gen_chat_response_with_gpt4", fake_response)
+    extractor = BatchExtractor("test", "prompt", 3)
+    paths = batch_processor.list_image_files(folder)
+    assert [r.filename for r in extractor.iter_results(paths)] == ["IMG_2.jpg", "IMG_1.jpg", "IMG_0.jpg"]
+
+
+def test_csv_is_written_in_filename_order(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_folder(folder)
+    monkeypatch.setattr(batch_processor, "gen_chat_response_with_gpt4", fake_response)
+    progress = []
+    results = BatchExtractor("test", "prompt", 3).run(
+        folder, resume=False, progress_callback=lambda done, total, result: progress.append((done, total, result.filename)))
+
+    assert progress == [(1, 3, "IMG_2.jpg"), (2, 3, "IMG_1.jpg"), (3, 3, "IMG_0.jpg")]
+    assert [r.filename for r in results] == ["IMG_0.jpg", "IMG_1.jpg", "IMG_2.jpg"]
+    with open(os.path.join(folder, RESULT_CSV_NAME), "rb") as f:
+        rows = f.read().decode("shift_jis").splitlines()
+    assert rows == [line for name in sorted(DELAYS) for line in (
+        f"{name},2024/05/10,{name}のお店,文具,100,消耗品費", f"{name},2024/05/10,{name}のお店,お茶,150,会議費")]
@@ -0,0 +1,64 @@
+#results_RyoSyuSyo.csvを1回の読み込みでデコード・パースし、エラー行も同時に見つけることの確認
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_loader
+from csv_loader import load_results_csv
+from file_renamer import FileRenamer
+
+CONTENT = ("a.jpg, 2024/05/10 ,セブン,\"文具,ノート\",1200,消耗品費\r\n"
+           "\r\n"
+           "b.jpg,申し訳ありませんが読み取れませんでした\r\n"
+           "c.jpg,2024/05/12\r\n"
+           "d.jpg,2024/05/13,ファミマ,電池,400,消耗品費\r\n")
+
+
+def test_shift_jis_is_parsed_in_one_pass(tmp_path):
+    path = tmp_path / "results_RyoSyuSyo.csv"
+    path.write_bytes(CONTENT.encode("shift_jis"))
+    table = load_results_csv(str(path))
+
+    assert table.encoding == "shift_jis"
+    # 空行は除き、引用符の中のカンマは列を分けず、前後の空白は削除する
+    assert table.rows[0] == ["a.jpg", "2024/05/10", "セブン", "文具,ノート", "1200", "消耗品費"]
+    assert len(table.rows) == 4
+    assert table.has_errors and table.error_rows == [1]
+    assert [row[0] for row in table.valid_rows()] == ["a.jpg", "d.jpg"]
+    assert table.is_current()
+
+    path.write_bytes(CONTENT.replace("セブン", "ローソン").encode("shift_jis"))
+    assert not table.is_current()
+
+
+def test_utf8_is_used_when_shift_jis_fails(tmp_path):
+    path = tmp_path / "results_RyoSyuSyo.csv"
+    path.write_bytes("a.jpg,2024/05/10,ｾﾌﾞﾝ～,文具,1200,消耗品費\r\n".encode("utf-8"))
+    table = load_results_csv(str(path))
+    assert table.encoding == "utf-8"
+    assert table.rows == [["a.jpg", "2024/05/10", "ｾﾌﾞﾝ～", "文具", "1200", "消耗品費"]]
+    assert not table.has_errors
+
+
+def test_renamer_reads_the_csv_once(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    for name in ("a.jpg", "d.jpg"):
+        (tmp_path / name).write_text(name, encoding="utf-8")
+    path = tmp_path / "results_RyoSyuSyo.csv"
+    path.write_bytes(CONTENT.replace("b.jpg,申し訳ありませんが読み取れませんでした\r\n", "").encode("shift_jis"))
+
+    loads = []
+    real_load = csv_loader.load_results_csv
+
+    def counting_load(csv_path):
+        loads.append(csv_path)
+        return real_load(csv_path)
+
+    monkeypatch.setattr("file_renamer.load_results_csv", counting_load)
+    # ダイアログの事前チェックで読み込んだ表を、リネームでもそのまま使う
+    renamer = FileRenamer(str(path), folder, table=counting_load(str(path)))
+    assert renamer.check_csv_content() == (False, "")
+    success, failed, _ = renamer.rename_files()
+    assert (success, failed) == (2, 0)
+    assert len(loads) == 1
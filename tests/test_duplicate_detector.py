@@ -0,0 +1,72 @@
+#重複チェックが、同じ店のレイアウトの別のレシートをまとめないことの確認
+import io
+import os
+import random
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicate_detector import find_duplicates
+
+
+def render_store_receipt(size, seed):
+    """同じ店のテンプレートで、日付・品数・合計だけが違うレシートを作る"""
+    rng = random.Random(seed)
+    width, height = size
+    img = Image.new("RGB", size, (110, 85, 60))
+    draw = ImageDraw.Draw(img)
+    left, top, right, bottom = width // 5, height // 12, width * 4 // 5, height * 11 // 12
+    draw.rectangle([left, top, right, bottom], fill=(240, 238, 232))
+    scale = max(1, width // 300)
+    line = 14 * scale
+
+    def text(x, y, value):
+        # 標準フォントは小さいので、描いてから拡大して貼る
+        layer = Image.new("L", (len(value) * 6 + 2, 11), 255)
+        ImageDraw.Draw(layer).text((1, 0), value, fill=0)
+        layer = layer.resize((layer.width * scale, layer.height * scale), Image.NEAREST)
+        img.paste((30, 30, 30), (x, y), layer.point(lambda v: 255 - v))
+
+    y = top + line
+    text(left + line, y, "BENCHMARK STORE")
+    y += line * 2
+    text(left + line, y, f"2025/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d} {rng.randint(8, 21):02d}:{rng.randint(0, 59):02d}")
+    y += line * 2
+    total = 0
+    for _ in range(rng.randint(2, 8)):
+        price = rng.randint(100, 3000)
+        total += price
+        text(left + line, y, f"ITEM {rng.randint(1000, 9999)}   {price:>6,}")
+        y += line
+    y += line
+    text(left + line, y, f"TOTAL   {total:>8,}")
+    return img
+
+
+def save_jpeg(img, path, quality=90):
+    img.save(path, format="JPEG", quality=quality)
+    return path
+
+
+@pytest.mark.parametrize("size", [(1200, 1600), (3000, 4000)])
+def test_same_template_receipts_are_not_merged(tmp_path, size):
+    paths = [save_jpeg(render_store_receipt(size, seed), str(tmp_path / f"r{seed}.jpg")) for seed in range(8)]
+    assert find_duplicates(paths, workers=2) == {}
+
+
+def test_copies_of_the_same_receipt_are_merged(tmp_path):
+    img = render_store_receipt((1200, 1600), 0)
+    original = save_jpeg(img, str(tmp_path / "a.jpg"))
+    with open(original, "rb") as f:
+        data = f.read()
+    copy = str(tmp_path / "b.jpg")
+    with open(copy, "wb") as f:
+        f.write(data)
+    # 読み込んで保存し直しただけの画像も同じ画像とみなす
+    buffer = io.BytesIO(data)
+    resaved = save_jpeg(Image.open(buffer), str(tmp_path / "c.jpg"), quality=80)
+    other = save_jpeg(render_store_receipt((1200, 1600), 1), str(tmp_path / "d.jpg"))
+    assert find_duplicates([original, copy, resaved, other], workers=2) == {copy: original, resaved: original}
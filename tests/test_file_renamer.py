@@ -0,0 +1,40 @@
+#同じ日・同じお店のレシートが多くても、フォルダを1回だけ読んで重ならない連番を付けることの確認
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_renamer
+from file_renamer import FileRenamer
+
+
+def test_collision_suffixes_come_from_one_directory_scan(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    names = [f"IMG_{i}.jpg" for i in range(5)]
+    for name in names + ["2024_05_10_セブン.jpg", "2024_05_10_セブン(2).jpg"]:
+        (tmp_path / name).write_text(name, encoding="utf-8")
+    csv_path = tmp_path / "results_RyoSyuSyo.csv"
+    csv_path.write_bytes("".join(f"{name},2024/05/10,セブン,文具,100,消耗品費\r\n" for name in names).encode("shift_jis"))
+
+    scans = []
+    real_scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return real_scandir(path)
+
+    monkeypatch.setattr(file_renamer.os, "scandir", counting_scandir)
+    renamer = FileRenamer(str(csv_path), folder)
+    success, failed, _ = renamer.rename_files()
+
+    assert (success, failed) == (5, 0)
+    assert len(scans) == 1
+    # 既にある名前と(2)は飛ばして、(1)(3)(4)…と付ける
+    assert [renamer.renamed_files[name] for name in names] == [
+        "2024_05_10_セブン(1).jpg", "2024_05_10_セブン(3).jpg", "2024_05_10_セブン(4).jpg",
+        "2024_05_10_セブン(5).jpg", "2024_05_10_セブン(6).jpg"]
+    for name in names:
+        with open(os.path.join(folder, renamer.renamed_files[name]), encoding="utf-8") as f:
+            assert f.read() == name
+    with open(os.path.join(folder, "2024_05_10_セブン.jpg"), encoding="utf-8") as f:
+        assert f.read() == "2024_05_10_セブン.jpg"
@@ -0,0 +1,39 @@
+#フォルダ監視で処理した画像をリネームしても、もう一度APIに送ってCSVに行を足さないことの確認
+import os
+import sys
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_processor import BatchExtractor, RESULT_CSV_NAME
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+def save_receipt(path, seed):
+    img = Image.new("RGB", (600, 800), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for row in range(40):
+        draw.text((30, 30 + row * 18), f"ITEM {seed:03d}-{row:02d}  {seed * 100 + row:>6,}", fill=(20, 20, 20))
+    img.save(path, quality=90)
+
+
+def test_renamed_images_are_not_processed_again(tmp_path):
+    folder = str(tmp_path)
+    csv_path = os.path.join(folder, RESULT_CSV_NAME)
+    paths = [os.path.join(folder, f"IMG_{i}.jpg") for i in range(2)]
+    for i, path in enumerate(paths):
+        save_receipt(path, i)
+
+    with FakeOpenAIServer(0.0, 0.0, 0.0) as server:
+        extractor = BatchExtractor("test", "prompt", 2, base_url=server.base_url)
+        assert len(extractor.run_incremental(paths, csv_path)) == 2
+        with open(csv_path, "rb") as f:
+            rows = f.read().splitlines()
+
+        renamed = os.path.join(folder, "20240510_store.jpg")
+        os.rename(paths[0], renamed)
+        assert extractor.run_incremental([renamed], csv_path) == []
+        with open(csv_path, "rb") as f:
+            assert f.read().splitlines() == rows
+        assert server.requests == 2
@@ -0,0 +1,79 @@
+#送る前の縮小が、送信量を増やさず、向きを直した画像を送ることの確認
+import io
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocessor import EXIF_ORIENTATION_TAG, crop_receipt, preprocess_image
+
+
+def noisy_image(size, seed=0):
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.point((x, y), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return img
+
+
+def receipt_photo(path, angle):
+    """机の上に500x1200のレシートをangle度傾けて置いて撮った写真"""
+    rng = random.Random(1)
+    photo = Image.blend(Image.effect_noise((1500, 2000), 40).convert("RGB"), Image.new("RGB", (1500, 2000), (90, 60, 40)), 0.6)
+    receipt = Image.new("RGB", (500, 1200), (250, 250, 245))
+    draw = ImageDraw.Draw(receipt)
+    for row in range(50):
+        draw.text((30, 30 + row * 22), f"ITEM {row:02d}   {rng.randrange(100, 9999):>6,}", fill=(20, 20, 20))
+    mask = Image.new("L", receipt.size, 255).rotate(angle, Image.NEAREST, expand=True)
+    photo.paste(receipt.rotate(angle, Image.BICUBIC, expand=True), (500, 400), mask)
+    photo.save(path, quality=90)
+
+
+def test_small_compressed_jpeg_is_not_made_bigger(tmp_path):
+    path = str(tmp_path / "small.jpg")
+    noisy_image((200, 200)).save(path, quality=30)
+    image = preprocess_image(path, 1600, 85)
+    assert image.sent_bytes <= os.path.getsize(path)
+    assert image.bytes_saved >= 0
+    with open(path, "rb") as f:
+        assert image.data == f.read()
+
+
+def test_large_image_is_resized_and_smaller(tmp_path):
+    path = str(tmp_path / "large.jpg")
+    noisy_image((3000, 4000)).save(path, quality=95)
+    image = preprocess_image(path, 1600, 85)
+    assert image.bytes_saved > 0
+    with Image.open(io.BytesIO(image.data)) as img:
+        assert max(img.size) == 1600
+
+
+def test_exif_rotated_image_is_sent_upright(tmp_path):
+    # 横長で保存し、EXIFで90度回転（6）を指定したスマホの写真
+    path = str(tmp_path / "rotated.jpg")
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = 6
+    noisy_image((400, 300)).save(path, quality=30, exif=exif)
+    image = preprocess_image(path, 1600, 85)
+    with Image.open(io.BytesIO(image.data)) as img:
+        assert img.size == (300, 400)
+
+
+def test_receipt_is_cropped_and_straightened(tmp_path):
+    path = str(tmp_path / "receipt.jpg")
+    receipt_photo(path, 6)
+    whole = preprocess_image(path, 1600, 85)
+    cropped = preprocess_image(path, 1600, 85, auto_crop=True)
+    assert cropped.sent_bytes * 3 < whole.sent_bytes
+    with Image.open(io.BytesIO(cropped.data)) as img:
+        # 傾いたまま切り抜くと幅は620px程度になるので、500px+余白に収まれば傾きも直っている
+        assert 500 <= img.width < 600 and 1200 <= img.height < 1350
+
+
+def test_photo_without_a_receipt_is_not_cropped():
+    assert crop_receipt(noisy_image((800, 600))) is None
@@ -0,0 +1,51 @@
+#複数の画像をまとめて送った返答を、ファイル名の取り違えなく分け、返答になかった画像だけを1枚ずつ送り直すことの確認
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_processor
+from batch_processor import BatchExtractor
+from text_extractor import split_packed_response
+
+ROW = "2024/05/10,セブン,文具,1200,消耗品費"
+
+
+def test_longer_names_are_not_taken_by_shorter_prefixes():
+    text = "\n".join([f"aa.jpg,{ROW}", f"a.jpg,{ROW}", f"a.jpg,2024/05/10,セブン,お茶,150,会議費"])
+    parts = split_packed_response(text, ["a.jpg", "aa.jpg"])
+    assert parts == {"aa.jpg": ROW, "a.jpg": f"{ROW}\n2024/05/10,セブン,お茶,150,会議費"}
+
+
+def test_lines_without_a_filename_are_ignored():
+    text = "\n".join(["以下が抽出結果です。", "", f"  b.jpg,{ROW}  ", ROW, "b.jpg 2024/05/11,ローソン", "```"])
+    assert split_packed_response(text, ["a.jpg", "b.jpg"]) == {"b.jpg": ROW}
+
+
+def test_images_missing_from_the_reply_are_sent_one_by_one(tmp_path, monkeypatch):
+    paths = []
+    for name in ("a.jpg", "aa.jpg", "b.jpg"):
+        path = tmp_path / name
+        path.write_bytes(name.encode("utf-8"))
+        paths.append(str(path))
+
+    packed_calls = []
+    single_calls = []
+
+    def packed(images, *args):
+        packed_calls.append([name for name, _ in images])
+        # aa.jpgの行だけがあり、a.jpgは名前のない行、b.jpgは行がない
+        return f"aa.jpg,{ROW}\n{ROW}"
+
+    def single(image_path, *args):
+        single_calls.append(os.path.basename(image_path))
+        return f"single {os.path.basename(image_path)}"
+
+    monkeypatch.setattr(batch_processor, "gen_chat_response_for_images", packed)
+    monkeypatch.setattr(batch_processor, "gen_chat_response_with_gpt4", single)
+    extractor = BatchExtractor("test", "prompt", 1, pack_size=3)
+    results = {r.filename: r.text for r in extractor.iter_results(paths)}
+
+    assert packed_calls == [["a.jpg", "aa.jpg", "b.jpg"]]
+    assert sorted(single_calls) == ["a.jpg", "b.jpg"]
+    assert results == {"a.jpg": "single a.jpg", "aa.jpg": ROW, "b.jpg": "single b.jpg"}
@@ -0,0 +1,69 @@
+#画質チェックが、きれいなスキャンを通し、明らかにだめな画像だけを止めることの確認
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_pool
+from quality_gate import QualityGate, measure_image
+
+
+def receipt_text(size, seed=0):
+    """白い紙に黒い文字の行を並べた画像"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    y = 40
+    while y < size[1] - 40:
+        draw.text((40, y), f"ITEM {rng.randint(1000, 9999)}  {rng.randint(100, 9999):>6,}", fill=(20, 20, 20))
+        y += 14
+    return img
+
+
+def evaluate(path):
+    return QualityGate().evaluate(path, measure_image(path))
+
+
+def test_flatbed_scan_with_a_small_receipt_passes(tmp_path):
+    # A4を300dpiでスキャンし、左上にレシートが写っている
+    page = Image.new("RGB", (2480, 3508), (255, 255, 255))
+    page.paste(receipt_text((500, 1400)), (100, 100))
+    path = str(tmp_path / "scan.jpg")
+    page.save(path, quality=90)
+    report = evaluate(path)
+    assert report.ok, report.describe()
+
+
+def test_blank_dark_and_blurred_images_are_rejected(tmp_path):
+    images = {
+        "blank": Image.new("RGB", (2480, 3508), (255, 255, 255)),
+        "dark": Image.new("RGB", (3000, 4000), (10, 10, 10)),
+        "blurred": receipt_text((1200, 1600)).resize((3000, 4000)).filter(ImageFilter.GaussianBlur(12)),
+    }
+    for name, img in images.items():
+        path = str(tmp_path / f"{name}.jpg")
+        img.save(path, quality=90)
+        assert not evaluate(path).ok, name
+
+
+def test_one_or_two_images_are_screened_without_starting_processes(tmp_path, monkeypatch):
+    # フォルダ監視で1〜2枚ずつ届いた画像のたびに、プロセスを起動しない
+    paths = []
+    for name, img in (("good", receipt_text((800, 1200))), ("dark", Image.new("RGB", (800, 1200), (10, 10, 10)))):
+        paths.append(str(tmp_path / f"{name}.jpg"))
+        img.save(paths[-1], quality=90)
+
+    def no_processes(*args, **kwargs):
+        raise AssertionError("ProcessPoolExecutor was started")
+
+    with monkeypatch.context() as m:
+        m.setattr(process_pool, "ProcessPoolExecutor", no_processes)
+        passed, rejected = QualityGate().screen(paths)
+    assert passed == paths[:1] and [r.image_path for r in rejected] == paths[1:]
+
+    # 枚数が多い場合は別プロセスでチェックし、結果は同じ
+    passed, rejected = QualityGate(workers=2).screen(paths * 2)
+    assert passed == paths[:1] * 2 and [r.image_path for r in rejected] == paths[1:] * 2
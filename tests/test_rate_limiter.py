@@ -0,0 +1,129 @@
+#時刻と待ち時間を差し替えて、429・Retry-After・同時実行数の調整が決まったとおりに動くことの確認
+import os
+import sys
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import AdaptiveRateLimiter, TokenBucket, call_with_retry, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def test_token_bucket_limits_bursts_to_a_few_seconds():
+    clock = FakeClock()
+    bucket = TokenBucket(60, burst_seconds=10, clock=clock)
+    # 60回/分なら、まとめて使えるのは10秒分の10回まで
+    for _ in range(10):
+        assert bucket.delay(1) == 0
+        bucket.take(1)
+    assert bucket.delay(1) == pytest.approx(1.0)
+    clock.sleep(0.5)
+    assert bucket.delay(1) == pytest.approx(0.5)
+    # 長く空いても、補充されるのは上限の10回分まで
+    clock.sleep(600)
+    bucket.take(10)
+    assert bucket.delay(1) == pytest.approx(1.0)
+
+
+def test_no_limit_by_default():
+    limiter = AdaptiveRateLimiter(clock=FakeClock())
+    for _ in range(limiter.max_concurrency):
+        assert limiter.wait_seconds(100000) == 0
+        limiter._acquire(100000)
+    # 分あたりの上限はなく、同時実行数だけで止まる
+    assert limiter.wait_seconds() is None
+
+
+def test_rate_limit_halves_concurrency_and_recovers_one_step_per_ten_successes():
+    limiter = AdaptiveRateLimiter(max_concurrency=8, clock=FakeClock())
+    limiter.on_rate_limited()
+    assert limiter.concurrency == 4
+    limiter.on_rate_limited()
+    limiter.on_rate_limited()
+    limiter.on_rate_limited()
+    assert limiter.concurrency == 1
+
+    steps = []
+    for _ in range(100):
+        limiter.on_success()
+        steps.append(limiter.concurrency)
+    # 10回成功するごとに1つずつ戻り、最大値で止まる
+    assert steps[8] == 1 and steps[9] == 2 and steps[19] == 3
+    assert steps[69] == 8 and steps[-1] == 8
+
+    # 途中で429になると、数えていた成功はやり直しになる
+    limiter.on_success()
+    limiter.on_rate_limited()
+    for _ in range(9):
+        limiter.on_success()
+    assert limiter.concurrency == 4
+
+
+def test_retry_after_pauses_every_worker():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(max_concurrency=4, clock=clock)
+    limiter.on_rate_limited(retry_after=5.0)
+    assert limiter.wait_seconds() == pytest.approx(5.0)
+    clock.sleep(4.0)
+    assert limiter.wait_seconds() == pytest.approx(1.0)
+    # 短いRetry-Afterが後から来ても、先に決まった待ち時間は縮めない
+    limiter.on_rate_limited(retry_after=0.5)
+    assert limiter.wait_seconds() == pytest.approx(1.0)
+    clock.sleep(1.0)
+    assert limiter.wait_seconds() == 0
+
+
+def test_call_with_retry_waits_for_retry_after():
+    assert retry_after_seconds(rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(rate_limit_error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(max_concurrency=4, clock=clock)
+    errors = [rate_limit_error({"retry-after": "3"}), rate_limit_error({"retry-after-ms": "1500"})]
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    retries = []
+    result = call_with_retry(func, limiter, max_retries=3, sleep=clock.sleep,
+                             on_retry=lambda attempt, error, delay: retries.append((attempt, delay)))
+    assert result == "ok"
+    assert [attempt for attempt, _ in retries] == [1, 2]
+    # Retry-Afterの秒数に最大1秒のジッターを足して待つ
+    assert 3.0 <= retries[0][1] <= 4.0 and 1.5 <= retries[1][1] <= 2.5
+    assert limiter.rate_limited_count == 2 and limiter.concurrency == 1
+    assert limiter.wait_seconds() == 0
+
+
+def test_call_with_retry_gives_up_after_max_retries():
+    clock = FakeClock()
+    calls = []
+
+    def func():
+        calls.append(clock())
+        raise rate_limit_error({"retry-after": "2"})
+
+    with pytest.raises(RateLimitError):
+        call_with_retry(func, AdaptiveRateLimiter(clock=clock), max_retries=2, sleep=clock.sleep)
+    assert len(calls) == 3
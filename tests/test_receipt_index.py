@@ -0,0 +1,101 @@
+#レシートのインデックスと月ごとの合計が、同じレシートの画像を二重に数えないことの確認
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_processor import ExtractionResult
+from receipt_index import SCHEMA_VERSION, ReceiptIndex
+
+LINE = "2024/05/10,セブン,文具,1200,消耗品費"
+
+
+def make_result(folder, name, text=LINE, error=None, duplicate_of=None):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(name.encode("utf-8"))
+    result = ExtractionResult(0, path, text=None if error else text, error=error)
+    if duplicate_of:
+        result.duplicate_of = os.path.join(folder, duplicate_of)
+    return result
+
+
+def test_duplicate_copies_are_not_counted_in_monthly_totals(tmp_path):
+    folder = str(tmp_path)
+    index = ReceiptIndex(str(tmp_path / "index.db"))
+    index.upsert_results(folder, [make_result(folder, "a.jpg"), make_result(folder, "b.jpg", duplicate_of="a.jpg")])
+
+    assert index.monthly_summary() == [{"month": "2024-05", "account": "消耗品費", "amount": 1200, "receipts": 1}]
+    assert {r["filename"]: r["duplicate_of"] for r in index.search()} == {"a.jpg": None, "b.jpg": "a.jpg"}
+
+    # リネームしても、コピーは新しいファイル名の代表を指したまま合計に入らない
+    index.record_renames(folder, {"a.jpg": "20240510_セブン.jpg", "b.jpg": "20240510_セブン_2.jpg"})
+    assert {r["filename"]: r["duplicate_of"] for r in index.search()} == {
+        "20240510_セブン.jpg": None, "20240510_セブン_2.jpg": "20240510_セブン.jpg"}
+    assert index.monthly_summary()[0]["amount"] == 1200
+
+
+def test_failed_and_deleted_files_lose_their_rows(tmp_path):
+    folder = str(tmp_path / "receipts")
+    os.makedirs(folder)
+    index = ReceiptIndex(str(tmp_path / "index.db"))
+    index.upsert_results(folder, [make_result(folder, name) for name in ("a.jpg", "b.jpg", "c.jpg")])
+    assert index.count() == 3
+
+    # 読み取り直して失敗した画像と、フォルダから消した画像の行は残さない
+    os.remove(os.path.join(folder, "c.jpg"))
+    index.upsert_results(folder, [make_result(folder, "b.jpg", error="timeout")])
+    assert [r["filename"] for r in index.search()] == ["a.jpg"]
+    assert index.monthly_summary()[0]["receipts"] == 1
+
+
+def test_rename_onto_a_name_with_stale_rows(tmp_path):
+    folder = str(tmp_path / "receipts")
+    os.makedirs(folder)
+    index = ReceiptIndex(str(tmp_path / "index.db"))
+    index.upsert_results(folder, [make_result(folder, "a.jpg"), make_result(folder, "old.jpg")])
+    # old.jpgを手で消した後に、a.jpgをold.jpgという名前にリネームした
+    os.remove(os.path.join(folder, "old.jpg"))
+    os.rename(os.path.join(folder, "a.jpg"), os.path.join(folder, "old.jpg"))
+    assert index.record_renames(folder, {"a.jpg": "old.jpg"}) == 1
+    assert [(r["filename"], r["original_filename"]) for r in index.search()] == [("old.jpg", "a.jpg")]
+    assert index.monthly_summary()[0]["receipts"] == 1
+
+
+def schema_state(path):
+    with closing(sqlite3.connect(path)) as conn:
+        return (conn.execute("PRAGMA schema_version").fetchone()[0], conn.execute("PRAGMA user_version").fetchone()[0],
+                conn.execute("SELECT sql FROM sqlite_master WHERE name = 'monthly_totals_insert'").fetchone()[0])
+
+
+def test_old_index_is_migrated_once(tmp_path):
+    path = str(tmp_path / "index.db")
+    # duplicate_of列がなく、コピーも合計に数える古いトリガーのインデックス
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.executescript("""
+            CREATE TABLE receipts (folder TEXT NOT NULL, filename TEXT NOT NULL, line_no INTEGER NOT NULL,
+                original_filename TEXT, file_hash TEXT, file_size INTEGER, file_mtime_ns INTEGER, date TEXT,
+                store TEXT, item TEXT, amount INTEGER, account TEXT, raw TEXT NOT NULL, updated_at REAL NOT NULL,
+                PRIMARY KEY (folder, filename, line_no));
+            CREATE TABLE monthly_totals (month TEXT NOT NULL, account TEXT NOT NULL, amount INTEGER NOT NULL,
+                receipts INTEGER NOT NULL, PRIMARY KEY (month, account));
+            CREATE TRIGGER monthly_totals_insert AFTER INSERT ON receipts WHEN NEW.date IS NOT NULL
+            BEGIN SELECT 1; END;
+            INSERT INTO receipts (folder, filename, line_no, date, amount, account, raw, updated_at)
+            VALUES ('f', 'a.jpg', 0, '2024-05-10', 1200, '消耗品費', 'raw', 0);
+            INSERT INTO monthly_totals VALUES ('2024-05', '消耗品費', 9999, 7);
+        """)
+
+    index = ReceiptIndex(path)
+    schema_version, user_version, trigger_sql = schema_state(path)
+    assert user_version == SCHEMA_VERSION
+    assert "duplicate_of IS NULL" in trigger_sql
+    # 古いトリガーで数えた合計は作り直される
+    assert index.monthly_summary() == [{"month": "2024-05", "account": "消耗品費", "amount": 1200, "receipts": 1}]
+
+    # 2回目以降はスキーマを変更しない
+    ReceiptIndex(path)
+    ReceiptIndex(path)
+    assert schema_state(path) == (schema_version, user_version, trigger_sql)
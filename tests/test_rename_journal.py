@@ -0,0 +1,114 @@
+#リネームのジャーナルから、途中まで行ったリネームや途中で落ちたリネームを元に戻せることの確認
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_renamer import FileRenamer
+from rename_journal import RenameJournal
+
+ROWS = [
+    "a.jpg,2024/05/10,セブン,文具,1200,消耗品費",
+    "b.jpg,2024/05/11,ローソン,お茶,150,会議費",
+    "c.jpg,2024/05/12,ファミマ,電池,400,消耗品費",
+]
+
+
+class Crash(BaseException):
+    """プロセスが落ちたことの代わり（except Exceptionでは捕まらない）"""
+
+
+def make_folder(folder, rows=ROWS):
+    for row in rows:
+        name = row.split(",", 1)[0]
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(name)
+    csv_path = os.path.join(folder, "results_RyoSyuSyo.csv")
+    with open(csv_path, "w", encoding="shift_jis", newline="") as f:
+        f.write("\r\n".join(rows) + "\r\n")
+    return csv_path
+
+
+def contents(folder):
+    result = {}
+    for name in os.listdir(folder):
+        if name.endswith(".jpg"):
+            with open(os.path.join(folder, name), encoding="utf-8") as f:
+                result[name] = f.read()
+    return result
+
+
+def test_partly_applied_renames_are_undone_in_reverse_order(tmp_path):
+    folder = str(tmp_path)
+    for name in ("x.jpg", "z.jpg", "w.jpg"):
+        (tmp_path / name).write_text(name, encoding="utf-8")
+    journal = RenameJournal.for_folder(folder)
+    journal.begin()
+    # x→y の後に z→x（xの元の名前を使う）ので、戻すときは z を先に戻さないと y→x が失敗する
+    journal.record("x.jpg", "y.jpg")
+    os.rename(tmp_path / "x.jpg", tmp_path / "y.jpg")
+    journal.record("z.jpg", "x.jpg")
+    os.rename(tmp_path / "z.jpg", tmp_path / "x.jpg")
+    # 記録した直後に落ちて、w はリネームされていない
+    journal.record("w.jpg", "v.jpg")
+
+    assert journal.rollback() == (2, [])
+    assert contents(folder) == {"x.jpg": "x.jpg", "z.jpg": "z.jpg", "w.jpg": "w.jpg"}
+    assert not journal.can_rollback()
+
+
+def test_rollback_after_a_crash_between_record_and_rename(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    csv_path = make_folder(folder)
+    with open(csv_path, "rb") as f:
+        original_csv = f.read()
+    backup = csv_path + ".bak"
+    with open(backup, "wb") as f:
+        f.write(original_csv)
+
+    real_rename = os.rename
+    calls = []
+
+    def crashing_rename(src, dst):
+        calls.append(src)
+        if len(calls) == 2:
+            raise Crash()
+        real_rename(src, dst)
+
+    journal = RenameJournal.for_folder(folder)
+    journal.begin(csv_path, backup)
+    with monkeypatch.context() as m:
+        m.setattr(os, "rename", crashing_rename)
+        with pytest.raises(Crash):
+            FileRenamer(csv_path, folder, journal=journal).rename_files()
+    # 書きかけの最後の行も残っている
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "rena')
+
+    # 次に起動したときに、同じジャーナルから元に戻す
+    resumed = RenameJournal.for_folder(folder)
+    assert resumed.can_rollback()
+    assert resumed.rollback() == (1, [])
+    assert contents(folder) == {"a.jpg": "a.jpg", "b.jpg": "b.jpg", "c.jpg": "c.jpg"}
+    with open(csv_path, "rb") as f:
+        assert f.read() == original_csv
+
+
+def test_existing_target_names_are_kept(tmp_path):
+    folder = str(tmp_path)
+    csv_path = make_folder(folder, ROWS[:1])
+    (tmp_path / "2024_05_10_セブン.jpg").write_text("existing", encoding="utf-8")
+    journal = RenameJournal.for_folder(folder)
+    journal.begin(csv_path)
+    success, failed, _ = FileRenamer(csv_path, folder, journal=journal).rename_files()
+    assert (success, failed) == (1, 0)
+    assert contents(folder) == {"2024_05_10_セブン.jpg": "existing", "2024_05_10_セブン(1).jpg": "a.jpg"}
+
+    # 元の名前が別のファイルで使われている場合は、上書きせずにエラーにする
+    (tmp_path / "a.jpg").write_text("new a", encoding="utf-8")
+    restored, errors = journal.rollback()
+    assert restored == 0 and errors == ["元のファイル名が既に使われています: a.jpg"]
+    assert contents(folder)["a.jpg"] == "new a"
+    assert journal.can_rollback()
@@ -0,0 +1,54 @@
+#同じ画像・同じテンプレートの2回目はAPIに送らず、テンプレートを編集したときはそのテンプレートの分だけ送り直すことの確認
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_processor import BatchExtractor
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from result_cache import ResultCache
+
+
+def make_folder(folder, count=3):
+    for i in range(count):
+        with open(os.path.join(folder, f"IMG_{i}.jpg"), "wb") as f:
+            f.write(f"image {i}".encode("utf-8"))
+
+
+def test_rerun_hits_the_cache_and_edited_template_is_sent_again(tmp_path):
+    folder = str(tmp_path / "receipts")
+    os.makedirs(folder)
+    make_folder(folder)
+    cache = ResultCache(str(tmp_path / "cache"))
+
+    with FakeOpenAIServer(0.0, 0.0, 0.0) as server:
+        def run(template):
+            before = server.requests
+            results = BatchExtractor("test", template, 2, base_url=server.base_url, cache=cache).run(folder, resume=False)
+            assert all(r.ok for r in results)
+            return server.requests - before, sum(r.cached for r in results)
+
+        assert run("template A") == (3, 0)
+        assert run("template A") == (0, 3)
+        assert run("template B") == (3, 0)
+
+        # テンプレートAを編集したら、Aの分だけ消えてBの分は残る
+        cache.invalidate_template("template A")
+        assert run("template A") == (3, 0)
+        assert run("template B") == (0, 3)
+
+
+def test_evict_removes_expired_then_oldest_entries(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_mb=0.001, max_age_days=1)
+    keys = [ResultCache.make_key(f"image {i}".encode("utf-8"), "template", "model") for i in range(4)]
+    for key in keys:
+        cache.put(key, "template", "x" * 400, "model")
+    now = time.time()
+    for age, key in zip((2 * 86400, 300, 200, 100), keys):
+        path = cache._entry_path(key, "template")
+        os.utime(path, (now - age, now - age))
+
+    # 期限切れの1件と、上限（約1KB）を超える分の古い1件が消える
+    assert cache.evict() == 2
+    assert [cache.get(key, "template") is not None for key in keys] == [False, False, True, True]
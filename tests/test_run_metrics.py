@@ -0,0 +1,78 @@
+#一括処理の計測値をパーセンタイル・料金に集計し、実行レポートとPrometheus用のファイルに書き出すことの確認
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_processor import BatchExtractor, ExtractionResult
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from run_metrics import PROMETHEUS_NAME, RUN_REPORT_NAME, build_run_report, percentile, prometheus_text
+
+PRICING = {"input_usd_per_million": 2.0, "output_usd_per_million": 10.0, "yen_per_usd": 100.0}
+
+
+def make_results():
+    results = []
+    for i in range(10):
+        result = ExtractionResult(i, f"IMG_{i}.jpg", text="row")
+        result.metrics = {"latency_seconds": float(i + 1), "upload_bytes": 1000 * (i + 1),
+                          "prompt_tokens": 1000, "completion_tokens": 100}
+        results.append(result)
+    results[0].retries = 2
+    cached = ExtractionResult(10, "IMG_10.jpg", text="row", cached=True)
+    failed = ExtractionResult(11, "IMG_11.jpg", error="timeout")
+    return results + [cached, failed]
+
+
+def test_percentiles_and_cost():
+    assert percentile([], 50) is None
+    assert [percentile([3, 1, 2, 4], p) for p in (50, 95, 99)] == [2, 4, 4]
+
+    report = build_run_report(make_results(), 60.0, PRICING)
+    assert (report["images"], report["succeeded"], report["failed"]) == (12, 11, 1)
+    assert (report["api_images"], report["cache_hits"], report["retries"]) == (10, 1, 2)
+    assert report["images_per_minute"] == 12.0
+    assert report["timings"]["latency_seconds"] == {"p50": 5.0, "p95": 10.0, "p99": 10.0, "count": 10, "sum": 55.0}
+    assert report["timings"]["ttfb_seconds"]["p50"] is None
+    assert report["upload_bytes"]["p95"] == 10000
+    # 入力10000トークン×2ドル + 出力1000トークン×10ドル（100万トークンあたり）= 0.03ドル = 3円
+    assert report["tokens"] == {"prompt": 10000, "completion": 1000}
+    assert round(report["cost"]["yen"], 6) == 3.0
+    assert round(report["cost"]["yen_per_api_image"], 6) == 0.3
+
+
+def test_prometheus_text_format():
+    text = prometheus_text(build_run_report(make_results(), 60.0, PRICING), {"folder": "2024-05"})
+    lines = text.splitlines()
+    assert 'aishiwake_run_images{folder="2024-05"} 12.0' in lines
+    assert 'aishiwake_run_stage_seconds{folder="2024-05",stage="latency",quantile="0.5"} 5.0' in lines
+    # 値のない段階はNaNにする
+    assert 'aishiwake_run_stage_seconds{folder="2024-05",stage="ttfb",quantile="0.95"} NaN' in lines
+    assert 'aishiwake_run_tokens{folder="2024-05",kind="completion"} 1000.0' in lines
+    # HELPとTYPEは指標ごとに1回だけ
+    assert lines.count("# TYPE aishiwake_run_stage_seconds gauge") == 1
+    assert lines.count("# TYPE aishiwake_run_tokens gauge") == 1
+    for line in lines:
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            assert name.startswith("aishiwake_run_")
+            float(value)
+
+
+def test_run_writes_the_report_and_prometheus_file(tmp_path):
+    folder = str(tmp_path)
+    for i in range(3):
+        with open(os.path.join(folder, f"IMG_{i}.jpg"), "wb") as f:
+            f.write(f"image {i}".encode("utf-8"))
+    with FakeOpenAIServer(0.0, 0.0, 0.0) as server:
+        BatchExtractor("test", "prompt", 2, base_url=server.base_url, pricing=PRICING).run(folder)
+
+    with open(os.path.join(folder, RUN_REPORT_NAME), encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["api_images"] == 3 and report["failed"] == 0
+    assert report["timings"]["latency_seconds"]["count"] == 3
+    assert report["tokens"]["completion"] == 60
+    assert report["cost"]["yen"] > 0
+    with open(os.path.join(folder, PROMETHEUS_NAME), encoding="utf-8") as f:
+        assert f'aishiwake_run_api_images{{folder="{os.path.basename(folder)}"}} 3.0' in f.read().splitlines()
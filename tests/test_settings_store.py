@@ -0,0 +1,61 @@
+#settings.jsonに変えた項目だけが残り、ほかの項目はデフォルト設定で補われることの確認
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings_store import SettingsStore, default_settings
+
+USER_FILE = {
+    "api_key": "",
+    "max_size": 1800,
+    "resize_enabled": True,
+    "current_template": "white_tax",
+    "prompt_templates": {
+        "white_tax": default_settings()["prompt_templates"]["white_tax"],
+        "blue_tax": {"name": "青色申告用", "template": "青色申告に必要な情報を抽出せよ"},
+    },
+    "rate_limit": {"max_retries": 2},
+}
+
+
+def read_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_save_round_trip_keeps_the_file_minimal(tmp_path):
+    path = str(tmp_path / "settings.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(USER_FILE, f, ensure_ascii=False)
+
+    store = SettingsStore(path)
+    settings = store.load()
+    # 読み込んだ設定にはデフォルトが補われている
+    assert settings["quality_gate"] == default_settings()["quality_gate"]
+    assert settings["rate_limit"]["max_retries"] == 2
+    assert settings["rate_limit"]["requests_per_minute"] == default_settings()["rate_limit"]["requests_per_minute"]
+
+    settings["current_template"] = "blue_tax"
+    store.save(settings)
+
+    # 保存しても、デフォルトと同じ項目はファイルに書かれない
+    assert read_file(path) == {
+        "resize_enabled": True,
+        "current_template": "blue_tax",
+        "prompt_templates": USER_FILE["prompt_templates"],
+        "rate_limit": {"max_retries": 2},
+    }
+    assert SettingsStore(path).load() == store.load()
+
+
+def test_update_does_not_write_defaults(tmp_path):
+    path = str(tmp_path / "settings.json")
+    store = SettingsStore(path)
+    store.load()
+    store.update(max_workers=8)
+    saved = read_file(path)
+    assert saved["max_workers"] == 8
+    assert "rate_limit" not in saved and "cache" not in saved
+    assert store.load()["cache"] == default_settings()["cache"]
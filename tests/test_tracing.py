@@ -0,0 +1,72 @@
+#トレースを有効にしたときだけ、一括処理の段階ごとのspanをChrome trace形式のファイルに書き出すことの確認
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracing
+from batch_processor import BatchExtractor
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from tracing import TRACE_NAME, span, tracing_options, tracing_session
+
+
+def make_folder(folder, count=2):
+    for i in range(count):
+        with open(os.path.join(folder, f"IMG_{i}.jpg"), "wb") as f:
+            f.write(f"image {i}".encode("utf-8"))
+
+
+def read_events(path):
+    with open(path, encoding="utf-8") as f:
+        trace = json.load(f)
+    return trace["traceEvents"]
+
+
+def test_run_is_written_as_a_chrome_trace(tmp_path):
+    folder = str(tmp_path)
+    make_folder(folder)
+    path = os.path.join(folder, TRACE_NAME)
+    with FakeOpenAIServer(0.0, 0.0, 0.0) as server:
+        with tracing_session({"profile": False, "trace_memory": False}, path):
+            BatchExtractor("test", "prompt", 2, base_url=server.base_url).run(folder)
+    assert tracing.get_tracer() is None
+
+    events = read_events(path)
+    spans = [e for e in events if e["ph"] == "X"]
+    names = {e["name"] for e in spans}
+    assert {"batch.run", "extract", "image.read", "encode_image", "create_message", "api.call",
+            "response.parse", "csv.write", "report.write"} <= names
+    assert sum(1 for e in spans if e["name"] == "api.call") == 2
+    assert all(e["dur"] >= 0 and e["ts"] >= 0 for e in spans)
+    # ワーカーのスレッドにも名前が付いている
+    thread_names = {e["args"]["name"] for e in events if e["name"] == "thread_name"}
+    assert any(name.startswith("ThreadPoolExecutor") for name in thread_names)
+    # 外側のspanは内側のspanを含む
+    run = next(e for e in spans if e["name"] == "batch.run")
+    for e in spans:
+        assert run["ts"] <= e["ts"] and e["ts"] + e["dur"] <= run["ts"] + run["dur"] + 1
+
+
+def test_profile_and_memory_snapshots(tmp_path):
+    path = str(tmp_path / "trace.json")
+    with tracing_session({"profile": True, "trace_memory": True}, path):
+        with span("work", images=3):
+            sum(i * i for i in range(10000))
+    assert os.path.exists(str(tmp_path / "trace.prof"))
+    with open(str(tmp_path / "trace.memory.txt"), encoding="utf-8") as f:
+        assert f.readline().startswith("現在: ")
+    events = read_events(path)
+    assert [e["args"] for e in events if e["name"] == "work"] == [{"images": 3}]
+    assert any(e["ph"] == "C" and e["name"] == "memory" for e in events)
+
+
+def test_nothing_is_recorded_when_disabled(tmp_path):
+    assert tracing_options({}) is None
+    assert tracing_options({"tracing": {"enabled": True}}) == {"profile": False, "trace_memory": False}
+    path = str(tmp_path / "trace.json")
+    with tracing_session(None, path):
+        with span("work"):
+            pass
+    assert tracing.get_tracer() is None
+    assert not os.path.exists(path)
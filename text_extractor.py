@@ -2,49 +2,32 @@
 import base64
 import json
 import os
-from openai import OpenAI
+import time
+from client_pool import get_openai_client
+from settings_store import get_settings_store
+from result_cache import ResultCache
+from image_preprocessor import guess_image_mime
+from tracing import span, traced
+
+MODEL_NAME = 'gpt-4o'
 
 SYSTEM_ROLE_CONTENT = "このシステムは提供された画像の内容の説明を生成します。画像を識別し視覚情報をテキスト形式で提供します。"
 
 def ensure_settings_file():
     """設定ファイルが存在しない場合、デフォルト設定で作成する"""
-    if not os.path.exists("settings.json"):
-        default_settings = {
-            "api_key": "",
-            "max_size": 1800,
-            "resize_enabled": False,
-            "current_template": "white_tax",
-            "default_folder_path": os.path.expanduser("~\\Documents"),  # デフォルトのフォルダパス
-            "prompt_templates": {
-                "white_tax": {
-                    "name": "白色申告用",
-                    "template": "画像から、取引年月日(yyyy/mm/ddのみ時間なし)、店舗名、商品名(要約)、合計金額(通貨記号は削除)、推測される勘定科目名を抽出しカンマ区切り(,)でreturnせよ"
-                }
-            }
-        }
-        with open("settings.json", "w", encoding='utf-8') as f:
-            json.dump(default_settings, f, indent=4, ensure_ascii=False)
-        return default_settings
-    
-    try:
-        with open("settings.json", "r", encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        raise ValueError("settings.jsonの形式が正しくありません。")
+    # 読み込み結果はストアでキャッシュされるので、画像ごとに呼ばれてもファイルは開き直さない
+    return get_settings_store().load()
 
 def save_settings(settings):
     """設定を保存する"""
-    with open("settings.json", "w", encoding='utf-8') as f:
-        json.dump(settings, f, indent=4, ensure_ascii=False)
+    get_settings_store().save(settings)
 
 def get_current_template(settings):
     """現在選択されているテンプレートを取得"""
     current = settings.get("current_template", "white_tax")
     templates = settings.get("prompt_templates", {})
     if current not in templates:
-        current = "white_tax"  # デフォルトに戻す
-        settings["current_template"] = current
-        save_settings(settings)
+        current = "white_tax"  # デフォルトに戻す（ここでは保存しない）
     return templates[current]["template"]
 
 def get_available_templates(settings):
@@ -64,6 +47,7 @@ def add_template(key, name, template):
     """新しいテンプレートを追加"""
     settings = ensure_settings_file()
     settings.setdefault("prompt_templates", {})
+    _invalidate_cached_results(settings, key)
     settings["prompt_templates"][key] = {
         "name": name,
         "template": template
@@ -78,9 +62,17 @@ def remove_template(key):
     if key in settings.get("prompt_templates", {}):
         if settings.get("current_template") == key:
             settings["current_template"] = "white_tax"
+        _invalidate_cached_results(settings, key)
         del settings["prompt_templates"][key]
         save_settings(settings)
 
+def _invalidate_cached_results(settings, key):
+    """テンプレートを書き換える前に、そのテンプレートで作られたキャッシュを削除する"""
+    old = settings.get("prompt_templates", {}).get(key)
+    cache = ResultCache.from_settings(settings)
+    if old and cache is not None:
+        cache.invalidate_template(old["template"])
+
 def get_gpt_openai_apikey():
     # 環境変数からAPIキーを取得
     env_api_key = os.environ.get("OPENAI_API_KEY")
@@ -107,10 +99,18 @@ def create_secret_file(api_key):
         json.dump({"OPENAI_API_KEY": api_key}, f, indent=4)
 
 def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode()
-    return f"data:image/jpeg;base64,{encoded_string}"
-
+    with span("image.read"):
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+    return encode_image_bytes(data, guess_image_mime(image_path))
+
+def encode_image_bytes(data, mime="image/jpeg"):
+    """メモリ上の画像データをdata URLにする"""
+    with span("encode_image", bytes=len(data)):
+        encoded_string = base64.b64encode(data).decode()
+    return f"data:{mime};base64,{encoded_string}"
+
+@traced("create_message")
 def create_message(system_role, prompt, image_base64):
     message = [
         {
@@ -135,9 +135,116 @@ def create_message(system_role, prompt, image_base64):
     ]
     return message
 
-def gen_chat_response_with_gpt4(image_path, api_key, prompt_template=None):
-    openai_client = OpenAI(api_key=api_key)
-    image_base64 = encode_image(image_path)
+PACKED_INSTRUCTION = "\n\n複数の画像を送ります。各画像の直前にファイル名を示します。画像ごとに上の指示どおりに抽出し、出力するすべての行の先頭に、その画像のファイル名とカンマ(,)を付けてください。"
+
+@traced("create_message")
+def create_packed_message(system_role, prompt, images):
+    """
+    複数の画像を1回のリクエストで送るためのメッセージ
+    images: (ファイル名, data URL) のリスト
+    """
+    content = [{'type': 'text', 'text': prompt + PACKED_INSTRUCTION}]
+    for filename, image_base64 in images:
+        content.append({'type': 'text', 'text': f"ファイル名: {filename}"})
+        content.append({'type': 'image_url', 'image_url': {'url': image_base64}})
+    return [
+        {
+            'role': 'system',
+            'content': system_role
+        },
+        {
+            'role': 'user',
+            'content': content
+        },
+    ]
+
+@traced("response.parse")
+def split_packed_response(text, filenames):
+    """
+    複数画像の返答をファイル名ごとに分ける
+    先頭がファイル名で始まらない行は無視する。返答に含まれなかったファイルは結果に入らない
+    """
+    # 長いファイル名から判定する（a.jpgとaa.jpgのような前方一致の取り違えを防ぐ）
+    names = sorted(filenames, key=len, reverse=True)
+    parts = {}
+    for line in text.splitlines():
+        line = line.strip()
+        for name in names:
+            if line.startswith(name + ","):
+                parts.setdefault(name, []).append(line[len(name) + 1:])
+                break
+    return {name: "\n".join(lines) for name, lines in parts.items()}
+
+def _record_usage(metrics, usage):
+    """response.usageのトークン数を計測結果に入れる"""
+    if metrics is None or usage is None:
+        return
+    metrics["prompt_tokens"] = usage.prompt_tokens
+    metrics["completion_tokens"] = usage.completion_tokens
+
+def _request_completion(api_key, base_url, messages, stream=False, metrics=None):
+    """
+    metricsに辞書を渡すと、所要時間（latency_seconds・ストリーミングの場合はttfb_seconds）と
+    トークン数（prompt_tokens・completion_tokens）を書き込む
+    """
+    # クライアントは毎回作らずに使い回す（接続とTLSハンドシェイクを省くため）
+    openai_client = get_openai_client(api_key, base_url)
+    started = time.perf_counter()
+    if stream:
+        with span("api.call", stream=True):
+            text = _read_stream(openai_client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                temperature=0,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), metrics, started)
+        if metrics is not None:
+            metrics["latency_seconds"] = time.perf_counter() - started
+        return text
+
+    with span("api.call"):
+        response = openai_client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=messages,
+            temperature=0,
+        )
+    if metrics is not None:
+        metrics["latency_seconds"] = time.perf_counter() - started
+        _record_usage(metrics, getattr(response, "usage", None))
+
+    with span("response.parse"):
+        if response and response.choices:
+            return response.choices[0].message.content
+        return "No data extracted"
+
+def _read_stream(chunks, metrics=None, started=None):
+    """ストリーミングの返答を受け取った順につなげる"""
+    parts = []
+    for chunk in chunks:
+        if metrics is not None and started is not None and "ttfb_seconds" not in metrics:
+            metrics["ttfb_seconds"] = time.perf_counter() - started
+        # 使用量は最後のチャンク（choicesが空）に入っている
+        _record_usage(metrics, getattr(chunk, "usage", None))
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    return "".join(parts) if parts else "No data extracted"
+
+def gen_chat_response_for_images(images, api_key, prompt_template, base_url=None, stream=False, metrics=None):
+    """複数の画像（(ファイル名, data URL) のリスト）をまとめて1回で問い合わせる"""
+    messages = create_packed_message(SYSTEM_ROLE_CONTENT, prompt_template, images)
+    return _request_completion(api_key, base_url, messages, stream, metrics)
+
+def gen_chat_response_with_gpt4(image_path, api_key, prompt_template=None, base_url=None, image_base64=None, stream=False,
+                                metrics=None):
+    # 前処理済みの画像が渡された場合はファイルを読み直さない
+    if image_base64 is None:
+        started = time.perf_counter()
+        image_base64 = encode_image(image_path)
+        if metrics is not None:
+            metrics["encode_seconds"] = time.perf_counter() - started
+    if metrics is not None:
+        metrics["upload_bytes"] = len(image_base64)
     
     # プロンプトテンプレートが指定されていない場合は現在の設定から取得
     if prompt_template is None:
@@ -145,16 +252,4 @@ def gen_chat_response_with_gpt4(image_path, api_key, prompt_template=None):
         prompt_template = get_current_template(settings)
     
     messages = create_message(SYSTEM_ROLE_CONTENT, prompt_template, image_base64)
-
-    response = openai_client.chat.completions.create(
-        model='gpt-4o',
-        messages=messages,
-        temperature=0,
-    )
-
-    if response and response.choices:
-        extracted_data = response.choices[0].message.content
-    else:
-        extracted_data = "No data extracted"
-
-    return extracted_data
\ No newline at end of file
+    return _request_completion(api_key, base_url, messages, stream, metrics)
\ No newline at end of file
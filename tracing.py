@@ -0,0 +1,231 @@
+#処理の段階ごとの時間を記録し、Chrome（chrome://tracing）やPerfettoで開けるトレースファイルに書き出す部分
+#有効にしたときだけ記録する（無効のときは何もしない空のspanを返すだけなので、普段の処理速度には影響しない）
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+TRACE_NAME = "trace_RyoSyuSyo.json"
+# 記録するイベント数の上限（5万枚を処理しても数百MBのファイルにならないようにする）
+MAX_EVENTS = 500000
+MEMORY_TOP_LINES = 30
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """
+    spanの開始・終了時刻をスレッドごとに記録する
+    profile=Trueの場合はspanを実行している間だけスレッドごとにcProfileで計測し、
+    trace_memory=Trueの場合はspanの終了ごとにtracemallocのメモリ使用量をカウンターとして記録する
+    """
+    def __init__(self, profile: bool = False, trace_memory: bool = False):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.dropped = 0
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events: List[dict] = []
+        self._thread_names: Dict[int, str] = {}
+        self._profilers: List[cProfile.Profile] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1_000_000
+
+    def _add(self, event: dict) -> None:
+        with self._lock:
+            if len(self._events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            tid = event["tid"]
+            if tid not in self._thread_names:
+                self._thread_names[tid] = threading.current_thread().name
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "pipeline", **args):
+        depth = getattr(self._local, "depth", 0)
+        profiler = None
+        if self.profile and depth == 0:
+            profiler = self._start_profiler()
+        self._local.depth = depth + 1
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            end = self._now_us()
+            self._local.depth = depth
+            if profiler is not None:
+                profiler.disable()
+            tid = threading.get_ident()
+            event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": end - start,
+                     "pid": self._pid, "tid": tid}
+            if args:
+                event["args"] = args
+            self._add(event)
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                self._add({"name": "memory", "ph": "C", "ts": end, "pid": self._pid, "tid": tid,
+                           "args": {"current_mb": current / (1024 * 1024), "peak_mb": peak / (1024 * 1024)}})
+
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        # スレッドごとに1つのプロファイラを使い回し、最後にまとめて集計する
+        profiler = getattr(self._local, "profiler", None)
+        if profiler is None:
+            profiler = cProfile.Profile()
+            self._local.profiler = profiler
+            with self._lock:
+                self._profilers.append(profiler)
+        try:
+            profiler.enable()
+        except ValueError:
+            # 他のプロファイラが動いている場合（Python 3.12以降）は計測しない
+            return None
+        return profiler
+
+    def instant(self, name: str, category: str = "pipeline", **args) -> None:
+        """時間の幅を持たない出来事（429を受けたなど）を記録する"""
+        event = {"name": name, "cat": category, "ph": "i", "s": "t", "ts": self._now_us(),
+                 "pid": self._pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        self._add(event)
+
+    def write(self, path: str) -> List[str]:
+        """
+        トレースファイルを書き出し、書き出したファイルのパスを返す
+        プロファイルは「トレースファイル名.prof」（pstats形式）、メモリは「トレースファイル名.memory.txt」に書く
+        """
+        base = os.path.splitext(path)[0]
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+            profilers = list(self._profilers)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": "AIShiwake"}}]
+        metadata.extend({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                        for tid, name in thread_names.items())
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                       "otherData": {"dropped_events": self.dropped}}, f, ensure_ascii=False)
+        written = [path]
+
+        if profilers:
+            stats = None
+            for profiler in profilers:
+                try:
+                    if stats is None:
+                        stats = pstats.Stats(profiler)
+                    else:
+                        stats.add(profiler)
+                except TypeError:
+                    # 一度も計測しなかったプロファイラは集計できない
+                    continue
+            if stats is not None:
+                stats.dump_stats(base + ".prof")
+                written.append(base + ".prof")
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            with open(base + ".memory.txt", "w", encoding="utf-8") as f:
+                f.write(f"現在: {current / (1024 * 1024):.1f}MB / ピーク: {peak / (1024 * 1024):.1f}MB\n")
+                for stat in snapshot.statistics("lineno")[:MEMORY_TOP_LINES]:
+                    f.write(f"{stat}\n")
+            written.append(base + ".memory.txt")
+        return written
+
+    def close(self) -> None:
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable_tracing(profile: bool = False, trace_memory: bool = False) -> Tracer:
+    """トレースを開始する（既に開始している場合はそのトレーサーを返す）"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(profile, trace_memory)
+    return _tracer
+
+
+def disable_tracing() -> Optional[Tracer]:
+    """トレースを止めて、記録済みのトレーサーを返す（書き出しは呼び出し側で行う）"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def tracing_options(settings: dict) -> Optional[dict]:
+    """settings.jsonの"tracing"から、enable_tracingに渡す引数を返す（無効の場合はNone）"""
+    options = settings.get("tracing", {})
+    if not options.get("enabled", False):
+        return None
+    return {"profile": bool(options.get("profile", False)), "trace_memory": bool(options.get("trace_memory", False))}
+
+
+@contextlib.contextmanager
+def tracing_session(options: Optional[dict], path: str):
+    """
+    optionsがNoneでなければ、withの中の処理をトレースしてpathに書き出す
+    既にトレース中の場合は、外側のトレースにまとめて記録する
+    """
+    if options is None or _tracer is not None:
+        yield
+        return
+    tracer = enable_tracing(**options)
+    try:
+        yield
+    finally:
+        # tracemallocを止める前に書き出す
+        try:
+            for written in tracer.write(path):
+                print(f"トレースを書き出しました: {written}")
+        except Exception as e:
+            print(f"トレースの書き出しエラー: {str(e)}")
+        disable_tracing()
+
+
+def span(name: str, category: str = "pipeline", **args):
+    """トレース中であれば区間を記録する（with span("encode_image"): ...）"""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, **args)
+
+
+def instant(name: str, category: str = "pipeline", **args) -> None:
+    tracer = _tracer
+    if tracer is not None:
+        tracer.instant(name, category, **args)
+
+
+def traced(name: str, category: str = "pipeline"):
+    """関数全体を1つのspanとして記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,10 +1,17 @@
 import os
 from tkinter import Tk, Label, Button, Entry, StringVar, Frame, BooleanVar, IntVar, Checkbutton, Toplevel, ttk, Text, Listbox, messagebox, Scrollbar
-from text_extractor import get_available_templates, get_current_template, set_template, add_template, remove_template
-from settings_manager import load_settings, save_settings
+from text_extractor import get_available_templates, get_current_template, set_template, add_template, remove_template, get_gpt_openai_apikey
+from settings_store import get_settings_store
 from file_handler import select_folder, open_processed_folder
 from file_renamer import FileRenamer
+from csv_loader import ERROR_ROWS_MESSAGE, load_results_csv
 from backup_manager import BackupManager
+from rename_journal import RenameJournal
+from receipt_index import ReceiptIndex
+from batch_processor import BatchExtractor, format_saved_calls, list_image_files, RESULT_CSV_NAME
+from folder_watcher import FolderWatcher
+from job_runner import QUEUED
+from tracing import TRACE_NAME, tracing_options, tracing_session
 
 def open_template_manager(parent_window, template_label):
     """テンプレート管理画面を開く"""
@@ -13,7 +20,7 @@ def open_template_manager(parent_window, template_label):
     template_window.geometry("800x500")
     template_window.minsize(800, 500)
 
-    settings = load_settings()
+    settings = get_settings_store().load()
     templates = settings.get("prompt_templates", {})
     
     # メインフレーム（スクロールに対応するため）
@@ -74,7 +81,7 @@ def open_template_manager(parent_window, template_label):
         selected_text = template_listbox.get(selection[0])
         key = selected_text.split(" (")[-1].rstrip(")")
         
-        settings = load_settings()
+        settings = get_settings_store().load()
         templates = settings.get("prompt_templates", {})
         template = templates[key]
         
@@ -108,7 +115,7 @@ def open_template_manager(parent_window, template_label):
             messagebox.showinfo("成功", "テンプレートを保存しました")
             
             template_listbox.delete(0, "end")
-            settings = load_settings()
+            settings = get_settings_store().load()
             templates = settings.get("prompt_templates", {})
             for k, v in templates.items():
                 template_listbox.insert("end", f"{v['name']} ({k})")
@@ -140,7 +147,7 @@ def open_template_manager(parent_window, template_label):
             try:
                 add_template(key, name_var.get(), template_text.get("1.0", "end-1c"))
                 template_listbox.delete(0, "end")
-                settings = load_settings()
+                settings = get_settings_store().load()
                 templates = settings.get("prompt_templates", {})
                 for k, v in templates.items():
                     template_listbox.insert("end", f"{v['name']} ({k})")
@@ -181,7 +188,7 @@ def open_template_manager(parent_window, template_label):
     save_button.config(state="disabled", bg="lightgray")
 
 def open_advanced_settings(parent_window, template_label, api_key_var, max_size_var, resize_enabled_var):
-    settings = load_settings()
+    settings = get_settings_store().load()
     
     advanced_settings_window = Toplevel(parent_window)
     advanced_settings_window.title("詳細設定")
@@ -264,7 +271,7 @@ def open_advanced_settings(parent_window, template_label, api_key_var, max_size_
 
     def on_template_change(event):
         set_template(template_dropdown.get())
-        settings = load_settings()
+        settings = get_settings_store().load()
         template = settings["prompt_templates"][template_dropdown.get()]["template"]
         template_content.config(state="normal")
         template_content.delete("1.0", "end")
@@ -275,10 +282,10 @@ def open_advanced_settings(parent_window, template_label, api_key_var, max_size_
     template_dropdown.bind('<<ComboboxSelected>>', on_template_change)
 
 def save_and_close_advanced_settings(window, api_key, max_size, resize_enabled, default_folder_path):
-    save_settings(api_key, max_size, resize_enabled, default_folder_path)
+    get_settings_store().update(api_key=api_key, max_size=max_size, resize_enabled=resize_enabled, default_folder_path=default_folder_path)
     window.destroy()
 
-def open_rename_dialog(parent_window, target_dir: str):
+def open_rename_dialog(parent_window, target_dir: str, job_runner):
     # 事前チェック
     csv_path = os.path.join(target_dir, "results_RyoSyuSyo.csv")
     
@@ -287,27 +294,11 @@ def open_rename_dialog(parent_window, target_dir: str):
         messagebox.showerror("エラー", "CSVファイルが見つかりません")
         return
         
-    # CSVファイルのエラーメッセージチェック
+    # CSVファイルのエラーメッセージチェック（読み込んだ内容はリネーム処理でも使い回す）
     try:
-        encodings = ['shift_jis', 'utf-8']
-        has_error = False
-        for encoding in encodings:
-            try:
-                with open(csv_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                    if "申し訳ありません" in content:
-                        has_error = True
-                        break
-            except UnicodeDecodeError:
-                continue
-                
-        if has_error:
-            messagebox.showerror("エラー", 
-                "CSVファイルにエラーメッセージが含まれています。\n" +
-                "先にCSVファイルの内容を修正してください。\n\n" +
-                "修正方法：\n" +
-                "1. CSVファイルを開いて、「申し訳ありません」を含む行を削除\n" +
-                "2. または、update_csv.pyを実行してCSVファイルを更新")
+        table = load_results_csv(csv_path)
+        if table.has_errors:
+            messagebox.showerror("エラー", ERROR_ROWS_MESSAGE)
             return
     except Exception as e:
         messagebox.showerror("エラー", f"CSVファイルの読み込み中にエラーが発生しました: {str(e)}")
@@ -337,54 +328,259 @@ def open_rename_dialog(parent_window, target_dir: str):
     result_text.config(yscrollcommand=scrollbar.set)
     
     def update_result(text):
+        if not rename_window.winfo_exists():
+            return
         result_text.insert("end", text + "\n")
         result_text.see("end")
 
+    rename_progress = ttk.Progressbar(main_frame, maximum=100, mode='determinate')
+    rename_progress.pack(side="top", fill="x", pady=(10, 0))
+
+    def set_progress(done, total):
+        if rename_window.winfo_exists():
+            rename_progress["value"] = int(done * 100 / total) if total else 100
+
     def execute_rename():
-        # バックアップ作成
+        # バックアップ作成（画像はコピーせず、リネームの内容をジャーナルに記録する）
         backup_manager = BackupManager(target_dir)
-        zip_backup = backup_manager.create_zip_backup()
-        if not zip_backup:
-            messagebox.showerror("エラー", "バックアップの作成に失敗しました")
-            return
-
         csv_backup = backup_manager.backup_csv_file(csv_path)
         if not csv_backup:
             messagebox.showerror("エラー", "CSVファイルのバックアップに失敗しました")
             return
 
-        update_result(f"バックアップを作成しました: {os.path.basename(zip_backup)}")
+        journal = RenameJournal.for_folder(target_dir)
+        try:
+            journal.begin(csv_path, csv_backup)
+        except OSError as e:
+            messagebox.showerror("エラー", f"リネーム記録の作成に失敗しました: {str(e)}")
+            return
+
         update_result(f"CSVバックアップを作成しました: {os.path.basename(csv_backup)}")
+        update_result(f"リネームの記録先: {os.path.basename(journal.path)}")
+        execute_button.config(state="disabled")
+        cancel_button.config(state="normal")
 
-        # リネーム処理の実行
-        renamer = FileRenamer(csv_path, target_dir)
-        success_count, error_count, errors = renamer.rename_files()
+        # リネーム処理は別スレッドで実行する（画面は固まらない）
+        # エラーは起きた時点で表示し、終わった後には残りのメッセージだけを表示する
+        logged_errors = []
 
-        # エラーメッセージの表示
-        if errors and "CSVファイルにエラーメッセージが含まれています" in errors[0]:
-            messagebox.showwarning("警告", errors[0])
-            return
+        def rename_job(context):
+            def log_error(message):
+                if not logged_errors:
+                    context.log("エラー内容:")
+                logged_errors.append(message)
+                context.log(f"- {message}")
+
+            # settings.jsonの"tracing"が有効な場合はフォルダ内にトレースを書き出す
+            with tracing_session(tracing_options(get_settings_store().load()), os.path.join(target_dir, TRACE_NAME)):
+                renamer = FileRenamer(csv_path, target_dir, table, journal,
+                                      ReceiptIndex.from_settings(get_settings_store().load()))
+                return renamer.rename_files(context.progress, context.cancel_event, log_error)
+
+        def on_done(job):
+            if not rename_window.winfo_exists():
+                return
+            execute_button.config(state="normal")
+            cancel_button.config(state="disabled")
+            if job.error is not None:
+                update_result(f"予期せぬエラーが発生しました: {job.error}")
+                offer_rollback("予期せぬエラーが発生しました。")
+                return
+            success_count, error_count, errors = job.result
+            set_progress(1, 1)
+
+            # エラーメッセージの表示
+            if errors and "CSVファイルにエラーメッセージが含まれています" in errors[0]:
+                messagebox.showwarning("警告", errors[0])
+                return
+
+            # 結果の表示
+            update_result(f"\n処理結果:")
+            update_result(f"成功: {success_count}件")
+            update_result(f"失敗: {error_count}件")
+
+            if errors:
+                # 処理中に表示したエラーは繰り返さない
+                remaining = errors[len(logged_errors):]
+                if remaining and not logged_errors:
+                    update_result("\nエラー内容:")
+                for error in remaining:
+                    update_result(f"- {error}")
+
+            # エラーの有無にかかわらず、中止した場合やリネーム済みのファイルがある場合は元に戻せるようにする
+            if job.cancel_event.is_set():
+                offer_rollback("リネームを中止しました。", force=True)
+            elif error_count > 0:
+                offer_rollback("エラーが発生しました。", force=True)
+            else:
+                offer_rollback("リネームが完了しました。")
 
-        # 結果の表示
-        update_result(f"\n処理結果:")
-        update_result(f"成功: {success_count}件")
-        update_result(f"失敗: {error_count}件")
+        def offer_rollback(reason, force=False):
+            if not force and not journal.can_rollback():
+                return
+            if messagebox.askyesno("確認", f"{reason}リネーム前の状態に戻しますか？"):
+                rollback_journal(journal)
+
+        rename_jobs.append(job_runner.submit("リネーム", rename_job, on_progress=set_progress, on_log=update_result, on_done=on_done))
+
+    def rollback_journal(journal):
+        # 元に戻す処理も件数が多いと時間がかかるので別スレッドで行う
+        def on_done(job):
+            if job.error is not None:
+                update_result(f"\n復元に失敗しました: {job.error}")
+                return
+            restored, restore_errors = job.result
+            if not restore_errors:
+                update_result(f"\nリネーム前の状態に戻しました（{restored}件）")
+            else:
+                update_result("\n復元に失敗しました")
+                for error in restore_errors:
+                    update_result(f"- {error}")
 
-        if errors:
-            update_result("\nエラー内容:")
-            for error in errors:
-                update_result(f"- {error}")
+        update_result("\nリネーム前の状態に戻しています...")
+        def rollback_job(context):
+            restored, restore_errors = journal.rollback()
+            receipt_index = ReceiptIndex.from_settings(get_settings_store().load())
+            if receipt_index is not None:
+                receipt_index.restore_original_names(target_dir)
+            return restored, restore_errors
 
-            if error_count > 0:
-                if messagebox.askyesno("確認", "エラーが発生しました。バックアップから復元しますか？"):
-                    if backup_manager.restore_from_backup(zip_backup):
-                        update_result("\nバックアップから復元しました")
-                    else:
-                        update_result("\n復元に失敗しました")
+        job_runner.submit("リネームの取り消し", rollback_job, on_done=on_done)
+
+    rename_jobs = []
+
+    def cancel_rename():
+        for job in rename_jobs:
+            job.cancel()
+        update_result("中止しています...")
 
     # ボタンエリア
     button_frame = Frame(main_frame)
     button_frame.pack(side="bottom", fill="x", pady=10)
 
-    Button(button_frame, text="実行", command=execute_rename).pack(side="right", padx=5)
-    Button(button_frame, text="閉じる", command=rename_window.destroy).pack(side="right", padx=5) 
\ No newline at end of file
+    execute_button = Button(button_frame, text="実行", command=execute_rename)
+    execute_button.pack(side="right", padx=5)
+    cancel_button = Button(button_frame, text="中止", command=cancel_rename, state="disabled")
+    cancel_button.pack(side="right", padx=5)
+    Button(button_frame, text="閉じる", command=rename_window.destroy).pack(side="right", padx=5)
+
+def run_batch_processing(job_runner, api_key, max_size, resize_enabled, folder_entry, progress_var, status_label):
+    """「レシート一括処理開始」ボタンの処理（別スレッドで実行し、処理中に押した分は順番待ちになる）"""
+    folder = folder_entry.get()
+    if not folder or not os.path.isdir(folder):
+        messagebox.showerror("エラー", "フォルダを選択してください")
+        return
+
+    image_paths = list_image_files(folder)
+    if not image_paths:
+        messagebox.showinfo("情報", "フォルダ内に画像ファイルがありません")
+        return
+
+    try:
+        extractor = BatchExtractor.from_settings(api_key or get_gpt_openai_apikey(), get_settings_store().load(),
+                                                 max_size=max_size, resize_enabled=resize_enabled)
+    except Exception as e:
+        messagebox.showerror("エラー", str(e))
+        return
+
+    name = f"一括処理 {os.path.basename(os.path.normpath(folder))}"
+
+    def batch_job(context):
+        def on_progress(done, total, result):
+            # 別スレッドから呼ばれるので、画面は触らずにキュー経由で通知する
+            context.progress(done, total)
+            if not result.ok:
+                context.log(f"失敗: {result.filename}")
+        with tracing_session(tracing_options(get_settings_store().load()), os.path.join(folder, TRACE_NAME)):
+            return extractor.run(image_paths, progress_callback=on_progress, cancel_event=context.cancel_event)
+
+    def on_progress(done, total):
+        progress_var.set(int(done * 100 / total))
+        status_label.config(text=f"{name}: {done}/{total}件" + _queued_text(job_runner))
+
+    def on_log(text):
+        status_label.config(text=f"{name}: {text}" + _queued_text(job_runner))
+
+    def on_done(job):
+        status_label.config(text=_queued_text(job_runner).strip())
+        if job.error is not None:
+            messagebox.showerror("エラー", f"{name}でエラーが発生しました: {job.error}")
+            return
+        results = job.result
+        review_count = sum(1 for r in results if r.review_reason is not None)
+        error_count = sum(1 for r in results if not r.ok) - review_count
+        cached_count = sum(1 for r in results if r.cached or r.resumed)
+        duplicate_count = sum(1 for r in results if r.duplicate_of)
+        saved_mb = sum(r.bytes_saved for r in results) / (1024 * 1024)
+        title = "中止" if job.cancel_event.is_set() else "完了"
+        messagebox.showinfo(title, f"{name}: 処理が{title}しました\n成功: {len(results) - error_count - review_count}件（うち前回の結果を利用: {cached_count}件、同じ画像の結果を利用: {duplicate_count}件）\n失敗: {error_count}件\n要確認（画質チェックで除外）: {review_count}件\n"
+                            f"縮小で削減した送信量: {saved_mb:.1f}MB\n{format_saved_calls(results)}" + _cost_text(extractor.last_report))
+
+    if job_runner.active_jobs():
+        status_label.config(text=f"{name}: 順番待ち")
+    else:
+        progress_var.set(0)
+    job_runner.submit(name, batch_job, on_progress, on_log, on_done)
+
+def _cost_text(report) -> str:
+    """実行レポートの料金の表示"""
+    if not report:
+        return ""
+    return f"\n料金の目安: {report['cost']['yen']:.1f}円（1枚あたり{report['cost']['yen_per_image'] or 0:.2f}円）"
+
+def _queued_text(job_runner) -> str:
+    """待機中のジョブの件数の表示"""
+    waiting = sum(1 for job in job_runner.active_jobs() if job.status == QUEUED)
+    return f"（ほかに{waiting}件待ち）" if waiting else ""
+
+def cancel_jobs(job_runner, status_label):
+    """「中止」ボタンの処理（実行中と順番待ちのジョブをすべて止める）"""
+    if not job_runner.active_jobs():
+        return
+    job_runner.cancel_all()
+    status_label.config(text="中止しています...")
+
+_folder_watcher = None
+
+def toggle_folder_watch(api_key, max_size, resize_enabled, folder_entry, watch_button, status_label, root):
+    """「フォルダ監視」ボタンの処理（押すたびに監視の開始と停止を切り替える）"""
+    global _folder_watcher
+    if _folder_watcher is not None:
+        _folder_watcher.stop()
+        _folder_watcher = None
+        watch_button.config(text="フォルダ監視開始")
+        status_label.config(text="")
+        return
+
+    folder = folder_entry.get()
+    if not folder or not os.path.isdir(folder):
+        messagebox.showerror("エラー", "フォルダを選択してください")
+        return
+
+    try:
+        extractor = BatchExtractor.from_settings(api_key or get_gpt_openai_apikey(), get_settings_store().load(),
+                                                 max_size=max_size, resize_enabled=resize_enabled)
+    except Exception as e:
+        messagebox.showerror("エラー", str(e))
+        return
+
+    csv_path = os.path.join(folder, RESULT_CSV_NAME)
+    counts = {"success": 0, "error": 0}
+
+    def on_ready(paths):
+        # 監視スレッドから呼ばれるので、ここではUIを触らずに件数だけ更新する
+        for result in extractor.run_incremental(paths, csv_path):
+            counts["success" if result.ok else "error"] += 1
+
+    watcher = FolderWatcher(folder, on_ready)
+    watcher.start()
+    _folder_watcher = watcher
+    watch_button.config(text="フォルダ監視停止")
+
+    def refresh_status():
+        if _folder_watcher is not watcher:
+            return
+        status_label.config(text=f"監視中: 成功 {counts['success']}件 / 失敗 {counts['error']}件")
+        root.after(1000, refresh_status)
+
+    refresh_status()